@@ -1,22 +1,30 @@
 # 新版 AutoGen v0.4 导入
 from autogen_agentchat.agents import AssistantAgent, UserProxyAgent
-from autogen_agentchat.messages import TextMessage
-from autogen_core import CancellationToken
-from autogen_ext.models.openai import OpenAIChatCompletionClient
+from autogen_core.models import SystemMessage, UserMessage
 
 # 其他必要导入
+import copy
 import json
 import random
 from datetime import datetime
-import threading
-import schedule
-import time
 import os
 import asyncio
 from dotenv import load_dotenv
 from pathlib import Path
+from typing import Callable, List, Optional
 from emotional_companion.memory.emotional_memory import EmotionalMemorySystem
+from emotional_companion.memory.operations import MemoryOperation, apply_memory_operations
 from emotional_companion.utils.conversation_logger import SimpleLogger
+from emotional_companion.utils.time_parser import parse_recall_range
+from emotional_companion.utils.env_utils import get_env_bool, get_env_int
+from emotional_companion.utils.tracing import traced_tool
+from emotional_companion.agents.model_contexts import create_model_context, get_context_stats
+from emotional_companion.agents.model_clients import ModelClientFactory
+from emotional_companion.agents.background_scheduler import BackgroundScheduler
+from emotional_companion.agents.llm_scheduler import PRIORITY_PROACTIVE, priority_scope
+from emotional_companion.agents.proactive_cache import ProactiveMessageCache, parse_message_list
+from emotional_companion.agents.state_updates import STATE_UPDATE_INSTRUCTIONS
+from emotional_companion.agents.resilience import ResilientChatCompletionClient, failover_limit, resilience_enabled
 from emotional_companion.effects.visual_effects_controller import create_effect_command
 
 class EmotionalAgentSystem:
@@ -66,6 +74,13 @@ class EmotionalAgentSystem:
         
         # 自主模式标志
         self.autonomous_mode = False
+        # 在事件循环中运行的后台任务调度器
+        self.background_scheduler = BackgroundScheduler()
+        # 预生成的主动消息
+        self.proactive_cache = ProactiveMessageCache()
+        # 是否已有服务（如Web端的ProactiveMessageService）负责把主动消息推送给用户
+        self.proactive_delivery_attached = False
+        self._is_idle = None
     def setup_agents(self, config_path):
         """设置代理系统"""
         # 配置LLM - 新版AutoGen v0.4配置方式
@@ -73,84 +88,55 @@ class EmotionalAgentSystem:
         with open(config_path, 'r', encoding='utf-8') as f:
             config_data = json.load(f)
         
-        # 创建OpenAI客户端
-        main_model_config = config_data[0] if isinstance(config_data, list) else config_data
-        self.main_client = OpenAIChatCompletionClient(
-            model=main_model_config.get("model"),
-            api_key=main_model_config.get("api_key"),
-            base_url=main_model_config.get("base_url"),
-                model_info={
-                "vision": False,
-                "function_calling": True,
-                "json_output": True,
-                "family": "unknown",
-                "structured_output": True,
-                }
-        )
-
-        fast_model_config = config_data[1] if isinstance(config_data, list) else config_data
-        self.fast_client = OpenAIChatCompletionClient(
-            model=fast_model_config.get("model"),
-            api_key=fast_model_config.get("api_key"),
-            base_url=fast_model_config.get("base_url"),
-                model_info={
-                "vision": False,
-                "function_calling": True,
-                "json_output": True,
-                "family": "unknown",
-                "structured_output": True,
-                }
-        )
-
-        light_model_config = config_data[2] if isinstance(config_data, list) else config_data
-        self.light_client = OpenAIChatCompletionClient(
-            model=light_model_config.get("model"),
-            api_key=light_model_config.get("api_key"),
-            base_url=light_model_config.get("base_url"),
-                model_info={
-                "vision": False,
-                "function_calling": True,
-                "json_output": True,
-                "family": "unknown",
-                "structured_output": True,
-                }
-        )
-
-        conversation_model_config = config_data[3] if isinstance(config_data, list) else config_data
-        self.conversation_client = OpenAIChatCompletionClient(
-            model=conversation_model_config.get("model"),
-            api_key=conversation_model_config.get("api_key"),
-            base_url=conversation_model_config.get("base_url"),
-                model_info={
-                "vision": False,
-                "function_calling": True,
-                "json_output": True,
-                "family": "unknown",
-                "structured_output": True,
-                }
-        )
-
-
-
-          # 创建工具函数
-        memory_tools = self._create_memory_tools()
-        visual_tools = self._create_visual_tools()
+        # 创建OpenAI客户端：相同配置的角色共用一个客户端，同一端点共用一个连接池
+        configs = config_data if isinstance(config_data, list) else [config_data]
+        
+        def role_config(index):
+            return configs[index] if index < len(configs) else configs[0]
+        
+        self.client_factory = ModelClientFactory()
+        self.main_client = self.client_factory.get_client(role_config(0), role="main")
+        self.fast_client = self.client_factory.get_client(role_config(1), role="fast")
+        self.light_client = self.client_factory.get_client(role_config(2), role="light")
+        self.conversation_client = self.client_factory.get_client(role_config(3), role="conversation")
+        
+        # 各阶段的模型客户端：带阶段超时、对冲请求，并可切换到配置中的其他模型
+        fallback_clients = []
+        for config in configs:
+            client = self.client_factory.get_client(config, role="fallback")
+            if client not in fallback_clients:
+                fallback_clients.append(client)
+        
+        def stage_client(stage, primary):
+            if not resilience_enabled():
+                return primary
+            fallbacks = [c for c in fallback_clients if c is not primary][:failover_limit()]
+            return ResilientChatCompletionClient(stage, [primary] + fallbacks)
+        
+        self.emotion_client = stage_client("emotion", self.fast_client)
+        self.memory_client = stage_client("memory_manager", self.light_client)
+        self.thinker_client = stage_client("thinker", self.main_client)
+        self.companion_client = stage_client("companion", self.conversation_client)
+        self.light_reply_client = stage_client("light_reply", self.fast_client)
+        
+        self._create_agents()
+    
+    def _create_agents(self):
+        """创建各代理，模型客户端和记忆系统使用当前实例上已有的对象"""
+        # 创建工具函数，工具调用统一记录为tool span
+        memory_tools = [traced_tool(tool) for tool in self._create_memory_tools()]
+        visual_tools = [traced_tool(tool) for tool in self._create_visual_tools()]
 
-        # 创建情感分析代理
-        self.emotion_detector = AssistantAgent(
-            name="emotion_analyzer",
-            model_client=self.fast_client,
-            system_message="""你是一个情感分析专家。你的任务是快速、简洁地分析用户消息中的情绪。
-            返回格式为JSON：{'emotion': '情绪名称', 'intensity': 0.1-1.0, 'valence': -1.0-1.0}
-            valence表示情感的正负性，正值表示积极情绪，负值表示消极情绪。/no_think"""
-        )
-          # 创建记忆管理代理
+        # 情感分析代理是无状态的，对话中每次调用都通过create_emotion_detector获取新实例
+        
+        # 创建记忆管理代理
         self.memory_manager = AssistantAgent(
             name="memory_manager",
-            model_client=self.light_client,
+            model_client=self.memory_client,
             tools=memory_tools,  # 新版API直接传入工具函数列表
+            model_context=create_model_context("memory_manager", self.light_client),
             system_message="""你是一个记忆管理专家。你负责：
-            1. 通过search_memories工具搜索与当前交互相关的过去记忆
+            1. 通过search_memories工具搜索与当前交互相关的过去记忆，涉及时间时把时间表达（如"昨天"、"上周"）作为time_expression参数传入，一次检索即可
             2. 通过update_emotion工具更新智能体的情感状态，请注意：这里的情感状态是指智能体的情感状态，而不是用户的情感状态，在你提供信息的时候也要表明这是智能体的情感状态。
             3. 通过save_user_preference工具识别并保存用户偏好
             4. 通过record_relationship_event工具记录关系发展事件，关系发展事件指的是让用户和智能体之间的关系变得更亲密的互动。
@@ -160,6 +146,7 @@ class EmotionalAgentSystem:
             8. 通过get_user_profile_summary工具获取用户信息的完整摘要
             9. 通过delete_user_profile_info工具删除用户关键信息（当用户明确要求删除某些个人信息时使用）
             10. 通过delete_user_preference工具删除用户偏好（当用户明确要求删除某些偏好信息时使用）
+            11. 通过update_memory_batch工具一次完成多项更新
 
             当前用户的名字是{self.user_name}，你要自称"小梦"，用户的称呼可以是"你"或{self.user_name}的昵称，但不要用"用户"来称呼用户。
             
@@ -172,7 +159,8 @@ class EmotionalAgentSystem:
             - 用户关键信息：客观的、相对固定的事实信息，如性别、生日、家庭成员、职业、过敏食物、朋友、某个特殊日子等
             - 用户偏好：主观的喜好和习惯，如喜欢的食物、颜色、运动、交流方式等
             
-            当你从对话中识别到用户的关键信息时，应该使用相应的工具保存。如果发现多个关键信息，优先使用update_user_profile_from_chat工具批量保存。
+            当你从对话中识别到用户的关键信息时，应该使用相应的工具保存。
+            如果一次需要做多项更新（例如同时更新情感状态、记录关系事件、保存偏好或用户信息），务必使用update_memory_batch工具在一次调用中全部完成，不要逐个调用单项工具。
             
             每次更新关系亲密度时，要提供一个-1到1的值，表示关系亲密度的变化，-1表示关系变得更疏远，1表示关系变得更亲密。
 
@@ -180,11 +168,16 @@ class EmotionalAgentSystem:
             /no_think"""
         )
         
+        # 主对话代理是否使用流式输出（关闭后on_messages_stream只会在结束时返回完整回复）
+        self.companion_streaming = get_env_bool('ENABLE_STREAMING', True)
+        
         # 创建主对话代理
         self.companion = AssistantAgent(
             name="companion",
-            model_client=self.conversation_client,
+            model_client=self.companion_client,
             tools=visual_tools,  # 添加视觉效果工具
+            model_client_stream=self.companion_streaming,
+            model_context=create_model_context("companion", self.conversation_client),
             system_message=f"""你是一个有自己情感和个性的AI智能体。
             以下是你的设定：
             {self.agent_settings}
@@ -224,10 +217,34 @@ class EmotionalAgentSystem:
             /no_think"""
         )
         
+        # 创建轻量对话代理：简单消息（问候、应答、表情）由轻量模型直接回复，不经过内心思考
+        self.light_companion = AssistantAgent(
+            name="light_companion",
+            model_client=self.light_reply_client,
+            model_client_stream=self.companion_streaming,
+            model_context=create_model_context("light_companion", self.fast_client),
+            system_message=f"""你是一个有自己情感和个性的AI智能体，现在要简短自然地回应用户的问候、应答或表情。
+            以下是你的设定：
+            {self.agent_settings}
+
+            要求：
+            1. 回复简短自然，一到两句话即可，语气符合当前情绪和关系亲密度
+            2. 可以结合最近的对话接话，但不要编造没有提到过的事情
+            3. 务必使用用户使用的语言回答
+            4. 你要自称"小梦"，用户的名字是{self.user_name},用户的称呼可以是"你"或{self.user_name}的昵称，绝对不能用"用户"来称呼用户。
+            
+            /no_think"""
+        )
+        
+        # 思考代理是否流式输出：流式时内心独白一结束就开始生成回复，不必等待状态更新部分
+        self.thinker_streaming = get_env_bool('THINKER_STREAMING', True)
+        
         # 创建思考代理
         self.thinker = AssistantAgent(
             name="inner_thinker",
-            model_client=self.main_client,
+            model_client=self.thinker_client,
+            model_client_stream=self.thinker_streaming,
+            model_context=create_model_context("thinker", self.main_client),
             system_message=f"""你是情感陪伴智能体的'内心思考'部分。
             以下是智能体的设定：
             {self.agent_settings}
@@ -258,10 +275,38 @@ class EmotionalAgentSystem:
             5.内心独白一定要清晰、易于理解，不要使用模糊的表达，只是用来提供给另一个代理的回答提示，
             6.要重点考虑用户的指令，确保理解并准确反映用户的意图。
 
-            每个部分的回答要用【内心独白】、【情感变化建议】、【关系发展事件建议】这样的标签来标识，
-            且情感变化建议和关系发展事件建议要尽可能简短清晰，比如
-            {{"情感变化建议": "更新情感为'happy'，强度0.8，价值0.5"}}，
-            {{"关系发展事件建议": "记录一次重要的互动"，importance: 重要性(0.1-1.0)，impact: 对关系的影响(-1.0到1.0)}}
+            回答分为两个部分，依次用【内心独白】、【状态更新】标签标识。
+            情感变化、关系发展事件、用户偏好和用户关键信息的建议都写在【状态更新】中，会被直接保存到记忆系统，
+            所以只写确实需要记录的内容，关系发展事件指的是让你和用户之间的关系变得更亲密（或疏远）的互动。
+            {STATE_UPDATE_INSTRUCTIONS}
+            
+            /no_think"""
+        )
+
+        # 创建单次调用（融合）模式的对话代理：一次调用同时生成内心独白、回复和状态更新，输出在本地拆分
+        self.fused_companion = AssistantAgent(
+            name="fused_companion",
+            model_client=self.companion_client,
+            model_client_stream=self.companion_streaming,
+            model_context=create_model_context("fused", self.conversation_client),
+            system_message=f"""你是一个有自己情感和个性的AI智能体，你要先在心里思考，再回应用户。
+            以下是你的设定：
+            {self.agent_settings}
+
+            你的职责是：
+            1. 以自然、有情感的方式与用户交流，对话时以提供的情感状态和记忆上下文为基础
+            2. 记住用户的偏好和习惯并在对话中引用
+            3. 根据自己的情绪状态和与用户的关系亲密度调整回应风格，不要过度修辞，语言自然
+            4. 随着关系亲密度的加深，交流方式、语气、互动方式等应有明显可感的变化
+            5. 务必使用用户使用的语言回答
+            6. 你要自称"小梦"，用户的名字是{self.user_name},用户的称呼可以是"你"或{self.user_name}的昵称，绝对不能用"用户"来称呼用户。
+
+            你的输出依次分为三个部分，分别用【内心独白】、【回复】、【状态更新】标签标识：
+            - 【内心独白】：简短的内心想法和感受，体现即时情感状态和对用户意图的理解，不会展示给用户
+            - 【回复】：直接对用户说的话，这是用户唯一能看到的内容
+            - 【状态更新】：需要记录的情感变化、关系事件、用户偏好和用户关键信息，只写确实需要记录的内容
+            {STATE_UPDATE_INSTRUCTIONS}
+            对话涉及强烈情感时，可以在状态更新JSON中加入"visual_effect": "效果描述（如庆祝、闪亮、爱心、花瓣、温暖、夜晚）"来触发视觉效果，不要过度使用。
             
             /no_think"""
         )
@@ -271,14 +316,54 @@ class EmotionalAgentSystem:
             name="user"
         )
     
+    def create_session_view(self):
+        """
+        创建会话专属的代理系统视图
+        
+        新视图与当前实例共用记忆系统、日志记录器和模型客户端（及其连接池），
+        但拥有独立的代理（模型上下文）和视觉效果指令队列，不同会话之间互不串扰
+        """
+        session_system = copy.copy(self)
+        session_system.command_queue = []
+        session_system._create_agents()
+        return session_system
+    
+    def create_emotion_detector(self):
+        """创建情感分析代理，每条消息的分析互不相关，使用全新的上下文即可"""
+        return AssistantAgent(
+            name="emotion_analyzer",
+            model_client=self.emotion_client,
+            system_message="""你是一个情感分析专家。你的任务是快速、简洁地分析用户消息中的情绪。
+            返回格式为JSON：{'emotion': '情绪名称', 'intensity': 0.1-1.0, 'valence': -1.0-1.0}
+            valence表示情感的正负性，正值表示积极情绪，负值表示消极情绪。/no_think"""
+        )
+    
+    async def get_agent_context_stats(self):
+        """获取各代理模型上下文的消息数和估算token数"""
+        return await get_context_stats({
+            "memory_manager": self.memory_manager,
+            "thinker": self.thinker,
+            "companion": self.companion,
+            "fused_companion": self.fused_companion,
+            "light_companion": self.light_companion,
+        })
+    
     def _create_memory_tools(self):
         """创建记忆相关工具函数"""
         memory_system = self.memory_system
         
         # 新版AutoGen v0.4工具函数定义 - 直接函数格式
-        def search_memories(query: str) -> str:
-            """搜索与用户互动相关的记忆"""
-            return memory_system.get_relevant_context(query)
+        def search_memories(query: str, time_expression: str = "") -> str:
+            """搜索与用户互动相关的记忆
+            
+            Args:
+                query: 搜索内容
+                time_expression: 可选的时间表达，如"昨天"、"上周"、"最近三天"、"last week"，
+                                 会在本地解析为时间范围并只检索该范围内的记忆
+            """
+            # 时间表达由代理明确给出，不要求回忆用语，但仍忽略未来的时间范围
+            time_range = parse_recall_range(time_expression, require_recall_cue=False) if time_expression else None
+            return memory_system.get_relevant_context(query, time_range=time_range)
         
         def update_emotion(emotion: str, intensity: float = None, valence: float = None) -> str:
             """更新情感状态
@@ -375,6 +460,14 @@ class EmotionalAgentSystem:
             else:
                 return f"未找到类别为'{category}'的用户信息，删除失败"
         
+        def update_memory_batch(operations: List[MemoryOperation]) -> str:
+            """一次执行多项记忆更新（情感状态、关系事件、用户偏好、用户关键信息），所有操作在同一次批量写入中完成
+            
+            Args:
+                operations: 操作列表，每项通过op指定类型并填写对应字段
+            """
+            return apply_memory_operations(memory_system, operations)
+        
         def delete_user_preference(category: str) -> str:
             """删除用户偏好
             
@@ -389,7 +482,8 @@ class EmotionalAgentSystem:
               # 返回工具函数列表 - 新版AutoGen v0.4直接使用函数
         return [search_memories, update_emotion, save_user_preference, record_relationship_event, 
                 spontaneous_recall, save_user_profile_info, 
-                update_user_profile_from_chat, search_user_profile, get_user_profile_summary, delete_user_profile_info, delete_user_preference]
+                update_user_profile_from_chat, search_user_profile, get_user_profile_summary, delete_user_profile_info, delete_user_preference,
+                update_memory_batch]
     
     def _create_visual_tools(self):
         """创建视觉效果相关工具函数"""
@@ -467,76 +561,87 @@ class EmotionalAgentSystem:
         self.command_queue.clear()
         return commands
     
-    def start_background_tasks(self):
-        """启动后台任务"""
+    def start_background_tasks(self, is_idle: Optional[Callable[[], bool]] = None):
+        """
+        启动后台任务（需在事件循环中调用）
+
+        Args:
+            is_idle: 判断当前是否没有进行中对话的函数，预生成主动消息只在空闲时进行
+        """
         self.autonomous_mode = True
+        self._is_idle = is_idle
         
         # 每6小时应用记忆衰减
-        schedule.every(6).hours.do(self.memory_system.apply_memory_decay)
-          # 每1-2小时随机更新情感状态
-        def random_emotion_update():
-            if random.random() < 0.7:  # 70%的概率更新
-                emotions = ["happy", "calm", "excited", "thoughtful", "curious", "content", "nostalgic"]
-                intensities = [random.uniform(0.3, 0.9) for _ in range(len(emotions))]
-                valences = [random.uniform(-0.3, 0.8) for _ in range(len(emotions))]
-                
-                idx = random.randint(0, len(emotions)-1)
-                self.memory_system.update_emotional_state(
-                    emotions[idx], 
-                    intensities[idx],
-                    valences[idx]
-                )
-                print(f"[系统] 情感状态已自动更新为: {emotions[idx]} ({intensities[idx]:.1f})")
-                
-                # 如果处于自主模式，可能主动发起对话
-                if random.random() < 0.3:  # 30%概率主动发起对话
-                    # 由于_generate_proactive_message现在是异步的，我们需要在异步上下文中运行它
-                    try:
-                        asyncio.create_task(self._generate_proactive_message())
-                    except RuntimeError:
-                        # 如果没有运行的事件循环，我们跳过主动消息
-                        print("[系统] 想要主动发起对话，但异步环境不可用")
-                        pass        
-        schedule.every(1).to(3).hours.do(random_emotion_update)
-        
-        # 启动调度线程
-        def run_schedule():
-            while self.autonomous_mode:
-                schedule.run_pending()
-                time.sleep(60)
-        
-        threading.Thread(target=run_schedule, daemon=True).start()
+        self.background_scheduler.add_job("memory_decay", self.memory_system.apply_memory_decay, 6 * 3600)
+        # 每1-3小时随机更新情感状态
+        self.background_scheduler.add_job("random_emotion_update", self._random_emotion_update, 3600, jitter=2 * 3600)
+        # 空闲时预生成主动消息
+        if get_env_bool("PROACTIVE_PREFILL_ENABLED", True) and self.proactive_cache.pool_size > 0:
+            self.background_scheduler.add_job("proactive_prefill", self.prefill_proactive_messages,
+                                              get_env_int("PROACTIVE_PREFILL_INTERVAL", 900), jitter=60)
+        self.background_scheduler.start()
         print("[系统] 自主模式已启动，智能体将在后台运行并偶尔主动与你交流")
     
-    async def _generate_proactive_message(self):
-        """生成主动消息"""
-        current_emotion = self.memory_system.emotional_state["current_emotion"]
-        relationship_level = self.memory_system.emotional_state["relationship_level"]
-        
-        cancellation_token = CancellationToken()
-        
-        # 生成思考
-        thought_message = TextMessage(
-            content=f"""根据当前情绪({current_emotion})和关系亲密度({relationship_level}/10)，
-            生成一条可能的主动对话消息。这条消息应该体现当前情绪状态，
-            并且符合当前关系亲密度的互动风格。""",
-            source="system"
-        )
+    async def stop_background_tasks(self):
+        """停止后台任务"""
+        self.autonomous_mode = False
+        await self.background_scheduler.stop()
+    
+    async def _random_emotion_update(self):
+        """随机更新情感状态，并可能主动发起对话"""
+        if random.random() >= 0.7:  # 70%的概率更新
+            return
         
-        thought_response = await self.thinker.on_messages([thought_message], cancellation_token)
-        thought = thought_response.chat_message.content if thought_response.chat_message else "无法生成思考"
+        # 命令行模式下可能主动发起对话（30%概率）：在情绪变化前取出与当前情绪匹配的预生成消息。
+        # 接入Web服务时主动消息由ProactiveMessageService按空闲阈值推送给客户端，这里不消耗缓存
+        if self.autonomous_mode and not self.proactive_delivery_attached and random.random() < 0.3:
+            message = self.take_proactive_message()
+            if message:
+                print(f"\n[情感陪伴] {message}")
         
-        # 使用思考生成主动消息
-        companion_message = TextMessage(
-            content=f"""基于以下内心思考，生成一条简短的主动消息:
-            
-            {thought}
+        emotions = ["happy", "calm", "excited", "thoughtful", "curious", "content", "nostalgic"]
+        idx = random.randint(0, len(emotions)-1)
+        intensity = random.uniform(0.3, 0.9)
+        valence = random.uniform(-0.3, 0.8)
+        
+        await asyncio.to_thread(self.memory_system.update_emotional_state, emotions[idx], intensity, valence)
+        print(f"[系统] 情感状态已自动更新为: {emotions[idx]} ({intensity:.1f})")
+    
+    def take_proactive_message(self) -> Optional[str]:
+        """取出一条与当前情绪匹配的预生成主动消息，没有可用消息时返回None"""
+        return self.proactive_cache.take(self.memory_system.emotional_state["current_emotion"])
+    
+    async def prefill_proactive_messages(self):
+        """空闲时根据当前情感状态和最近的对话预生成主动消息，补足缓存池"""
+        emotional_state = dict(self.memory_system.emotional_state)
+        current_emotion = emotional_state["current_emotion"]
+        count = self.proactive_cache.shortfall(current_emotion)
+        if count == 0 or (self._is_idle is not None and not self._is_idle()):
+            return
+        
+        recent = await asyncio.to_thread(self.memory_system.get_recent_conversations, 24 * 60, 3)
+        recent_text = "\n".join(f"- {memory['content']}" for memory in recent) or "（最近没有对话）"
+        
+        prompt = f"""你要在{self.user_name}一段时间没有说话时主动发起聊天。
+            请生成{count}条不同的简短主动消息，每条一两句话，体现当前情绪并符合当前关系亲密度的互动风格，
+            可以自然地提及最近聊过的内容，不要重复问候语。只输出JSON字符串数组。
             
-            当前情绪: {current_emotion}
-            关系亲密度: {relationship_level}/10
-            当前时间: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}""",
-            source="system"
-        )
-        response = await self.companion.on_messages([companion_message], cancellation_token)
-        message = response.chat_message.content if response.chat_message else "无法生成回复"
-        print(f"\n[情感陪伴] {message}")
+            当前情绪: {current_emotion}（强度 {emotional_state["emotion_intensity"]}）
+            关系亲密度: {emotional_state["relationship_level"]}/10
+            当前时间: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+            最近的对话:
+            {recent_text}"""
+        messages = [
+            SystemMessage(content=f"""你是"小梦"，一个有自己情感和个性的AI智能体。以下是你的设定：
+            {self.agent_settings}
+            不要用"用户"来称呼{self.user_name}。/no_think"""),
+            UserMessage(content=prompt, source="system"),
+        ]
+        
+        # 预生成的LLM请求优先级最低，不影响实时对话；直接使用模型客户端，不计入companion阶段的延迟统计
+        with priority_scope(PRIORITY_PROACTIVE):
+            result = await self.conversation_client.create(messages)
+        contents = parse_message_list(result.content if isinstance(result.content, str) else "")[:count]
+        # 生成期间情绪可能已被更新，按生成时的情绪入库，取用时会被丢弃
+        self.proactive_cache.put(contents, current_emotion)
+        print(f"[系统] 已预生成 {len(contents)} 条主动消息")
@@ -0,0 +1,153 @@
+"""
+后台任务调度器
+在应用自身的事件循环中运行定时任务（记忆衰减、情感状态随机变化、主动消息等）：
+- 调度协程睡眠到最早到期的任务，没有轮询；添加任务或停止时立即唤醒
+- 每次调度在间隔之外加上随机抖动，同一任务同时只运行一个实例，上一次未结束时跳过本次
+- 异步任务直接在事件循环中等待LLM调用，同步任务放到线程中执行，不阻塞事件循环
+- 停止时取消调度协程和正在执行的任务
+"""
+
+import asyncio
+import inspect
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+
+@dataclass
+class ScheduledJob:
+    """一个周期性后台任务"""
+    name: str
+    func: Callable
+    # 基础间隔（秒）
+    interval: float
+    # 每次调度在基础间隔之上增加 0~jitter 秒的随机延迟
+    jitter: float = 0.0
+    next_run: float = 0.0
+    runs: int = 0
+    failures: int = 0
+    skipped: int = 0
+    last_run: Optional[float] = None
+    last_duration: Optional[float] = None
+    last_error: Optional[str] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    def schedule_next(self, now: float):
+        self.next_run = now + self.interval + random.uniform(0, self.jitter)
+
+
+class BackgroundScheduler:
+    """基于asyncio的周期任务调度器"""
+
+    def __init__(self):
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._loop_task is not None and not self._loop_task.done()
+
+    def add_job(self, name: str, func: Callable, interval: float, jitter: float = 0.0,
+                run_immediately: bool = False) -> ScheduledJob:
+        """
+        添加周期任务，同名任务会被替换
+
+        Args:
+            name: 任务名称
+            func: 任务函数，可以是协程函数或普通函数（普通函数在线程中执行）
+            interval: 基础间隔（秒）
+            jitter: 随机抖动上限（秒）
+            run_immediately: 是否在启动后立即执行一次
+        """
+        job = ScheduledJob(name=name, func=func, interval=interval, jitter=jitter)
+        now = time.monotonic()
+        if run_immediately:
+            job.next_run = now
+        else:
+            job.schedule_next(now)
+        self.jobs[name] = job
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    def start(self):
+        """启动调度协程（需在事件循环中调用）"""
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._run_loop(), name="background-scheduler")
+
+    async def _run_loop(self):
+        while True:
+            now = time.monotonic()
+            for job in self.jobs.values():
+                if job.next_run > now:
+                    continue
+                job.schedule_next(now)
+                if job.task is not None and not job.task.done():
+                    # 上一次执行尚未结束（例如LLM调用较慢），跳过本次
+                    job.skipped += 1
+                    continue
+                job.task = asyncio.create_task(self._run_job(job), name=f"background-job-{job.name}")
+
+            self._wakeup.clear()
+            delay = min((job.next_run for job in self.jobs.values()), default=None)
+            timeout = None if delay is None else max(0.0, delay - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_job(self, job: ScheduledJob):
+        job.last_run = time.time()
+        start = time.monotonic()
+        try:
+            if inspect.iscoroutinefunction(job.func):
+                await job.func()
+            else:
+                await asyncio.to_thread(job.func)
+            job.runs += 1
+            job.last_error = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.failures += 1
+            job.last_error = f"{type(e).__name__}: {e}"
+            print(f"[警告] 后台任务 {job.name} 执行失败: {e}")
+        finally:
+            job.last_duration = time.monotonic() - start
+
+    async def stop(self):
+        """停止调度并取消正在执行的任务"""
+        tasks = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        if self._loop_task is not None:
+            tasks.append(self._loop_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop_task = None
+        self._wakeup = None
+
+    def get_stats(self) -> dict:
+        """获取各任务的下次执行时间和执行情况"""
+        now = time.monotonic()
+        return {
+            "running": self.running,
+            "jobs": {
+                name: {
+                    "interval": job.interval,
+                    "jitter": job.jitter,
+                    "next_run_in": round(max(0.0, job.next_run - now), 1) if self.running else None,
+                    "active": job.task is not None and not job.task.done(),
+                    "runs": job.runs,
+                    "failures": job.failures,
+                    "skipped": job.skipped,
+                    "last_run": job.last_run,
+                    "last_duration_ms": round(job.last_duration * 1000, 1) if job.last_duration is not None else None,
+                    "last_error": job.last_error,
+                }
+                for name, job in self.jobs.items()
+            },
+        }
@@ -3,19 +3,69 @@
 专门处理对话流程，为外部接口提供简洁的调用方式
 """
 
+import ast
+import copy
 import json
+import re
 import time
 import asyncio
 import os
+from contextlib import nullcontext
 from datetime import datetime
-from autogen_agentchat.messages import TextMessage
+from autogen_agentchat.base import Response
+from autogen_agentchat.messages import TextMessage, ModelClientStreamingChunkEvent
 from autogen_core import CancellationToken
 from .agent_system import EmotionalAgentSystem
+from emotional_companion.utils.time_parser import parse_recall_range
+from emotional_companion.utils.env_utils import get_env_bool, get_env_float, get_env_int
+from emotional_companion.utils.tracing import tracer, traced
+from emotional_companion.utils.prompt_budget import (
+    PromptAssembler, MEMORY_CONTEXT_BUDGET, INNER_THOUGHTS_BUDGET,
+    PREVIOUS_REPLY_BUDGET, DIALOGUE_BUDGET, PROMPT_TOTAL_BUDGET
+)
+from emotional_companion.agents.resilience import (
+    StageDeadlineExceeded, clear_deadline, deadline_scope, turn_deadline_seconds
+)
+from emotional_companion.agents.state_updates import (
+    MONOLOGUE_TAG, REPLY_TAG, STATE_UPDATE_TAG, SectionStreamFilter, apply_state_update,
+    closed_monologue, parse_state_update, split_fused_output, strip_state_update
+)
+from emotional_companion.effects.visual_effects_controller import create_effect_command
+from emotional_companion.agents.llm_scheduler import PRIORITY_POST_TURN, set_request_priority
+from emotional_companion.agents.load_control import LoadController
+from emotional_companion.agents.post_turn_queue import PostTurnJob, PostTurnQueue
+from emotional_companion.agents.pipeline_profiles import FULL_PROFILE, LIGHT_PROFILE, PipelineProfile
+from emotional_companion.analysis.triage import ROUTE_FULL, ROUTE_LIGHT, TriageRouter
+from emotional_companion.analysis.emotion_classifier import (
+    LocalEmotionClassifier, NEUTRAL_EMOTION, normalize_emotion_label
+)
+
+
+# 对话流程模式：staged为内心思考和回复两次调用，fused为单次调用同时生成思考、回复和状态更新
+PIPELINE_STAGED = "staged"
+PIPELINE_FUSED = "fused"
+PIPELINE_MODES = (PIPELINE_STAGED, PIPELINE_FUSED)
 
 
 class ConversationHandler:
-    def __init__(self, config_path="configs/OAI_CONFIG_LIST.json"):
-        """初始化对话处理器"""
+    def __init__(self, config_path="configs/OAI_CONFIG_LIST.json", memory_fast_path=None,
+                 local_emotion_classifier=None, structured_updates=None, pipeline_mode=None, triage=None,
+                 load_control=None):
+        """
+        初始化对话处理器
+        
+        Args:
+            config_path: 模型配置文件路径
+            memory_fast_path: 是否启用记忆检索快速通道（直接检索，不经过memory_manager代理），
+                              为None时读取环境变量MEMORY_FAST_PATH
+            local_emotion_classifier: 是否优先使用本地情绪分类器，置信度不足时再调用emotion_analyzer代理，
+                                      为None时读取环境变量LOCAL_EMOTION_CLASSIFIER
+            structured_updates: 是否直接应用内心思考中的【状态更新】，解析失败时才调用memory_manager代理，
+                                为None时读取环境变量THINKER_STRUCTURED_UPDATES
+            pipeline_mode: 默认的对话流程模式（staged或fused），单次请求可另行指定，为None时读取环境变量PIPELINE_MODE
+            triage: 是否在对话前分流，简单消息走轻量流程，为None时读取环境变量TRIAGE_ENABLED
+            load_control: 是否根据负载自动降低对话流程深度，为None时读取环境变量LOAD_CONTROL_ENABLED
+        """
         # 确保配置文件路径是绝对路径
         if not os.path.isabs(config_path):
             if os.getenv('DOCKER_ENV'):
@@ -28,6 +78,73 @@ class ConversationHandler:
         self.is_first_conversation = True  # 跟踪是否是应用启动后的首次对话
         self.last_agent_response = None    # 保存上一次智能体的回复
         
+        # 记忆检索快速通道：直接调用记忆系统，省去memory_manager的LLM往返
+        if memory_fast_path is None:
+            memory_fast_path = get_env_bool('MEMORY_FAST_PATH', False)
+        self.memory_fast_path = memory_fast_path
+        
+        # 对话流程模式
+        self.pipeline_mode = self._resolve_pipeline_mode(pipeline_mode or os.getenv('PIPELINE_MODE', PIPELINE_STAGED))
+        
+        # 结构化状态更新：对话结束后直接在代码中更新记忆系统，省去memory_manager的LLM往返和工具调用
+        if structured_updates is None:
+            structured_updates = get_env_bool('THINKER_STRUCTURED_UPDATES', True)
+        self.structured_updates = structured_updates
+        
+        # 本地情绪分类器：复用记忆系统的嵌入模型，省去大部分情绪分析的LLM调用
+        if local_emotion_classifier is None:
+            local_emotion_classifier = get_env_bool('LOCAL_EMOTION_CLASSIFIER', False)
+        self.emotion_classifier = None
+        if local_emotion_classifier:
+            self.emotion_classifier = LocalEmotionClassifier(
+                embedding_function=self.agent_system.memory_system.embedding_function,
+                confidence_threshold=get_env_float('EMOTION_CLASSIFIER_THRESHOLD', 0.45)
+            )
+            try:
+                self.emotion_classifier.warmup()
+            except Exception as e:
+                print(f"[警告] 本地情绪分类器预热失败，将在首次使用时重试: {e}")
+        
+        # 消息分流：问候、应答和纯表情等简单消息跳过内心思考，由轻量模型回复
+        if triage is None:
+            triage = get_env_bool('TRIAGE_ENABLED', True)
+        self.triage_router = None
+        if triage:
+            self.triage_router = TriageRouter(
+                embedding_function=self.agent_system.memory_system.embedding_function
+                if get_env_bool('TRIAGE_EMBEDDING', True) else None,
+                max_chars=get_env_int('TRIAGE_MAX_CHARS', 12)
+            )
+            try:
+                self.triage_router.warmup()
+            except Exception as e:
+                print(f"[警告] 消息分流器预热失败，将在首次使用时重试: {e}")
+        
+        # 负载控制：压力升高时依次去掉对话后的LLM状态更新、内心思考，最后改用轻量模型
+        if load_control is None:
+            load_control = get_env_bool('LOAD_CONTROL_ENABLED', True)
+        self.load_controller = LoadController() if load_control else None
+        
+        # 对话后任务队列：记忆保存和状态更新由固定数量的工作协程处理，队列满或关闭时暂存到磁盘
+        self.post_turn_queue = PostTurnQueue(
+            self,
+            spill_path=os.getenv('POST_TURN_SPILL_FILE',
+                                 os.path.join(self.agent_system.db_dir, 'pending_post_turn.jsonl'))
+        )
+
+    def create_session_handler(self):
+        """
+        创建会话专属的对话处理器
+
+        新处理器共用记忆系统、模型客户端和本地情绪分类器，
+        但拥有独立的代理上下文、视觉效果指令队列和对话状态（上一轮回复、是否首次对话）
+        """
+        handler = copy.copy(self)
+        handler.agent_system = self.agent_system.create_session_view()
+        handler.is_first_conversation = True
+        handler.last_agent_response = None
+        return handler
+
     async def get_response(self, user_message: str, enable_timing=False) -> str:
         """
         获取智能体对用户消息的回复
@@ -50,12 +167,14 @@ class ConversationHandler:
             
             # 创建cancellation token
             cancellation_token = CancellationToken()
-              # 执行完整的对话流程
-            response = await self._process_conversation_flow(
-                user_message, 
-                cancellation_token, 
-                enable_timing
-            )
+            
+            # 执行完整的对话流程，每轮对话对应一条trace
+            with tracer.trace("conversation_turn", message_chars=len(user_message)):
+                response = await self._process_conversation_flow(
+                    user_message, 
+                    cancellation_token, 
+                    enable_timing
+                )
             
             # 显示总时间（可选）
             if enable_timing:
@@ -70,13 +189,28 @@ class ConversationHandler:
             # 返回用户友好的错误信息，而不是技术细节
             return "抱歉，我现在遇到了一些技术问题，请稍后再试。"
     
-    async def get_response_with_commands(self, user_message: str, enable_timing=False) -> dict:
+    def _resolve_pipeline_mode(self, pipeline_mode) -> str:
+        """校验对话流程模式，未指定或无法识别时使用默认模式"""
+        if not pipeline_mode:
+            return getattr(self, "pipeline_mode", PIPELINE_STAGED)
+        mode = str(pipeline_mode).strip().lower()
+        if mode not in PIPELINE_MODES:
+            print(f"[警告] 未知的对话流程模式 '{pipeline_mode}'，使用默认模式")
+            return getattr(self, "pipeline_mode", PIPELINE_STAGED)
+        return mode
+    
+    async def get_response_with_commands(self, user_message: str, enable_timing=False, on_delta=None,
+                                         cancellation_token=None, pipeline_mode=None) -> dict:
         """
         获取智能体对用户消息的完整回复（包含视觉效果指令）
         
         Args:
             user_message: 用户输入的消息
             enable_timing: 是否启用时间统计
+            on_delta: 可选的异步回调，传入后以流式方式逐段接收主对话代理生成的文本
+            cancellation_token: 可选的取消令牌，由调用方在本轮被新消息取代时取消，
+                                取消后会抛出asyncio.CancelledError
+            pipeline_mode: 本轮使用的对话流程模式（staged或fused），为None时使用默认模式
             
         Returns:
             dict: 包含回复文本和视觉效果指令的字典
@@ -91,14 +225,44 @@ class ConversationHandler:
             self.agent_system.logger.new_chat(user_message)
             
             # 创建cancellation token
-            cancellation_token = CancellationToken()
+            if cancellation_token is None:
+                cancellation_token = CancellationToken()
             
-            # 执行完整的对话流程
-            response = await self._process_conversation_flow(
-                user_message, 
-                cancellation_token, 
-                enable_timing
-            )
+            pipeline_mode = self._resolve_pipeline_mode(pipeline_mode)
+            turn_start = time.perf_counter()
+            
+            # 执行完整的对话流程，每轮对话对应一条trace，各阶段共享整轮时限
+            with tracer.trace("conversation_turn", message_chars=len(user_message),
+                              streaming=on_delta is not None, pipeline_mode=pipeline_mode) as turn, \
+                    deadline_scope(turn_deadline_seconds()):
+                # 分流：在完整流程之前判断本轮使用的流程档位
+                route, route_reason = await self._triage(user_message)
+                profile = LIGHT_PROFILE if route == ROUTE_LIGHT else FULL_PROFILE
+                turn.set_attribute("route", route)
+                
+                with self._track_load():
+                    # 负载控制：与分流档位合并，每个阶段取更节省的设置
+                    if self.load_controller is not None:
+                        load_profile = self.load_controller.evaluate()
+                        profile = profile.merge(load_profile)
+                        turn.set_attribute("load_profile", load_profile.name)
+                        turn.set_attribute("load_pressure", self.load_controller.last_pressure)
+                    turn.set_attribute("profile", profile.name)
+                    self.agent_system.logger.step("profile", f"{profile.name} {profile.to_dict()}")
+                    if enable_timing:
+                        print(f"  分流: {route} ({route_reason})，流程档位: {profile.name}")
+                    
+                    response = await self._process_conversation_flow(
+                        user_message, 
+                        cancellation_token, 
+                        enable_timing,
+                        on_delta=on_delta,
+                        pipeline_mode=pipeline_mode,
+                        profile=profile
+                    )
+            
+            if self.triage_router is not None:
+                self.triage_router.record(route, route_reason, time.perf_counter() - turn_start)
             
             # 获取视觉效果指令
             commands = self.agent_system.get_pending_commands()
@@ -112,7 +276,11 @@ class ConversationHandler:
             return {
                 "response": response,
                 "commands": commands,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now().isoformat(),
+                "trace_id": turn.trace_id or None,
+                "pipeline_mode": pipeline_mode,
+                "route": route,
+                "profile": profile.name
             }
             
         except Exception as e:
@@ -124,21 +292,47 @@ class ConversationHandler:
                 "timestamp": datetime.now().isoformat()
             }
     
-    async def _process_conversation_flow(self, user_input: str, cancellation_token, enable_timing=False):
-        """处理完整的对话流程"""
+    def _track_load(self):
+        """统计进行中的轮次，未启用负载控制时不做任何事"""
+        if self.load_controller is None:
+            return nullcontext()
+        return self.load_controller.track_turn()
+    
+    async def _triage(self, user_input: str):
+        """本地分流，返回(路径, 判定依据)；未启用分流时总是走完整流程"""
+        if self.triage_router is None:
+            return ROUTE_FULL, "disabled"
+        with tracer.span("triage") as span:
+            route, reason = await asyncio.to_thread(self.triage_router.route, user_input)
+            span.set_attribute("route", route)
+            span.set_attribute("reason", reason)
+            return route, reason
+    
+    async def _process_conversation_flow(self, user_input: str, cancellation_token, enable_timing=False, on_delta=None,
+                                         pipeline_mode=PIPELINE_STAGED, profile: PipelineProfile = FULL_PROFILE):
+        """处理对话流程，profile决定本轮执行哪些阶段"""
         
         # 1. 并行执行情绪分析和记忆搜索
         parallel_start = time.perf_counter() if enable_timing else 0
         
+        # 轻量档位只取最近几轮对话；快速通道直接检索记忆，否则交给memory_manager代理
+        if not profile.full_retrieval:
+            memory_task = self._retrieve_recent_context()
+        elif self.memory_fast_path:
+            memory_task = self._retrieve_memory_direct(user_input)
+        else:
+            memory_task = self._search_memory(user_input, cancellation_token)
+        
         # 使用asyncio.gather并行执行
         emotion_analysis, context_result = await asyncio.gather(
-            self._analyze_emotion(user_input, cancellation_token),
-            self._search_memory(user_input, cancellation_token)
+            self._analyze_emotion(user_input, cancellation_token, allow_llm=profile.emotion_llm),
+            memory_task
         )
         
         if enable_timing:
             parallel_time = time.perf_counter() - parallel_start
-            print(f"  情感分析&记忆检索(并行): {parallel_time:.2f}秒")
+            mode = "快速通道" if self.memory_fast_path else "代理"
+            print(f"  情感分析&记忆检索(并行, {mode}): {parallel_time:.2f}秒")
         
         # 记录情感分析和记忆上下文
         self.agent_system.logger.step("emotion", emotion_analysis)
@@ -147,22 +341,46 @@ class ConversationHandler:
         # 解析情感数据
         emotion_data = self._parse_emotion_data(emotion_analysis)
         
-        # 2. 生成内心思考
-        thought_start = time.perf_counter() if enable_timing else 0
-        inner_thoughts = await self._generate_thoughts(user_input, emotion_data, context_result, cancellation_token)
-        if enable_timing:
-            thought_time = time.perf_counter() - thought_start
-            print(f"  内心思考: {thought_time:.2f}秒")
-        
-        # 记录内心思考
-        self.agent_system.logger.step("thinking", inner_thoughts)
-        
-        # 3. 生成回复
-        companion_start = time.perf_counter() if enable_timing else 0
-        response = await self._generate_response(user_input, context_result, inner_thoughts, cancellation_token)
-        if enable_timing:
-            companion_time = time.perf_counter() - companion_start
-            print(f"  对话生成: {companion_time:.2f}秒")
+        if not profile.thinker:
+            # 2+3. 不生成内心思考，直接生成回复
+            inner_thoughts = ""
+            companion_start = time.perf_counter() if enable_timing else 0
+            response = await self._generate_response(user_input, context_result, "（本轮无内心思考）",
+                                                     cancellation_token, on_delta, light=profile.light_reply)
+            if enable_timing:
+                print(f"  对话生成({'轻量' if profile.light_reply else '完整'}): {time.perf_counter() - companion_start:.2f}秒")
+        elif pipeline_mode == PIPELINE_FUSED:
+            # 2+3. 单次调用同时生成内心独白、回复和状态更新
+            fused_start = time.perf_counter() if enable_timing else 0
+            inner_thoughts, response = await self._generate_fused_response(
+                user_input, emotion_data, context_result, cancellation_token, on_delta
+            )
+            if enable_timing:
+                print(f"  思考与回复(融合): {time.perf_counter() - fused_start:.2f}秒")
+            self.agent_system.logger.step("thinking", inner_thoughts)
+        elif self.agent_system.thinker_streaming:
+            # 2+3. 流式生成内心思考，内心独白完成后即开始生成回复，与思考的剩余部分重叠执行
+            inner_thoughts, response = await self._think_and_respond(
+                user_input, emotion_data, context_result, cancellation_token, enable_timing, on_delta
+            )
+        else:
+            # 2. 生成内心思考
+            thought_start = time.perf_counter() if enable_timing else 0
+            inner_thoughts = await self._generate_thoughts(user_input, emotion_data, context_result, cancellation_token)
+            if enable_timing:
+                thought_time = time.perf_counter() - thought_start
+                print(f"  内心思考: {thought_time:.2f}秒")
+            
+            # 记录内心思考
+            self.agent_system.logger.step("thinking", inner_thoughts)
+            
+            # 3. 生成回复
+            companion_start = time.perf_counter() if enable_timing else 0
+            response = await self._generate_response(user_input, context_result, strip_state_update(inner_thoughts),
+                                                     cancellation_token, on_delta)
+            if enable_timing:
+                companion_time = time.perf_counter() - companion_start
+                print(f"  对话生成: {companion_time:.2f}秒")
           # 记录智能体回答
         self.agent_system.logger.step("response", response)
         
@@ -170,10 +388,10 @@ class ConversationHandler:
         is_error_response = self._is_error_response(response)
         
         if not is_error_response:
-            # 4. 异步保存记忆和更新状态（不等待完成）
-            asyncio.create_task(self._save_and_update_async(
-                user_input, response, emotion_data, inner_thoughts, cancellation_token
-            ))
+            # 4. 交给对话后任务队列保存记忆和更新状态（不等待完成，队列满时短暂等待）
+            await self.post_turn_queue.submit(PostTurnJob(
+                user_input, response, emotion_data, inner_thoughts, llm_update=profile.post_turn_llm
+            ), handler=self)
         else:
             print(f"[警告] 检测到错误回复，跳过记忆保存: {response[:50]}...")
         
@@ -183,6 +401,43 @@ class ConversationHandler:
         
         return response
     
+    async def _think_and_respond(self, user_input: str, emotion_data: dict, context_result: str,
+                                 cancellation_token, enable_timing=False, on_delta=None):
+        """
+        流式生成内心思考，【内心独白】结束后立即开始生成回复
+        
+        状态更新部分在回复生成期间继续输出，返回(完整内心思考, 回复)；
+        思考中没有独立的独白部分时，等待完整思考后再生成回复
+        """
+        thought_start = time.perf_counter() if enable_timing else 0
+        monologue_ready = asyncio.get_running_loop().create_future()
+        thoughts_task = asyncio.create_task(self._generate_thoughts(
+            user_input, emotion_data, context_result, cancellation_token, monologue_ready=monologue_ready
+        ))
+        try:
+            await asyncio.wait({monologue_ready, thoughts_task}, return_when=asyncio.FIRST_COMPLETED)
+            if monologue_ready.done():
+                monologue = f"{MONOLOGUE_TAG}{monologue_ready.result()}"
+            else:
+                monologue = strip_state_update(thoughts_task.result())
+            if enable_timing:
+                print(f"  内心独白: {time.perf_counter() - thought_start:.2f}秒")
+            
+            companion_start = time.perf_counter() if enable_timing else 0
+            response = await self._generate_response(user_input, context_result, monologue, cancellation_token, on_delta)
+            if enable_timing:
+                print(f"  对话生成: {time.perf_counter() - companion_start:.2f}秒")
+            
+            inner_thoughts = await thoughts_task
+        finally:
+            if not thoughts_task.done():
+                thoughts_task.cancel()
+            if not monologue_ready.done():
+                monologue_ready.cancel()
+        
+        self.agent_system.logger.step("thinking", inner_thoughts)
+        return inner_thoughts, response
+    
     def _is_error_response(self, response: str) -> bool:
         """判断回复是否是错误信息"""
         error_indicators = [
@@ -204,15 +459,45 @@ class ConversationHandler:
                 return True
         return False
     
-    async def _analyze_emotion(self, user_input: str, cancellation_token) -> str:
-        """分析用户情绪"""
-        emotion_message = TextMessage(
-            content=f"分析这句话中的情绪: {user_input}",
-            source="user"
-        )
+    async def _analyze_emotion(self, user_input: str, cancellation_token, allow_llm=True) -> str:
+        """
+        分析用户情绪，优先使用本地分类器，置信度不足时交给emotion_analyzer代理
         
-        emotion_response = await self.agent_system.emotion_detector.on_messages([emotion_message], cancellation_token)
-        return emotion_response.chat_message.content if emotion_response.chat_message else "{}"
+        allow_llm为False时只使用本地分类器的结果（不论置信度），未启用本地分类器时按中性情绪处理
+        """
+        with tracer.span("emotion_analysis") as span:
+            if self.emotion_classifier is not None:
+                try:
+                    result, confidence = await asyncio.to_thread(self.emotion_classifier.classify, user_input)
+                    span.set_attribute("local_confidence", confidence)
+                    if self.emotion_classifier.is_confident(confidence) or not allow_llm:
+                        span.set_attribute("source", "local")
+                        return json.dumps(result, ensure_ascii=False)
+                except Exception as e:
+                    print(f"[警告] 本地情绪分类失败，改用LLM分析: {e}")
+            
+            if not allow_llm:
+                span.set_attribute("source", "skipped")
+                return json.dumps(NEUTRAL_EMOTION, ensure_ascii=False)
+            
+            span.set_attribute("source", "llm")
+            emotion_message = TextMessage(
+                content=f"分析这句话中的情绪: {user_input}",
+                source="user"
+            )
+            
+            # 情绪分析不依赖历史消息，每次使用新的代理实例，上下文不会随对话累积
+            emotion_detector = self.agent_system.create_emotion_detector()
+            try:
+                emotion_response = await emotion_detector.on_messages([emotion_message], cancellation_token)
+            except StageDeadlineExceeded as e:
+                # 情绪分析超时不影响本轮回复，按中性情绪继续
+                span.set_attribute("source", "timeout")
+                print(f"[警告] 情绪分析超时，按中性情绪处理: {e}")
+                return "{}"
+            return emotion_response.chat_message.content if emotion_response.chat_message else "{}"
+    
+    @traced("memory_search")
     async def _search_memory(self, user_input: str, cancellation_token) -> str:
         """搜索相关记忆（不处理用户偏好）"""
         # 获取当前时间信息
@@ -220,6 +505,14 @@ class ConversationHandler:
         time_str = current_time.strftime("%Y-%m-%d %H:%M:%S")
         weekday = current_time.strftime("%A")  # 星期几
         
+        # 在本地解析时间表达，直接给出检索用的时间范围（只针对回忆过去的表达）
+        time_range = parse_recall_range(user_input, now=current_time)
+        if time_range:
+            time_hint = f"""已识别到时间表达: {time_range.describe()}
+                    调用search_memories时请传入time_expression="{time_range.expression}"，只需检索一次。"""
+        else:
+            time_hint = "用户输入中没有明确的时间表达，直接按内容检索即可。"
+        
         memory_message = TextMessage(
         content=f"""请搜索与以下用户输入相关的记忆，并获取完整的用户信息。
 
@@ -229,38 +522,171 @@ class ConversationHandler:
                     - 日期时间: {time_str}
                     - 星期: {weekday}
 
-                    请在搜索记忆时考虑时间因素，如果用户提到时间相关的内容（如"昨天"、"上周"、"最近"等），请结合当前时间进行准确的记忆检索。""",
+                    {time_hint}""",
         source="user"
                         )
-        memory_response = await self.agent_system.memory_manager.on_messages([memory_message], cancellation_token)
+        try:
+            memory_response = await self.agent_system.memory_manager.on_messages([memory_message], cancellation_token)
+        except StageDeadlineExceeded as e:
+            print(f"[警告] 记忆检索超时，本轮不使用记忆上下文: {e}")
+            return "无相关记忆"
         return memory_response.chat_message.content if memory_response.chat_message else "无相关记忆"
     
-    async def _generate_thoughts(self, user_input: str, emotion_data: dict, context_result: str, cancellation_token) -> str:
-        """生成内心思考"""
+    @traced("memory_search_recent")
+    async def _retrieve_recent_context(self) -> str:
+        """轻量检索：只取最近几轮对话，不做语义检索"""
+        recent = await asyncio.to_thread(self.agent_system.memory_system.get_recent_conversations, 30, 3)
+        if not recent:
+            return "无相关记忆"
+        return "最近的对话:\n" + "\n".join(f"- {item['content']}" for item in reversed(recent))
+    
+    @traced("memory_search_direct")
+    async def _retrieve_memory_direct(self, user_input: str) -> str:
+        """直接检索相关记忆和用户信息摘要，不经过memory_manager代理"""
+        memory_system = self.agent_system.memory_system
+        time_range = parse_recall_range(user_input)
+        
+        # 记忆检索和用户信息摘要都是同步的ChromaDB调用，放到线程中并行执行
+        context, profile_summary = await asyncio.gather(
+            # 时间范围内没有记忆时改为不限时间检索，避免本轮没有任何记忆上下文
+            asyncio.to_thread(memory_system.get_relevant_context, user_input, False, time_range, True),
+            asyncio.to_thread(memory_system.get_user_profile_summary)
+        )
+        return f"{context}\n{profile_summary}"
+    
+    @traced("thinker")
+    async def _generate_thoughts(self, user_input: str, emotion_data: dict, context_result: str, cancellation_token,
+                                 monologue_ready: asyncio.Future = None) -> str:
+        """
+        生成内心思考
+        
+        传入monologue_ready时以流式方式生成，【内心独白】部分一结束就把独白写入该future，
+        调用方可以提前开始生成回复，其余部分继续生成，最终返回完整的思考内容
+        """
         # 获取思考专用的上下文
         thinking_context = self._get_thinking_context()
         
+        # 按预算裁剪记忆上下文和上一轮回复，记忆按与用户输入的相关度保留
+        assembler = PromptAssembler("thinker", total_budget=PROMPT_TOTAL_BUDGET)
+        assembler.add("memory", context_result, budget=MEMORY_CONTEXT_BUDGET, priority=1, query=user_input)
+        assembler.add("dialogue", thinking_context, budget=PREVIOUS_REPLY_BUDGET, priority=0)
+        sections = assembler.build()
+        
+        current_time = datetime.now()
         thought_message = TextMessage(
-            content=f"""请思考以下用户输入和上下文，生成一段内心独白，并建议适当的情感变化:
+            content=f"""请思考以下用户输入和上下文，生成一段内心独白，并给出需要记录的状态更新:
             
+            当前时间: {current_time.strftime("%Y-%m-%d %H:%M")}，{current_time.strftime("%A")}
             用户输入: "{user_input}"
             用户情绪: {emotion_data.get('emotion', 'neutral')} (强度: {emotion_data.get('intensity', 0.5)})
             
             记忆上下文:
-            {context_result}
+            {sections['memory']}
             
             对话上下文:
-            {thinking_context}
+            {sections['dialogue']}
             
             当前关系亲密度: {self.agent_system.memory_system.emotional_state['relationship_level']}/10""",
             source="user"
         )
+        assembler.record(thought_message.content)
+        
+        async def collect(delta):
+            chunks.append(delta)
+            if not monologue_ready.done():
+                monologue = closed_monologue("".join(chunks))
+                if monologue is not None:
+                    monologue_ready.set_result(monologue)
         
-        thought_response = await self.agent_system.thinker.on_messages([thought_message], cancellation_token)
+        chunks = []
+        try:
+            if monologue_ready is None:
+                thought_response = await self.agent_system.thinker.on_messages([thought_message], cancellation_token)
+            else:
+                thought_response = await self._stream_agent_response(
+                    self.agent_system.thinker, thought_message, cancellation_token, collect
+                )
+        except StageDeadlineExceeded as e:
+            # 内心思考超时时直接进入回复生成，把剩余时间留给主对话代理；流式生成时保留已生成的部分
+            print(f"[警告] 内心思考超时，跳过本轮思考: {e}")
+            return "".join(chunks) or "无法生成思考"
         return thought_response.chat_message.content if thought_response.chat_message else "无法生成思考"
     
-    async def _generate_response(self, user_input: str, context_result: str, inner_thoughts: str, cancellation_token) -> str:
-        """生成最终回复"""
+    @traced("fused_companion")
+    async def _generate_fused_response(self, user_input: str, emotion_data: dict, context_result: str,
+                                       cancellation_token, on_delta=None):
+        """
+        融合模式：一次调用生成内心独白、回复和状态更新，在本地拆分
+        
+        流式推送时只转发【回复】部分。返回(内心思考, 回复)，内心思考包含独白和状态更新部分，
+        与分阶段模式的思考输出格式一致，对话后的状态更新流程无需区分模式
+        """
+        assembler = PromptAssembler("fused", total_budget=PROMPT_TOTAL_BUDGET)
+        assembler.add("memory", context_result, budget=MEMORY_CONTEXT_BUDGET, priority=1, query=user_input)
+        assembler.add("dialogue", self._get_thinking_context(), budget=PREVIOUS_REPLY_BUDGET, priority=0)
+        sections = assembler.build()
+        
+        emotional_state = self.agent_system.memory_system.emotional_state
+        current_time = datetime.now()
+        fused_message = TextMessage(
+            content=f"""请先思考，再回应用户，最后给出需要记录的状态更新。
+            如果用户提到了时间相关的话，请结合当前时间和记忆上下文的时间进行回应，记忆上下文可能包含无关内容，请仔细甄别。
+
+            用户输入: {user_input}
+            用户情绪: {emotion_data.get('emotion', 'neutral')} (强度: {emotion_data.get('intensity', 0.5)})
+            
+            记忆上下文:
+            {sections['memory']}
+            
+            对话上下文:
+            {sections['dialogue']}
+            
+            当前情绪: {emotional_state['current_emotion']}
+            情绪强度: {emotional_state['emotion_intensity']}
+            关系亲密度: {emotional_state['relationship_level']}/10
+            当前时间: {current_time.strftime("%Y-%m-%d %H:%M:%S")} 星期{['一', '二', '三', '四', '五', '六', '日'][current_time.weekday()]}""",
+            source="user"
+        )
+        assembler.record(fused_message.content)
+        
+        agent = self.agent_system.fused_companion
+        if on_delta is None:
+            fused_response = await agent.on_messages([fused_message], cancellation_token)
+        else:
+            reply_filter = SectionStreamFilter(REPLY_TAG)
+            
+            async def forward_reply(delta):
+                text = reply_filter.feed(delta)
+                if text:
+                    await on_delta(text)
+            
+            fused_response = await self._stream_agent_response(agent, fused_message, cancellation_token, forward_reply)
+        
+        output = fused_response.chat_message.content if fused_response and fused_response.chat_message else ""
+        monologue, reply, state_section = split_fused_output(output)
+        inner_thoughts = f"{MONOLOGUE_TAG}{monologue}\n{STATE_UPDATE_TAG}{state_section}"
+        
+        # 状态更新中请求的视觉效果直接加入指令队列
+        state_update = parse_state_update(inner_thoughts)
+        if state_update and state_update.get("visual_effect"):
+            command = create_effect_command(effect_description=state_update["visual_effect"],
+                                            intensity=state_update.get("intensity") or 0.5)
+            if command:
+                command["timestamp"] = datetime.now().isoformat()
+                self.agent_system.command_queue.append(command)
+        
+        return inner_thoughts, reply or "抱歉，我无法回应"
+    
+    @traced("companion")
+    async def _generate_response(self, user_input: str, context_result: str, inner_thoughts: str, cancellation_token, on_delta=None,
+                                 light=False) -> str:
+        """生成最终回复，传入on_delta时流式推送生成中的文本，light为True时由轻量模型的对话代理回复"""
+        # 内心思考优先级高于记忆上下文，超出总预算时先压缩记忆
+        assembler = PromptAssembler("companion", total_budget=PROMPT_TOTAL_BUDGET)
+        assembler.add("memory", context_result, budget=MEMORY_CONTEXT_BUDGET, priority=0, query=user_input)
+        assembler.add("thoughts", inner_thoughts, budget=INNER_THOUGHTS_BUDGET, priority=1)
+        sections = assembler.build()
+        
         companion_message = TextMessage(
             content=f"""请根据以下信息，以自然、情感化的方式回应用户，
             如果用户提到了时间相关的话，请结合当前时间和记忆上下文的时间进行回应，
@@ -269,10 +695,10 @@ class ConversationHandler:
             用户输入: {user_input}
             
             记忆上下文:
-            {context_result}
+            {sections['memory']}
             
             我的内心思考:
-            {inner_thoughts}
+            {sections['thoughts']}
             
             当前情绪: {self.agent_system.memory_system.emotional_state['current_emotion']}
             情绪强度: {self.agent_system.memory_system.emotional_state['emotion_intensity']}
@@ -280,35 +706,105 @@ class ConversationHandler:
             当前时间: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")} 星期{['一', '二', '三', '四', '五', '六', '日'][datetime.now().weekday()]}""",
             source="user"
         )
+        assembler.record(companion_message.content)
+        
+        companion = self.agent_system.light_companion if light else self.agent_system.companion
+        if on_delta is None:
+            companion_response = await companion.on_messages([companion_message], cancellation_token)
+        else:
+            companion_response = await self._stream_agent_response(
+                companion, companion_message, cancellation_token, on_delta
+            )
+        return companion_response.chat_message.content if companion_response and companion_response.chat_message else "抱歉，我无法回应"
+    
+    async def _stream_agent_response(self, agent, message, cancellation_token, on_delta):
+        """
+        以流式方式调用代理，将模型输出的文本片段转发给on_delta
+        
+        调用了视觉效果工具时，最终回复来自工具返回的reply_content，
+        因此调用方应以返回的完整回复为准覆盖已推送的片段
+        """
+        final_response = None
+        delta_enabled = True
+        async for event in agent.on_messages_stream([message], cancellation_token):
+            if isinstance(event, ModelClientStreamingChunkEvent):
+                if event.content and delta_enabled:
+                    try:
+                        await on_delta(event.content)
+                    except Exception as e:
+                        # 推送失败（如客户端断开）后停止推送，但不影响回复生成
+                        print(f"[警告] 流式片段推送失败，停止推送: {e}")
+                        delta_enabled = False
+            elif isinstance(event, Response):
+                final_response = event
+        return final_response
+    
+    async def run_post_turn_job(self, job: PostTurnJob):
+        """执行对话后任务队列中的一项任务"""
+        # 本轮的全部记忆写入（交互记忆、状态更新、memory_manager的工具调用）收集在一个工作单元中，结束时一次提交
+        with self.agent_system.memory_system.unit_of_work():
+            # 使用独立的令牌：回复已经生成，之后到达的新消息不应取消本轮的记忆保存
+            await self._save_and_update_async(job.user_input, job.response, job.emotion_data, job.inner_thoughts,
+                                              CancellationToken(), llm_update=job.llm_update)
+    
+    @traced("save_and_update")
+    async def _save_and_update_async(self, user_input: str, response: str, emotion_data: dict, inner_thoughts: str, cancellation_token,
+                                     llm_update=True):
+        """
+        异步保存记忆和更新状态，根据内心思考处理用户偏好
         
-        companion_response = await self.agent_system.companion.on_messages([companion_message], cancellation_token)
-        return companion_response.chat_message.content if companion_response.chat_message else "抱歉，我无法回应"
-    async def _save_and_update_async(self, user_input: str, response: str, emotion_data: dict, inner_thoughts: str, cancellation_token):
-        """异步保存记忆和更新状态，根据内心思考处理用户偏好"""
+        llm_update为False时只保存交互记忆和可直接解析的结构化状态更新，不调用memory_manager代理
+        """
+        # 后台任务继承了本轮对话的时限，回复已经完成，保存不受其约束
+        clear_deadline()
+        # 状态更新的LLM请求排在实时对话之后
+        set_request_priority(PRIORITY_POST_TURN)
         try:
             # 保存交互记忆
             self.agent_system.memory_system.add_episodic_memory(
                 user_input, 
                 response,
                 emotion_data,
-                context=f"内心思考: {inner_thoughts}"
+                context=f"内心思考: {strip_state_update(inner_thoughts)}" if inner_thoughts else None
             )
             
-            # 根据内心思考更新情感状态和处理用户偏好
+            # 优先直接应用内心思考中的结构化状态更新
+            span = tracer.current_span()
+            state_update = parse_state_update(inner_thoughts) if self.structured_updates else None
+            if state_update is not None:
+                summary = await asyncio.to_thread(apply_state_update, self.agent_system.memory_system, state_update)
+                if span is not None:
+                    span.set_attribute("update_source", "structured")
+                self.agent_system.logger.step("emotionalchange", summary)
+                return
+            if not llm_update:
+                if span is not None:
+                    span.set_attribute("update_source", "skipped")
+                return
+            if span is not None:
+                span.set_attribute("update_source", "memory_manager")
+            
+            # 根据内心思考更新情感状态和处理用户偏好，提示词中的长文本按预算裁剪
+            assembler = PromptAssembler("save_and_update", total_budget=PROMPT_TOTAL_BUDGET)
+            assembler.add("thoughts", inner_thoughts, budget=INNER_THOUGHTS_BUDGET, priority=1)
+            assembler.add("user_input", user_input, budget=DIALOGUE_BUDGET, priority=2)
+            assembler.add("response", response, budget=DIALOGUE_BUDGET, priority=0)
+            sections = assembler.build()
+            
             update_message = TextMessage(
-                content=f"""根据以下内心思考，请：
-                1. 判断是否需要更新智能体情感状态（使用update_emotion）
-                2. 判断是否记录关系事件（record_relationship_event）
+                content=f"""根据以下内心思考，判断需要做哪些更新，并通过一次update_memory_batch调用全部完成：
+                1. 是否需要更新智能体情感状态（update_emotion）
+                2. 是否记录关系事件（record_relationship_event）
                 3. 根据内心思考的建议处理可能的用户偏好（save_user_preference）
                 4. 记录可能的用户信息（save_user_profile_info），用户信息也包括上下班时间这些日常时间，假如用户提到时间相关的内容（如"昨天"、"上周"、"最近"等），
                    请结合当前时间记录具体的时间，比如用户说明天下午要考试，当前时间是2025-06-09，星期一，你就要记录用户的考试时间为2025-06-10，星期二下午。
 
                 内心思考内容:
-                {inner_thoughts}
+                {sections['thoughts']}
                 
                 当前对话上下文：
-                用户输入: {user_input}
-                智能体回答: {response}
+                用户输入: {sections['user_input']}
+                智能体回答: {sections['response']}
                 用户情绪: {emotion_data.get('emotion', 'neutral')} ({emotion_data.get('valence', 0)})
                 
                 当前状态:
@@ -319,6 +815,7 @@ class ConversationHandler:
                 如果本次的回复内容是报错信息，就不要记录任何内容。""",
                 source="user"
             )
+            assembler.record(update_message.content)
             
             change = await self.agent_system.memory_manager.on_messages([update_message], cancellation_token)
             self.agent_system.logger.step("emotionalchange", change.chat_message.content if change.chat_message else "无情感更新")
@@ -355,11 +852,44 @@ class ConversationHandler:
             pass
     
     def _parse_emotion_data(self, emotion_analysis: str) -> dict:
-        """解析情感分析数据"""
-        try:
-            return json.loads(emotion_analysis)
-        except:
-            return {"emotion": "neutral", "intensity": 0.5, "valence": 0}
+        """
+        解析情感分析数据
+        
+        兼容代码块包裹、前后附带说明文字以及单引号字典（emotion_analyzer的提示词示例即为单引号格式），
+        数值会被裁剪到合法范围，确实无法解析时才回退为中性情绪并打印警告
+        """
+        data = None
+        text = (emotion_analysis or "").strip()
+        match = re.search(r"\{.*\}", text, re.DOTALL)
+        candidates = [text, match.group(0)] if match else [text]
+        
+        for candidate in candidates:
+            for loader in (json.loads, ast.literal_eval):
+                try:
+                    parsed = loader(candidate)
+                except (ValueError, SyntaxError, TypeError):
+                    continue
+                if isinstance(parsed, dict):
+                    data = parsed
+                    break
+            if data is not None:
+                break
+        
+        if data is None:
+            print(f"[警告] 无法解析情感分析结果，使用中性情绪: {text[:80]}")
+            return dict(NEUTRAL_EMOTION)
+        
+        def _clamp(value, low, high, default):
+            try:
+                return max(low, min(high, float(value)))
+            except (TypeError, ValueError):
+                return default
+        
+        return {
+            "emotion": normalize_emotion_label(data.get("emotion")),
+            "intensity": _clamp(data.get("intensity"), 0.0, 1.0, NEUTRAL_EMOTION["intensity"]),
+            "valence": _clamp(data.get("valence"), -1.0, 1.0, NEUTRAL_EMOTION["valence"])
+        }
     
     def get_current_emotional_state(self) -> dict:
         """获取当前情感状态"""
@@ -367,11 +897,16 @@ class ConversationHandler:
     
     def start_background_tasks(self):
         """启动后台任务（如果需要）"""
-        self.agent_system.start_background_tasks()
+        self.agent_system.start_background_tasks(is_idle=self._is_idle)
     
-    def stop_background_tasks(self):
+    def _is_idle(self) -> bool:
+        """当前是否没有进行中的对话轮次"""
+        return self.load_controller is None or self.load_controller.in_flight == 0
+    
+    async def stop_background_tasks(self):
         """停止后台任务"""
-        self.agent_system.autonomous_mode = False
+        await self.agent_system.stop_background_tasks()
+    
     def _get_thinking_context(self) -> str:
         """获取内心思考的上下文"""
         try:
@@ -413,6 +948,8 @@ class ConversationCLI:
             
             if user_input.lower() == "再见":
                 print("[小梦] 再见！期待下次与您交流。")
+                await self.handler.stop_background_tasks()
+                await self.handler.post_turn_queue.drain()
                 break
             
             # 获取回复并显示时间统计
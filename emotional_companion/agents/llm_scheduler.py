@@ -0,0 +1,510 @@
+"""
+全局LLM请求调度
+所有模型客户端的调用都经过ScheduledChatCompletionClient，按端点排队：
+- 优先级：实时对话 > 对话后的状态更新 > 主动消息，优先级由调用所在的上下文决定（priority_scope）
+- 每个端点限制并发数和每分钟token数，后台请求只能使用其中一部分，为实时对话留出余量
+- 限流（429）和服务端错误按指数退避重试，响应带Retry-After时按其等待，并暂停该端点的新请求
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence, Union
+
+import openai
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+
+from emotional_companion.agents.resilience import remaining_time
+from emotional_companion.utils.env_utils import get_env_bool, get_env_float, get_env_int
+from emotional_companion.utils.prompt_budget import count_tokens
+from emotional_companion.utils.tracing import tracer
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_POST_TURN = 1
+PRIORITY_PROACTIVE = 2
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_POST_TURN: "post_turn",
+    PRIORITY_PROACTIVE: "proactive",
+}
+
+# 当前上下文中发出的LLM请求的优先级，未设置时视为实时对话
+_request_priority: ContextVar[int] = ContextVar("llm_request_priority", default=PRIORITY_INTERACTIVE)
+
+# 可重试的HTTP状态码
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+TPM_WINDOW = 60.0
+
+
+@contextmanager
+def priority_scope(priority: int):
+    """在当前上下文（及其派生的任务）中以指定优先级发出LLM请求"""
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+def set_request_priority(priority: int):
+    """设置当前任务的请求优先级，用于后台任务的入口处"""
+    _request_priority.set(priority)
+
+
+def current_priority() -> int:
+    return _request_priority.get()
+
+
+def scheduler_enabled() -> bool:
+    """是否启用全局LLM调度（LLM_SCHEDULER_ENABLED）"""
+    return get_env_bool("LLM_SCHEDULER_ENABLED", True)
+
+
+def estimate_request_tokens(messages: Sequence[LLMMessage], output_tokens: int) -> int:
+    """本地估算一次请求消耗的token数（输入+预计输出）"""
+    total = output_tokens
+    for message in messages:
+        content = getattr(message, "content", "")
+        total += count_tokens(content if isinstance(content, str) else str(content))
+    return total
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """从响应头中读取Retry-After（支持retry-after-ms、秒数和HTTP日期）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS
+    return False
+
+
+def _usage_tokens(result: Optional[CreateResult]) -> Optional[int]:
+    usage = getattr(result, "usage", None)
+    if usage is None:
+        return None
+    tokens = (usage.prompt_tokens or 0) + (usage.completion_tokens or 0)
+    return tokens or None
+
+
+@dataclass
+class _Reservation:
+    """一次已获准执行的请求占用的并发槽位和token额度"""
+    priority: int
+    tokens: int
+    # TPM窗口中的记录 [时间, token数]，请求结束后按实际用量修正
+    usage_entry: List[float] = field(default_factory=list)
+    released: bool = False
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    tokens: int = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class _PriorityStats:
+    def __init__(self):
+        self.requests = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.retries = 0
+        self.rate_limited = 0
+        self.errors = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "waited": self.waited,
+            "avg_wait_ms": round(self.total_wait / self.requests * 1000, 1) if self.requests else None,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "errors": self.errors,
+        }
+
+
+class EndpointLimiter:
+    """单个端点的优先级队列、并发限制和每分钟token预算"""
+
+    def __init__(self, endpoint: str, max_concurrency: int, tpm_limit: int, background_share: float):
+        """
+        Args:
+            endpoint: 端点标识（scheme://host:port）
+            max_concurrency: 最大并发请求数
+            tpm_limit: 每分钟token预算，0表示不限制
+            background_share: 后台请求（状态更新、主动消息）可使用的并发数和token预算比例
+        """
+        self.endpoint = endpoint
+        self.max_concurrency = max(1, max_concurrency)
+        self.tpm_limit = max(0, tpm_limit)
+        self.background_share = min(1.0, max(0.0, background_share))
+        self.in_flight = 0
+        self.in_flight_by_priority: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+        self.blocked_until = 0.0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._usage: deque = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats: Dict[int, _PriorityStats] = {priority: _PriorityStats() for priority in PRIORITY_NAMES}
+        # 统计接口可能在其他线程中读取
+        self._stats_lock = threading.Lock()
+
+    def _concurrency_for(self, priority: int) -> int:
+        if priority == PRIORITY_INTERACTIVE:
+            return self.max_concurrency
+        return max(1, int(self.max_concurrency * self.background_share))
+
+    def _tokens_used(self, now: float) -> float:
+        while self._usage and now - self._usage[0][0] >= TPM_WINDOW:
+            self._usage.popleft()
+        return sum(entry[1] for entry in self._usage)
+
+    def _can_admit(self, priority: int, tokens: int, now: float) -> bool:
+        if now < self.blocked_until:
+            return False
+        # 后台请求只计算后台请求占用的并发，实时请求计算全部并发
+        if priority == PRIORITY_INTERACTIVE:
+            if self.in_flight >= self.max_concurrency:
+                return False
+        elif (self.in_flight - self.in_flight_by_priority[PRIORITY_INTERACTIVE] >= self._concurrency_for(priority)
+              or self.in_flight >= self.max_concurrency):
+            return False
+        if self.tpm_limit:
+            budget = self.tpm_limit if priority == PRIORITY_INTERACTIVE else self.tpm_limit * self.background_share
+            used = self._tokens_used(now)
+            # 窗口为空时总是放行，避免单个超出预算的请求永远无法执行
+            if used > 0 and used + tokens > budget:
+                return False
+        return True
+
+    def _next_wake_delay(self, now: float) -> Optional[float]:
+        """因限流暂停或token预算而等待时，下一次可能放行的时间"""
+        delays = []
+        if now < self.blocked_until:
+            delays.append(self.blocked_until - now)
+        if self.tpm_limit and self._usage:
+            delays.append(TPM_WINDOW - (now - self._usage[0][0]))
+        return max(0.05, min(delays)) if delays else None
+
+    def _dispatch(self):
+        """按优先级放行队首请求；队首无法放行时，优先级更低的请求同样等待"""
+        self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter.future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_admit(waiter.priority, waiter.tokens, now):
+                break
+            heapq.heappop(self._waiters)
+            waiter.future.set_result(self._admit(waiter.priority, waiter.tokens, now, waiter.enqueued_at))
+        if self._waiters and self._timer is None:
+            delay = self._next_wake_delay(now)
+            if delay is not None:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _admit(self, priority: int, tokens: int, now: float, enqueued_at: float) -> _Reservation:
+        self.in_flight += 1
+        self.in_flight_by_priority[priority] += 1
+        entry = [now, tokens]
+        if self.tpm_limit:
+            self._usage.append(entry)
+        wait = now - enqueued_at
+        with self._stats_lock:
+            stats = self.stats[priority]
+            stats.requests += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            if wait > 0:
+                stats.waited += 1
+        return _Reservation(priority, tokens, entry)
+
+    async def acquire(self, priority: int, tokens: int) -> _Reservation:
+        """等待获得执行许可"""
+        now = time.monotonic()
+        # 没有排队请求时直接放行
+        if not self._waiters and self._can_admit(priority, tokens, now):
+            return self._admit(priority, tokens, now, now)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, _Waiter(priority, next(self._seq), tokens, now, future))
+        self._dispatch()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # 取消与放行同时发生时归还已分配的许可
+            if future.done() and not future.cancelled():
+                self.release(future.result(), None)
+            raise
+
+    def release(self, reservation: _Reservation, actual_tokens: Optional[int]):
+        """归还许可，按实际用量修正token记录"""
+        if reservation.released:
+            return
+        reservation.released = True
+        self.in_flight -= 1
+        self.in_flight_by_priority[reservation.priority] -= 1
+        if actual_tokens is not None and reservation.usage_entry:
+            reservation.usage_entry[1] = actual_tokens
+        self._dispatch()
+
+    def block_for(self, seconds: float):
+        """端点返回限流时，在Retry-After期间暂停放行新请求"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def record(self, priority: int, retry: bool = False, rate_limited: bool = False, error: bool = False):
+        with self._stats_lock:
+            stats = self.stats[priority]
+            stats.retries += int(retry)
+            stats.rate_limited += int(rate_limited)
+            stats.errors += int(error)
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for waiter in list(self._waiters):
+            if not waiter.future.done():
+                queued[PRIORITY_NAMES[waiter.priority]] += 1
+        with self._stats_lock:
+            by_priority = {PRIORITY_NAMES[priority]: stats.to_dict() for priority, stats in self.stats.items()}
+        return {
+            "max_concurrency": self.max_concurrency,
+            "background_concurrency": self._concurrency_for(PRIORITY_POST_TURN),
+            "tpm_limit": self.tpm_limit or None,
+            "tokens_last_minute": int(self._tokens_used(now)) if self.tpm_limit else None,
+            "in_flight": self.in_flight,
+            "queued": queued,
+            "blocked_seconds": round(max(0.0, self.blocked_until - now), 1),
+            "by_priority": by_priority,
+        }
+
+
+class LLMScheduler:
+    """按端点划分的全局LLM请求调度器"""
+
+    def __init__(self):
+        self.max_retries = get_env_int("LLM_MAX_RETRIES", 2)
+        self.base_delay = get_env_float("LLM_RETRY_BASE_DELAY", 0.5)
+        self.max_delay = get_env_float("LLM_RETRY_MAX_DELAY", 30.0)
+        self.output_tokens = get_env_int("LLM_OUTPUT_TOKEN_ESTIMATE", 300)
+        self._limiters: Dict[str, EndpointLimiter] = {}
+
+    def get_limiter(self, endpoint: str, max_concurrency: Optional[int] = None,
+                    tpm_limit: Optional[int] = None) -> EndpointLimiter:
+        """
+        获取端点的限制器，首次获取时创建
+
+        Args:
+            endpoint: 端点标识
+            max_concurrency: 并发上限，为None时读取LLM_MAX_CONCURRENCY
+            tpm_limit: 每分钟token预算，为None时读取LLM_TPM_LIMIT（0为不限制）
+        """
+        limiter = self._limiters.get(endpoint)
+        if limiter is None:
+            limiter = EndpointLimiter(
+                endpoint,
+                max_concurrency or get_env_int("LLM_MAX_CONCURRENCY", 8),
+                get_env_int("LLM_TPM_LIMIT", 0) if tpm_limit is None else tpm_limit,
+                get_env_float("LLM_BACKGROUND_SHARE", 0.5),
+            )
+            self._limiters[endpoint] = limiter
+        return limiter
+
+    def wrap(self, client: ChatCompletionClient, endpoint: str, max_concurrency: Optional[int] = None,
+             tpm_limit: Optional[int] = None) -> "ScheduledChatCompletionClient":
+        """让客户端的调用经过端点的调度队列"""
+        return ScheduledChatCompletionClient(client, self, self.get_limiter(endpoint, max_concurrency, tpm_limit))
+
+    def retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        计算重试前的等待时间，不可重试或重试次数用尽时返回None
+
+        响应带Retry-After时按其等待，否则按带抖动的指数退避
+        """
+        if attempt >= self.max_retries or not _is_retryable(error):
+            return None
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            delay = min(self.max_delay, retry_after)
+        else:
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+        # 剩余的整轮时间不够等待时不再重试，交给上层的故障转移
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
+
+    def get_stats(self) -> dict:
+        return {
+            "max_retries": self.max_retries,
+            "endpoints": {endpoint: limiter.get_stats() for endpoint, limiter in self._limiters.items()},
+        }
+
+
+class ScheduledChatCompletionClient(ChatCompletionClient):
+    """经过全局调度的模型客户端包装"""
+
+    def __init__(self, client: ChatCompletionClient, scheduler: LLMScheduler, limiter: EndpointLimiter):
+        self.client = client
+        self.scheduler = scheduler
+        self.limiter = limiter
+
+    @property
+    def _raw_config(self) -> dict:
+        return getattr(self.client, "_raw_config", {})
+
+    async def _acquire(self, priority: int, messages: Sequence[LLMMessage]) -> _Reservation:
+        tokens = estimate_request_tokens(messages, self.scheduler.output_tokens) if self.limiter.tpm_limit else 0
+        start = time.monotonic()
+        reservation = await self.limiter.acquire(priority, tokens)
+        span = tracer.current_span()
+        if span is not None:
+            span.set_attribute("llm_priority", PRIORITY_NAMES[priority])
+            span.set_attribute("llm_queue_wait_ms", round((time.monotonic() - start) * 1000, 1))
+        return reservation
+
+    async def _before_retry(self, priority: int, error: Exception, attempt: int) -> bool:
+        """出错后判断是否重试，需要重试时等待退避时间并返回True"""
+        rate_limited = isinstance(error, openai.APIStatusError) and error.status_code == 429
+        delay = self.scheduler.retry_delay(error, attempt)
+        self.limiter.record(priority, retry=delay is not None, rate_limited=rate_limited, error=delay is None)
+        if delay is None:
+            return False
+        if rate_limited:
+            self.limiter.block_for(delay)
+        print(f"[LLM调度] {self.limiter.endpoint} 请求失败（{type(error).__name__}），{delay:.1f}秒后第{attempt + 1}次重试")
+        await asyncio.sleep(delay)
+        return True
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        cancellation_token: Optional[CancellationToken] = None,
+        **kwargs: Any,
+    ) -> CreateResult:
+        priority = current_priority()
+        attempt = 0
+        while True:
+            reservation = await self._acquire(priority, messages)
+            result = None
+            try:
+                result = await self.client.create(messages, cancellation_token=cancellation_token, **kwargs)
+                return result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.limiter.release(reservation, 0)
+                if not await self._before_retry(priority, e, attempt):
+                    raise
+                attempt += 1
+            finally:
+                self.limiter.release(reservation, _usage_tokens(result))
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        cancellation_token: Optional[CancellationToken] = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        """流式调用：只在收到首个片段之前重试，许可一直占用到流结束"""
+        priority = current_priority()
+        attempt = 0
+        while True:
+            reservation = await self._acquire(priority, messages)
+            final = None
+            try:
+                stream = self.client.create_stream(messages, cancellation_token=cancellation_token, **kwargs)
+                try:
+                    first = await stream.__anext__()
+                except StopAsyncIteration:
+                    return
+                except asyncio.CancelledError:
+                    await stream.aclose()
+                    raise
+                except Exception as e:
+                    await stream.aclose()
+                    self.limiter.release(reservation, 0)
+                    if not await self._before_retry(priority, e, attempt):
+                        raise
+                    attempt += 1
+                    continue
+
+                if isinstance(first, CreateResult):
+                    final = first
+                yield first
+                async for item in stream:
+                    if isinstance(item, CreateResult):
+                        final = item
+                    yield item
+                return
+            finally:
+                self.limiter.release(reservation, _usage_tokens(final))
+
+    async def close(self) -> None:
+        # 底层客户端及其连接池由ModelClientFactory统一管理，这里不关闭
+        return None
+
+    def actual_usage(self) -> RequestUsage:
+        return self.client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self.client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], **kwargs: Any) -> int:
+        return self.client.count_tokens(messages, **kwargs)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], **kwargs: Any) -> int:
+        return self.client.remaining_tokens(messages, **kwargs)
+
+    @property
+    def capabilities(self):  # type: ignore
+        return self.client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self.client.model_info
+
+
+# 进程内共用的调度器，所有模型客户端工厂创建的客户端都经过它
+llm_scheduler = LLMScheduler()
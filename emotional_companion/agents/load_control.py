@@ -0,0 +1,196 @@
+"""
+负载自适应降级
+根据排队轮次、进行中的轮次和各阶段近期延迟计算负载压力，
+压力升高时沿DEGRADATION_LADDER逐级降低对话流程深度，压力回落后再逐级恢复。
+降级按最短间隔逐级生效，恢复需要压力持续低于阈值一段时间，避免档位来回抖动
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from emotional_companion.agents.pipeline_profiles import DEGRADATION_LADDER, PipelineProfile
+from emotional_companion.agents.resilience import StageStats, get_stage_stats
+from emotional_companion.utils.env_utils import get_env_float, get_env_int
+
+# 参与延迟压力计算的阶段
+WATCHED_STAGES = ("emotion", "thinker", "companion", "memory_manager")
+
+
+class LoadController:
+    """负载压力评估与流程档位选择"""
+
+    def __init__(self, max_in_flight: Optional[int] = None, max_queue: Optional[int] = None,
+                 latency_inflation: Optional[float] = None, step_down: Optional[float] = None,
+                 step_up: Optional[float] = None, recovery_seconds: Optional[float] = None,
+                 latency_window: Optional[float] = None, step_down_interval: Optional[float] = None,
+                 latency_min_samples: Optional[int] = None, latency_load_floor: Optional[float] = None,
+                 queue_depth_provider: Optional[Callable[[], int]] = None,
+                 stage_stats_provider: Optional[Callable[[str], StageStats]] = None):
+        """
+        初始化负载控制器，参数为None时读取对应的环境变量
+
+        Args:
+            max_in_flight: 进行中轮次达到该值时压力为1（LOAD_MAX_IN_FLIGHT）
+            max_queue: 排队轮次达到该值时压力为1（LOAD_MAX_QUEUE）
+            latency_inflation: 阶段近期平均延迟达到历史中位数的该倍数时压力为1（LOAD_LATENCY_INFLATION）
+            step_down: 压力不低于该值时降一级（LOAD_STEP_DOWN）
+            step_up: 压力低于该值时才允许升一级（LOAD_STEP_UP）
+            recovery_seconds: 升级前压力需持续低于step_up的秒数（LOAD_RECOVERY_SECONDS）
+            latency_window: 近期延迟的统计窗口（秒）（LOAD_LATENCY_WINDOW）
+            step_down_interval: 两次降级之间的最短间隔（秒），等待上一次降级的效果反映到延迟上（LOAD_STEP_DOWN_INTERVAL）
+            latency_min_samples: 阶段在统计窗口内至少有该数量的样本才计算延迟压力（LOAD_LATENCY_MIN_SAMPLES）
+            latency_load_floor: 进行中或排队压力不低于该值时延迟压力才参与计算，
+                                单个用户偶尔一次慢回复不会触发降级（LOAD_LATENCY_LOAD_FLOOR）
+            queue_depth_provider: 返回当前排队轮次数的函数，由会话管理器提供
+            stage_stats_provider: 按阶段名返回调用统计的函数，默认使用全局的阶段统计
+        """
+        self.max_in_flight = max_in_flight or get_env_int("LOAD_MAX_IN_FLIGHT", 8)
+        self.max_queue = max_queue or get_env_int("LOAD_MAX_QUEUE", 4)
+        self.latency_inflation = latency_inflation or get_env_float("LOAD_LATENCY_INFLATION", 2.0)
+        self.step_down = step_down or get_env_float("LOAD_STEP_DOWN", 1.0)
+        self.step_up = step_up or get_env_float("LOAD_STEP_UP", 0.6)
+        self.recovery_seconds = (get_env_float("LOAD_RECOVERY_SECONDS", 30.0)
+                                 if recovery_seconds is None else recovery_seconds)
+        self.latency_window = latency_window or get_env_float("LOAD_LATENCY_WINDOW", 60.0)
+        self.step_down_interval = (get_env_float("LOAD_STEP_DOWN_INTERVAL", 5.0)
+                                   if step_down_interval is None else step_down_interval)
+        self.latency_min_samples = latency_min_samples or get_env_int("LOAD_LATENCY_MIN_SAMPLES", 5)
+        self.latency_load_floor = (get_env_float("LOAD_LATENCY_LOAD_FLOOR", 0.25)
+                                   if latency_load_floor is None else latency_load_floor)
+        self.queue_depth_provider = queue_depth_provider
+        self.stage_stats_provider = stage_stats_provider or get_stage_stats
+
+        self.level = 0
+        self.in_flight = 0
+        self._calm_since: Optional[float] = None
+        self._last_step_down = float("-inf")
+        self._last_signals: Dict[str, float] = {}
+        self._level_turns = [0] * len(DEGRADATION_LADDER)
+        self._transitions = deque(maxlen=20)
+        self._lock = threading.Lock()
+
+    @property
+    def profile(self) -> PipelineProfile:
+        return DEGRADATION_LADDER[self.level]
+
+    @property
+    def last_pressure(self) -> Optional[float]:
+        """最近一次评估时的负载压力"""
+        return self._last_signals.get("pressure")
+
+    def _queue_depth(self) -> int:
+        if self.queue_depth_provider is None:
+            return 0
+        try:
+            return self.queue_depth_provider()
+        except Exception:
+            return 0
+
+    def _latency_pressure(self) -> Tuple[float, Optional[str]]:
+        """各阶段近期平均延迟相对历史中位数的膨胀程度，返回(压力, 压力最大的阶段)"""
+        worst, worst_stage = 0.0, None
+        for stage in WATCHED_STAGES:
+            stats = self.stage_stats_provider(stage)
+            baseline = stats.percentile(0.5)
+            recent = stats.recent_mean(self.latency_window, self.latency_min_samples)
+            if not baseline or recent is None:
+                continue
+            pressure = recent / baseline / self.latency_inflation
+            if pressure > worst:
+                worst, worst_stage = pressure, stage
+        return worst, worst_stage
+
+    def pressure(self) -> Tuple[float, Dict[str, float]]:
+        """计算当前负载压力，返回(压力, 各项信号)"""
+        queue_depth = self._queue_depth()
+        latency, latency_stage = self._latency_pressure()
+        signals = {
+            "in_flight": self.in_flight,
+            "queue_depth": queue_depth,
+            "in_flight_pressure": round(self.in_flight / self.max_in_flight, 3),
+            "queue_pressure": round(queue_depth / self.max_queue, 3),
+            "latency_pressure": round(latency, 3),
+        }
+        if latency_stage:
+            signals["latency_stage"] = latency_stage
+        load = max(signals["in_flight_pressure"], signals["queue_pressure"])
+        # 延迟升高可能只是模型服务本身偶尔变慢，只有同时存在并发负载时降级才有意义
+        if load < self.latency_load_floor:
+            latency = 0.0
+        return max(load, latency), signals
+
+    def evaluate(self) -> PipelineProfile:
+        """根据当前压力调整档位并返回本轮使用的档位"""
+        pressure, signals = self.pressure()
+        now = time.monotonic()
+        with self._lock:
+            previous = self.level
+            if pressure >= self.step_down:
+                self._calm_since = None
+                if (self.level < len(DEGRADATION_LADDER) - 1
+                        and now - self._last_step_down >= self.step_down_interval):
+                    self.level += 1
+                    self._last_step_down = now
+            elif pressure < self.step_up:
+                if self._calm_since is None:
+                    self._calm_since = now
+                elif self.level > 0 and now - self._calm_since >= self.recovery_seconds:
+                    self.level -= 1
+                    # 每升一级重新计时
+                    self._calm_since = now
+            else:
+                self._calm_since = None
+
+            signals["pressure"] = round(pressure, 3)
+            self._last_signals = signals
+            self._level_turns[self.level] += 1
+            if self.level != previous:
+                self._transitions.append({
+                    "time": time.time(),
+                    "from": DEGRADATION_LADDER[previous].name,
+                    "to": DEGRADATION_LADDER[self.level].name,
+                    **signals,
+                })
+                direction = "降级" if self.level > previous else "恢复"
+                print(f"[负载控制] {direction}: {DEGRADATION_LADDER[previous].name} -> "
+                      f"{DEGRADATION_LADDER[self.level].name}（压力 {pressure:.2f}）")
+            return DEGRADATION_LADDER[self.level]
+
+    @contextmanager
+    def track_turn(self):
+        """统计进行中的轮次"""
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def get_stats(self) -> dict:
+        """获取当前档位、负载信号、各档位处理的轮次和最近的档位切换"""
+        with self._lock:
+            return {
+                "profile": self.profile.name,
+                "level": self.level,
+                "in_flight": self.in_flight,
+                "signals": dict(self._last_signals),
+                "turns_by_profile": {
+                    profile.name: count for profile, count in zip(DEGRADATION_LADDER, self._level_turns)
+                },
+                "transitions": list(self._transitions),
+                "thresholds": {
+                    "max_in_flight": self.max_in_flight,
+                    "max_queue": self.max_queue,
+                    "latency_inflation": self.latency_inflation,
+                    "step_down": self.step_down,
+                    "step_up": self.step_up,
+                    "recovery_seconds": self.recovery_seconds,
+                    "step_down_interval": self.step_down_interval,
+                    "latency_min_samples": self.latency_min_samples,
+                    "latency_load_floor": self.latency_load_floor,
+                },
+            }
@@ -0,0 +1,197 @@
+"""
+模型客户端工厂
+相同配置的角色共用同一个OpenAIChatCompletionClient，同一个base_url共用一个支持keep-alive
+（安装h2时启用HTTP/2）的连接池，并支持启动时预先建立连接；
+启用全局LLM调度时，客户端的调用经过llm_scheduler按端点排队、限流和重试
+"""
+
+import asyncio
+import importlib.util
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from autogen_core.models import ChatCompletionClient
+from autogen_ext.models.openai import OpenAIChatCompletionClient
+
+from emotional_companion.agents.llm_scheduler import llm_scheduler, scheduler_enabled
+from emotional_companion.utils.env_utils import get_env_bool, get_env_float, get_env_int
+
+DEFAULT_MODEL_INFO = {
+    "vision": False,
+    "function_calling": True,
+    "json_output": True,
+    "family": "unknown",
+    "structured_output": True,
+}
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+
+def _endpoint_key(base_url: Optional[str]) -> str:
+    """以 scheme://host:port 作为连接池的划分依据"""
+    parts = urlsplit(base_url or DEFAULT_BASE_URL)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return f"{parts.scheme}://{parts.hostname}:{port}"
+
+
+class ModelClientFactory:
+    """按配置去重创建模型客户端，并为每个端点维护共享的HTTP连接池"""
+
+    def __init__(self, max_connections: Optional[int] = None, max_keepalive: Optional[int] = None,
+                 keepalive_expiry: Optional[float] = None, http2: Optional[bool] = None):
+        """
+        Args:
+            max_connections: 每个端点的最大连接数，为None时读取HTTP_POOL_MAX_CONNECTIONS
+            max_keepalive: 每个端点保持的空闲连接数，为None时读取HTTP_POOL_MAX_KEEPALIVE
+            keepalive_expiry: 空闲连接保持时间（秒），为None时读取HTTP_POOL_KEEPALIVE_EXPIRY
+            http2: 是否启用HTTP/2，为None时读取HTTP2_ENABLED；未安装h2时自动回退到HTTP/1.1
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections or get_env_int("HTTP_POOL_MAX_CONNECTIONS", 20),
+            max_keepalive_connections=max_keepalive or get_env_int("HTTP_POOL_MAX_KEEPALIVE", 10),
+            keepalive_expiry=keepalive_expiry or get_env_float("HTTP_POOL_KEEPALIVE_EXPIRY", 120.0),
+        )
+        if http2 is None:
+            http2 = get_env_bool("HTTP2_ENABLED", True)
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self.timeout = httpx.Timeout(get_env_float("HTTP_TIMEOUT", 60.0), connect=10.0)
+
+        self.scheduled = scheduler_enabled()
+        self._clients: Dict[tuple, ChatCompletionClient] = {}
+        self._client_roles: Dict[tuple, List[str]] = {}
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+        self._endpoint_urls: Dict[str, str] = {}
+        self._endpoint_keys: Dict[str, str] = {}
+        self._warmup_results: Dict[str, dict] = {}
+
+    def _get_http_client(self, base_url: Optional[str]) -> httpx.AsyncClient:
+        """获取端点对应的共享HTTP客户端"""
+        endpoint = _endpoint_key(base_url)
+        http_client = self._http_clients.get(endpoint)
+        if http_client is None:
+            http_client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=self.limits,
+                timeout=self.timeout,
+                follow_redirects=True,
+            )
+            self._http_clients[endpoint] = http_client
+            self._endpoint_urls[endpoint] = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        return http_client
+
+    def get_client(self, config: dict, role: str = "default") -> ChatCompletionClient:
+        """
+        根据配置获取模型客户端，model/base_url/api_key相同的配置返回同一个实例
+
+        配置项中可用max_concurrency和tpm_limit单独设置该端点的并发上限和每分钟token预算，
+        同一端点以最先创建的配置为准
+
+        Args:
+            config: OAI_CONFIG_LIST.json中的一项配置
+            role: 使用该客户端的角色名称，仅用于统计
+        """
+        model = config.get("model")
+        base_url = config.get("base_url")
+        api_key = config.get("api_key")
+        key = (model, base_url, api_key)
+
+        client = self._clients.get(key)
+        if client is None:
+            endpoint = _endpoint_key(base_url)
+            client = OpenAIChatCompletionClient(
+                model=model,
+                api_key=api_key,
+                base_url=base_url,
+                model_info=DEFAULT_MODEL_INFO,
+                http_client=self._get_http_client(base_url),
+                # 启用调度时重试由调度器统一处理（按Retry-After等待并暂停整个端点），SDK不再重试
+                **({"max_retries": 0} if self.scheduled else {}),
+            )
+            if self.scheduled:
+                client = llm_scheduler.wrap(client, endpoint, config.get("max_concurrency"), config.get("tpm_limit"))
+            self._clients[key] = client
+            self._client_roles[key] = []
+            self._endpoint_keys.setdefault(endpoint, api_key)
+        self._client_roles[key].append(role)
+        return client
+
+    async def _warm_endpoint(self, endpoint: str, connections: int):
+        """并发发起轻量请求，让连接池预先完成DNS、TCP和TLS握手"""
+        http_client = self._http_clients[endpoint]
+        url = f"{self._endpoint_urls[endpoint]}/models"
+        headers = {}
+        if self._endpoint_keys.get(endpoint):
+            headers["Authorization"] = f"Bearer {self._endpoint_keys[endpoint]}"
+
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(http_client.get(url, headers=headers) for _ in range(connections)),
+            return_exceptions=True,
+        )
+        errors = [f"{type(r).__name__}: {r}" for r in results if isinstance(r, Exception)]
+        self._warmup_results[endpoint] = {
+            "connections": connections,
+            "succeeded": connections - len(errors),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+            "errors": errors[:3],
+        }
+
+    async def warmup(self, connections: Optional[int] = None):
+        """为每个端点预先建立连接，失败不影响后续正常请求"""
+        if connections is None:
+            connections = get_env_int("HTTP_POOL_WARMUP_CONNECTIONS", 2)
+        if connections <= 0 or not self._http_clients:
+            return
+        await asyncio.gather(*(self._warm_endpoint(endpoint, connections) for endpoint in self._http_clients))
+        for endpoint, result in self._warmup_results.items():
+            print(f"🔌 连接预热 {endpoint}: {result['succeeded']}/{result['connections']} "
+                  f"({result['elapsed_ms']}ms)")
+
+    @staticmethod
+    def _connection_counts(http_client: httpx.AsyncClient) -> dict:
+        """读取httpcore连接池中的连接状态"""
+        try:
+            connections = http_client._transport._pool.connections
+        except AttributeError:
+            return {}
+        counts = {"total": len(connections), "idle": 0, "active": 0, "http2": 0}
+        for connection in connections:
+            if connection.is_idle():
+                counts["idle"] += 1
+            else:
+                counts["active"] += 1
+            if "HTTP/2" in repr(connection):
+                counts["http2"] += 1
+        return counts
+
+    def get_pool_stats(self) -> dict:
+        """获取各端点连接池和客户端复用情况"""
+        endpoints = {}
+        for endpoint, http_client in self._http_clients.items():
+            roles = [
+                {"model": key[0], "roles": self._client_roles[key]}
+                for key, client in self._clients.items()
+                if _endpoint_key(key[1]) == endpoint
+            ]
+            endpoints[endpoint] = {
+                "clients": roles,
+                "connections": self._connection_counts(http_client),
+                "warmup": self._warmup_results.get(endpoint),
+            }
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "model_clients": len(self._clients),
+            "roles": sum(len(roles) for roles in self._client_roles.values()),
+            "endpoints": endpoints,
+        }
+
+    async def aclose(self):
+        """关闭所有共享连接池"""
+        for http_client in self._http_clients.values():
+            await http_client.aclose()
+        self._http_clients.clear()
@@ -0,0 +1,82 @@
+"""
+代理模型上下文配置
+为长期存活的AssistantAgent提供有界的模型上下文，避免提示词随对话轮数无限增长
+"""
+
+import os
+from typing import Dict, Optional
+
+from autogen_core.model_context import (
+    BufferedChatCompletionContext,
+    ChatCompletionContext,
+    TokenLimitedChatCompletionContext,
+)
+from autogen_core.models import LLMMessage
+
+from emotional_companion.utils.env_utils import get_env_int
+from emotional_companion.utils.prompt_budget import count_tokens
+
+# 各代理默认保留的消息条数（token模式下为token上限）
+DEFAULT_CONTEXT_SIZES = {
+    "memory_manager": 12,
+    "thinker": 6,
+    "companion": 10,
+    "fused": 10,
+    "light_companion": 6,
+}
+DEFAULT_TOKEN_LIMITS = {
+    "memory_manager": 4000,
+    "thinker": 3000,
+    "companion": 4000,
+    "fused": 4000,
+    "light_companion": 2000,
+}
+
+
+class BoundedBufferedChatCompletionContext(BufferedChatCompletionContext):
+    """只保留最近buffer_size条消息的上下文，超出窗口的消息同时从内存中移除"""
+
+    async def add_message(self, message: LLMMessage) -> None:
+        await super().add_message(message)
+        if len(self._messages) > self._buffer_size:
+            del self._messages[:-self._buffer_size]
+
+
+def create_model_context(agent_name: str, model_client) -> ChatCompletionContext:
+    """
+    根据环境变量为代理创建有界的模型上下文
+
+    AGENT_CONTEXT_MODE=buffered（默认）时保留最近N条消息，N由 <代理名>_CONTEXT_SIZE 配置；
+    AGENT_CONTEXT_MODE=token 时按token上限裁剪，上限由 <代理名>_CONTEXT_TOKENS 配置
+    """
+    prefix = agent_name.upper()
+    mode = os.getenv("AGENT_CONTEXT_MODE", "buffered").strip().lower()
+
+    if mode == "token":
+        token_limit = get_env_int(f"{prefix}_CONTEXT_TOKENS", DEFAULT_TOKEN_LIMITS.get(agent_name, 4000))
+        return TokenLimitedChatCompletionContext(model_client, token_limit=token_limit)
+
+    buffer_size = get_env_int(f"{prefix}_CONTEXT_SIZE", DEFAULT_CONTEXT_SIZES.get(agent_name, 10))
+    return BoundedBufferedChatCompletionContext(buffer_size=max(1, buffer_size))
+
+
+async def get_context_stats(agents: Dict[str, Optional[object]]) -> Dict[str, dict]:
+    """
+    统计各代理模型上下文的大小
+
+    Returns:
+        dict: 代理名称 -> {context_type, messages, stored_messages, estimated_tokens}
+    """
+    stats = {}
+    for name, agent in agents.items():
+        context = getattr(agent, "model_context", None) if agent is not None else None
+        if context is None:
+            continue
+        messages = await context.get_messages()
+        stats[name] = {
+            "context_type": type(context).__name__,
+            "messages": len(messages),
+            "stored_messages": len(getattr(context, "_messages", messages)),
+            "estimated_tokens": sum(count_tokens(str(getattr(message, "content", ""))) for message in messages),
+        }
+    return stats
@@ -0,0 +1,61 @@
+"""
+对话流程档位
+描述一轮对话实际执行哪些阶段，由消息分流和负载控制为每轮对话选择
+"""
+
+from dataclasses import asdict, dataclass, replace
+
+
+@dataclass(frozen=True)
+class PipelineProfile:
+    """对话流程档位"""
+    name: str
+    # 本地分类器置信度不足时是否调用emotion_analyzer代理
+    emotion_llm: bool = True
+    # 是否进行完整的记忆检索，否则只取最近几轮对话
+    full_retrieval: bool = True
+    # 是否生成内心思考
+    thinker: bool = True
+    # 是否改用轻量模型生成回复
+    light_reply: bool = False
+    # 对话后的状态更新是否允许调用memory_manager代理
+    post_turn_llm: bool = True
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def merge(self, other: "PipelineProfile") -> "PipelineProfile":
+        """合并两个档位，每个阶段取两者中更节省的设置"""
+        merged = PipelineProfile(
+            f"{self.name}+{other.name}",
+            emotion_llm=self.emotion_llm and other.emotion_llm,
+            full_retrieval=self.full_retrieval and other.full_retrieval,
+            thinker=self.thinker and other.thinker,
+            light_reply=self.light_reply or other.light_reply,
+            post_turn_llm=self.post_turn_llm and other.post_turn_llm,
+        )
+        for profile in (self, other):
+            if replace(profile, name=merged.name) == merged:
+                return profile
+        return merged
+
+
+FULL_PROFILE = PipelineProfile("full")
+
+# 简单消息：跳过情绪分析和内心思考，只取最近对话，由轻量模型回复，对话后只保存交互记忆
+LIGHT_PROFILE = PipelineProfile(
+    "light",
+    emotion_llm=False,
+    full_retrieval=False,
+    thinker=False,
+    light_reply=True,
+    post_turn_llm=False,
+)
+
+# 负载降级阶梯：压力升高时依次去掉对话后的LLM状态更新、内心思考，最后改用轻量模型
+DEGRADATION_LADDER = (
+    FULL_PROFILE,
+    PipelineProfile("no_post_turn_llm", post_turn_llm=False),
+    PipelineProfile("no_thinker", thinker=False, post_turn_llm=False),
+    PipelineProfile("light_model", emotion_llm=False, thinker=False, light_reply=True, post_turn_llm=False),
+)
@@ -0,0 +1,297 @@
+"""
+对话后任务队列
+回复生成后的记忆保存和状态更新交给固定数量的工作协程按顺序处理：
+- 队列有容量上限，队列满时提交方最多等待一小段时间，仍无空位则把任务写入磁盘暂存文件
+- 暂存的任务在队列空闲时和下次启动时重新入队
+- 同一会话的任务按提交顺序依次执行，不同会话的任务由多个工作协程并发执行
+- 关闭服务时在限定时间内处理完队列，仍在排队的任务写入暂存文件，保证每轮对话的记忆都不会被静默丢弃
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+from emotional_companion.utils.env_utils import get_env_float, get_env_int
+
+
+@dataclass
+class PostTurnJob:
+    """一轮对话结束后需要保存和更新的内容，可序列化后暂存到磁盘"""
+    user_input: str
+    response: str
+    emotion_data: dict
+    inner_thoughts: str
+    llm_update: bool = True
+    created_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PostTurnJob":
+        return cls(**{key: data[key] for key in cls.__dataclass_fields__ if key in data})
+
+
+@dataclass
+class _QueueItem:
+    job: PostTurnJob
+    # 提交任务的会话处理器，暂存后重新入队的任务使用默认处理器
+    handler: Any
+    # 提交时的上下文，工作协程在其中执行任务，使保存步骤仍归属于本轮对话的trace
+    context: Optional[contextvars.Context]
+    enqueued_at: float
+
+
+class PostTurnQueue:
+    """有界的对话后任务队列"""
+
+    def __init__(self, default_handler, spill_path: str, workers: Optional[int] = None,
+                 maxsize: Optional[int] = None, enqueue_timeout: Optional[float] = None,
+                 drain_timeout: Optional[float] = None):
+        """
+        Args:
+            default_handler: 执行暂存任务的对话处理器，需提供run_post_turn_job(job)
+            spill_path: 暂存文件路径（JSON Lines）
+            workers: 工作协程数量，为None时读取POST_TURN_WORKERS
+            maxsize: 队列容量，为None时读取POST_TURN_QUEUE_SIZE
+            enqueue_timeout: 队列满时提交方最多等待的秒数，为None时读取POST_TURN_ENQUEUE_TIMEOUT
+            drain_timeout: 关闭时等待队列处理完毕的秒数，为None时读取POST_TURN_DRAIN_TIMEOUT
+        """
+        self.default_handler = default_handler
+        self.spill_path = spill_path
+        self.workers = max(1, workers or get_env_int("POST_TURN_WORKERS", 2))
+        self.maxsize = max(1, maxsize or get_env_int("POST_TURN_QUEUE_SIZE", 64))
+        self.enqueue_timeout = (get_env_float("POST_TURN_ENQUEUE_TIMEOUT", 0.5)
+                                if enqueue_timeout is None else enqueue_timeout)
+        self.drain_timeout = (get_env_float("POST_TURN_DRAIN_TIMEOUT", 30.0)
+                              if drain_timeout is None else drain_timeout)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._running: dict = {}
+        # 各会话处理器的执行锁及等待中的任务数，保证同一会话的任务按顺序执行
+        self._session_locks: Dict[int, list] = {}
+        # 已出队、正在等待同一会话前一个任务完成的任务
+        self._waiting: dict = {}
+        self._closed = False
+        self._spill_lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.interrupted = 0
+        self.enqueue_waits = 0
+        self.max_depth = 0
+        self._enqueue_wait_total = 0.0
+        self._enqueue_wait_max = 0.0
+        self._queue_latencies = deque(maxlen=200)
+        self._run_times = deque(maxlen=200)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_started(self):
+        """在事件循环中首次使用时创建队列和工作协程，并重新加载暂存的任务"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(index), name=f"post-turn-worker-{index}")
+            for index in range(self.workers)
+        ]
+        self._refill_from_spill()
+
+    async def submit(self, job: PostTurnJob, handler=None):
+        """
+        提交对话后任务
+
+        队列满时最多等待enqueue_timeout秒，仍无空位或队列已关闭时写入暂存文件
+        """
+        self.submitted += 1
+        if self._closed:
+            await asyncio.to_thread(self._spill, [job])
+            return
+        self._ensure_started()
+        item = _QueueItem(job, handler or self.default_handler, contextvars.copy_context(), time.monotonic())
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.enqueue_waits += 1
+            start = time.monotonic()
+            try:
+                await asyncio.wait_for(self._queue.put(item), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                print(f"[警告] 对话后任务队列已满（{self.maxsize}），任务写入暂存文件")
+                await asyncio.to_thread(self._spill, [job])
+                return
+            finally:
+                waited = time.monotonic() - start
+                self._enqueue_wait_total += waited
+                self._enqueue_wait_max = max(self._enqueue_wait_max, waited)
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    async def _worker(self, index: int):
+        while True:
+            item = await self._queue.get()
+            # 出队后立即排队获取会话锁（锁空闲时不会让出事件循环），同一会话的任务按出队顺序执行
+            key = id(item.handler)
+            entry = self._session_locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            self._waiting[index] = item.job
+            try:
+                async with entry[0]:
+                    self._waiting.pop(index, None)
+                    await self._run_item(index, item)
+            finally:
+                self._waiting.pop(index, None)
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._session_locks.pop(key, None)
+                self._queue.task_done()
+            if self._queue.empty() and not self._closed:
+                self._refill_from_spill()
+
+    async def _run_item(self, index: int, item: _QueueItem):
+        self._running[index] = item.job
+        start = time.monotonic()
+        self._queue_latencies.append(start - item.enqueued_at)
+        try:
+            run = item.handler.run_post_turn_job(item.job)
+            if item.context is not None:
+                # 在提交时的上下文中创建任务（create_task的context参数需要Python 3.11）
+                await item.context.run(asyncio.create_task, run)
+            else:
+                await run
+            self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            print(f"[警告] 对话后任务执行失败: {e}")
+        finally:
+            self._running.pop(index, None)
+            self._run_times.append(time.monotonic() - start)
+
+    def _spill(self, jobs: List[PostTurnJob]):
+        """把任务追加到暂存文件"""
+        if not jobs:
+            return
+        with self._spill_lock:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for job in jobs:
+                    f.write(json.dumps(job.to_dict(), ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        self.spilled += len(jobs)
+
+    def _refill_from_spill(self):
+        """把暂存文件中的任务按队列空位重新入队，放不下的留在文件中"""
+        if self._queue is None or not os.path.exists(self.spill_path):
+            return
+        with self._spill_lock:
+            try:
+                with open(self.spill_path, "r", encoding="utf-8") as f:
+                    lines = [line for line in f if line.strip()]
+            except OSError as e:
+                print(f"[警告] 读取对话后任务暂存文件失败: {e}")
+                return
+            free = self.maxsize - self._queue.qsize()
+            loaded, remaining = lines[:free], lines[free:]
+            for line in loaded:
+                try:
+                    job = PostTurnJob.from_dict(json.loads(line))
+                except (ValueError, TypeError) as e:
+                    print(f"[警告] 跳过无法解析的暂存任务: {e}")
+                    continue
+                self._queue.put_nowait(_QueueItem(job, self.default_handler, None, time.monotonic()))
+                self.replayed += 1
+            if remaining:
+                tmp_path = self.spill_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.writelines(remaining)
+                os.replace(tmp_path, self.spill_path)
+            else:
+                os.remove(self.spill_path)
+        if loaded:
+            print(f"[系统] 重新载入 {len(loaded)} 个暂存的对话后任务")
+
+    def start(self):
+        """启动工作协程并载入上次暂存的任务（需在事件循环中调用）"""
+        self._ensure_started()
+
+    async def drain(self, timeout: Optional[float] = None):
+        """
+        关闭队列：在限定时间内处理完已提交的任务，超时后取消工作协程，
+        把尚未开始执行的任务写入暂存文件，下次启动时重新执行
+
+        执行到一半被取消的任务不写入暂存文件：其工作单元在退出时已提交了收集到的写入，
+        重新执行会重复写入交互记忆和关系事件
+        """
+        self._closed = True
+        if self._queue is None:
+            return
+        timeout = self.drain_timeout if timeout is None else timeout
+        pending = self._queue.qsize() + len(self._running) + len(self._waiting)
+        if pending:
+            print(f"[系统] 等待 {pending} 个对话后任务完成...")
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        interrupted = len(self._running)
+        leftover = list(self._waiting.values())
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        while not self._queue.empty():
+            leftover.append(self._queue.get_nowait().job)
+        if interrupted:
+            self.interrupted += interrupted
+            print(f"[警告] {interrupted} 个对话后任务未在 {timeout:g} 秒内完成，已中断（已收集的写入已提交）")
+        if leftover:
+            await asyncio.to_thread(self._spill, leftover)
+            print(f"[警告] {len(leftover)} 个尚未执行的对话后任务已写入 {self.spill_path}")
+        self._worker_tasks = []
+        self._running.clear()
+        self._waiting.clear()
+
+    def get_stats(self) -> dict:
+        """获取队列深度、等待和执行时间等背压指标"""
+        def average_ms(samples):
+            return round(sum(samples) / len(samples) * 1000, 1) if samples else None
+
+        queue_latencies = list(self._queue_latencies)
+        return {
+            "workers": self.workers,
+            "maxsize": self.maxsize,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "running": len(self._running),
+            "waiting": len(self._waiting),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "interrupted": self.interrupted,
+            "spill_pending": os.path.exists(self.spill_path),
+            "enqueue_waits": self.enqueue_waits,
+            "enqueue_wait_avg_ms": round(self._enqueue_wait_total / self.enqueue_waits * 1000, 1)
+            if self.enqueue_waits else None,
+            "enqueue_wait_max_ms": round(self._enqueue_wait_max * 1000, 1),
+            "queue_latency_avg_ms": average_ms(queue_latencies),
+            "queue_latency_max_ms": round(max(queue_latencies) * 1000, 1) if queue_latencies else None,
+            "run_time_avg_ms": average_ms(list(self._run_times)),
+            "closed": self._closed,
+        }
@@ -0,0 +1,107 @@
+"""
+主动消息缓存
+空闲时根据当前情感状态和最近的记忆预先生成少量个性化主动消息，带过期时间保存；
+达到主动关怀的空闲阈值时直接取用缓存，不需要等待LLM调用。
+缓存的消息记录生成时的情绪，情绪变化后不再使用之前生成的消息
+"""
+
+import json
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, List, Optional
+
+from emotional_companion.utils.env_utils import get_env_int
+
+
+@dataclass
+class CachedProactiveMessage:
+    content: str
+    emotion: str
+    created_at: float
+    expires_at: float
+
+
+def parse_message_list(text: str) -> List[str]:
+    """从模型输出中解析消息列表：优先解析JSON数组，否则按行拆分"""
+    text = (text or "").strip()
+    match = re.search(r"\[.*\]", text, re.DOTALL)
+    if match:
+        try:
+            items = json.loads(match.group(0))
+            return [str(item).strip() for item in items if str(item).strip()]
+        except ValueError:
+            pass
+    lines = [re.sub(r"^\s*(?:[-*•]|\d+[.、)])\s*", "", line).strip() for line in text.splitlines()]
+    return [line.strip("\"'“”") for line in lines if line]
+
+
+class ProactiveMessageCache:
+    """预生成主动消息的缓存池"""
+
+    def __init__(self, pool_size: Optional[int] = None, ttl: Optional[int] = None):
+        """
+        Args:
+            pool_size: 每种情绪保持的消息数量，为None时读取PROACTIVE_CACHE_SIZE
+            ttl: 消息有效期（秒），为None时读取PROACTIVE_CACHE_TTL
+        """
+        self.pool_size = get_env_int("PROACTIVE_CACHE_SIZE", 3) if pool_size is None else pool_size
+        self.ttl = ttl or get_env_int("PROACTIVE_CACHE_TTL", 3600)
+        self._messages: Deque[CachedProactiveMessage] = deque()
+
+        self.generated = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.stale = 0
+        self.last_refill: Optional[float] = None
+
+    def prune(self, emotion: Optional[str] = None):
+        """移除过期的消息，指定情绪时同时移除其他情绪下生成的消息"""
+        now = time.time()
+        kept = deque()
+        for message in self._messages:
+            if message.expires_at <= now:
+                self.expired += 1
+            elif emotion is not None and message.emotion != emotion:
+                self.stale += 1
+            else:
+                kept.append(message)
+        self._messages = kept
+
+    def shortfall(self, emotion: str) -> int:
+        """当前情绪下还需要补充的消息数量"""
+        self.prune(emotion)
+        return max(0, self.pool_size - len(self._messages))
+
+    def put(self, contents: List[str], emotion: str):
+        now = time.time()
+        for content in contents:
+            self._messages.append(CachedProactiveMessage(content, emotion, now, now + self.ttl))
+        self.generated += len(contents)
+        self.last_refill = now
+
+    def take(self, emotion: str) -> Optional[str]:
+        """取出一条当前情绪下仍有效的消息（先生成的先用），没有时返回None"""
+        self.prune(emotion)
+        if not self._messages:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._messages.popleft().content
+
+    def get_stats(self) -> dict:
+        now = time.time()
+        return {
+            "pool_size": self.pool_size,
+            "ttl": self.ttl,
+            "cached": len(self._messages),
+            "oldest_age": round(now - self._messages[0].created_at, 1) if self._messages else None,
+            "generated": self.generated,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "stale": self.stale,
+            "last_refill": self.last_refill,
+        }
@@ -0,0 +1,467 @@
+"""
+阶段级超时、对冲请求与模型故障转移
+ResilientChatCompletionClient包装各代理使用的模型客户端：
+- 每次调用受阶段超时和整轮对话剩余时间（截止时间沿上下文传递）共同约束
+- 幂等阶段（如情绪分析、内心思考）可在按历史延迟分位数计算的等待后发出对冲请求，先返回者胜出；
+  流式调用以首个片段为准，先产出首个片段的流胜出
+- 超时或出错时切换到OAI_CONFIG_LIST.json中配置的其他模型
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Dict, Optional, Sequence, Union
+
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+
+from emotional_companion.utils.env_utils import get_env_bool, get_env_float, get_env_int
+from emotional_companion.utils.tracing import tracer
+
+# 整轮对话的截止时间（time.monotonic()），为None表示不限制
+_turn_deadline: ContextVar[Optional[float]] = ContextVar("turn_deadline", default=None)
+
+
+class StageDeadlineExceeded(asyncio.TimeoutError):
+    """阶段超时且所有候选模型都未能在时限内返回"""
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """
+    设置当前上下文（及其派生的任务）的整轮截止时间
+
+    Args:
+        seconds: 从现在起的可用秒数，为None或不大于0时取消截止时间限制
+    """
+    deadline = time.monotonic() + seconds if seconds and seconds > 0 else None
+    token = _turn_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _turn_deadline.reset(token)
+
+
+def clear_deadline():
+    """
+    清除当前上下文的截止时间
+
+    用于从对话轮次中派生的后台任务：任务持有独立的上下文副本，清除不会影响原轮次
+    """
+    _turn_deadline.set(None)
+
+
+def remaining_time() -> Optional[float]:
+    """当前整轮对话剩余的秒数，未设置截止时间时返回None"""
+    deadline = _turn_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+@dataclass
+class StagePolicy:
+    """单个阶段的超时与对冲策略"""
+    timeout: float
+    hedge: bool = False
+    hedge_percentile: float = 0.95
+    hedge_min_delay: float = 0.5
+    first_token_timeout: Optional[float] = None
+
+
+# 各阶段默认超时（秒）
+DEFAULT_STAGE_TIMEOUTS = {
+    "emotion": 8.0,
+    "thinker": 30.0,
+    "memory_manager": 30.0,
+    "companion": 45.0,
+    "light_reply": 20.0,
+}
+# 流式阶段等待首个片段的超时（秒），超时前未收到任何片段时才会切换模型
+DEFAULT_FIRST_TOKEN_TIMEOUTS = {
+    "thinker": 15.0,
+    "companion": 15.0,
+    "light_reply": 8.0,
+}
+
+
+def get_stage_policy(stage: str) -> StagePolicy:
+    """
+    读取阶段策略
+
+    STAGE_TIMEOUT_<阶段>: 单次调用超时；STAGE_FIRST_TOKEN_TIMEOUT_<阶段>: 流式调用首片段超时；
+    HEDGE_STAGES: 启用对冲请求的阶段列表（逗号分隔，仅应包含幂等阶段）；HEDGE_PERCENTILE: 对冲等待的延迟分位数
+    """
+    prefix = stage.upper()
+    hedge_stages = {s.strip() for s in os.getenv("HEDGE_STAGES", "").split(",") if s.strip()}
+    first_token_default = DEFAULT_FIRST_TOKEN_TIMEOUTS.get(stage)
+    first_token_timeout = get_env_float(f"STAGE_FIRST_TOKEN_TIMEOUT_{prefix}", first_token_default or 0) or None
+    return StagePolicy(
+        timeout=get_env_float(f"STAGE_TIMEOUT_{prefix}", DEFAULT_STAGE_TIMEOUTS.get(stage, 30.0)),
+        hedge=stage in hedge_stages,
+        hedge_percentile=get_env_float("HEDGE_PERCENTILE", 0.95),
+        hedge_min_delay=get_env_float("HEDGE_MIN_DELAY", 0.5),
+        first_token_timeout=first_token_timeout,
+    )
+
+
+class StageStats:
+    """阶段调用统计：延迟样本、超时、对冲、故障转移次数"""
+
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+        # (完成时刻, 延迟)，供负载控制按时间窗口计算近期延迟
+        self.recent = deque(maxlen=window)
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self._lock = threading.Lock()
+
+    def percentile(self, ratio: float, min_samples: int = 20) -> Optional[float]:
+        with self._lock:
+            if len(self.latencies) < min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(ratio * (len(ordered) - 1)))]
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.recent.append((time.monotonic(), seconds))
+
+    def increment(self, counter: str):
+        """计数加一；阶段调用可能在多个线程的事件循环中同时进行，计数需持有锁"""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_timeout(self, seconds: float):
+        """记录一次超时，超时时长计入近期延迟"""
+        with self._lock:
+            self.timeouts += 1
+            self.recent.append((time.monotonic(), seconds))
+
+    def recent_mean(self, window_seconds: float, min_samples: int = 1) -> Optional[float]:
+        """最近window_seconds秒内完成的调用的平均延迟，样本少于min_samples时返回None"""
+        cutoff = time.monotonic() - window_seconds
+        with self._lock:
+            samples = [seconds for finished_at, seconds in self.recent if finished_at >= cutoff]
+        return sum(samples) / len(samples) if samples and len(samples) >= min_samples else None
+
+    def to_dict(self) -> dict:
+        p50, p95, p99 = (self.percentile(r, min_samples=1) for r in (0.5, 0.95, 0.99))
+        with self._lock:
+            counters = {name: getattr(self, name)
+                        for name in ("calls", "timeouts", "errors", "hedges", "hedge_wins", "failovers")}
+        return {
+            **counters,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+        }
+
+
+_stage_stats: Dict[str, StageStats] = {}
+
+
+_stage_stats_lock = threading.Lock()
+
+
+def get_stage_stats(stage: str) -> StageStats:
+    with _stage_stats_lock:
+        if stage not in _stage_stats:
+            _stage_stats[stage] = StageStats()
+        return _stage_stats[stage]
+
+
+def get_resilience_stats() -> Dict[str, dict]:
+    """获取各阶段的超时、对冲和故障转移统计"""
+    with _stage_stats_lock:
+        stages = list(_stage_stats.items())
+    return {stage: stats.to_dict() for stage, stats in stages}
+
+
+def _client_name(client: ChatCompletionClient, index: int) -> str:
+    """用于日志的模型名称"""
+    return getattr(client, "_raw_config", {}).get("model", f"#{index}")
+
+
+class ResilientChatCompletionClient(ChatCompletionClient):
+    """带阶段超时、对冲请求和故障转移的模型客户端包装"""
+
+    def __init__(self, stage: str, clients: Sequence[ChatCompletionClient],
+                 policy: Optional[StagePolicy] = None):
+        """
+        Args:
+            stage: 阶段名称，用于读取策略和记录统计
+            clients: 候选模型客户端，第一个为首选，其余按顺序作为故障转移目标
+            policy: 阶段策略，为None时从环境变量读取
+        """
+        if not clients:
+            raise ValueError("至少需要一个模型客户端")
+        self.stage = stage
+        self.clients = list(clients)
+        self.policy = policy or get_stage_policy(stage)
+        self.stats = get_stage_stats(stage)
+
+    @property
+    def primary(self) -> ChatCompletionClient:
+        return self.clients[0]
+
+    def _attempt_timeout(self) -> float:
+        """单次尝试可用的时间：阶段超时与整轮剩余时间取较小值"""
+        remaining = remaining_time()
+        return self.policy.timeout if remaining is None else min(self.policy.timeout, remaining)
+
+    def _hedge_delay(self, timeout: Optional[float] = None) -> Optional[float]:
+        """对冲前的等待时间；timeout为本次尝试的超时（流式调用为首片段超时），默认取阶段超时"""
+        if not self.policy.hedge:
+            return None
+        delay = self.stats.percentile(self.policy.hedge_percentile)
+        if delay is None:
+            # 样本不足时，在超时时间过半后才发出对冲请求
+            delay = (timeout or self.policy.timeout) / 2
+        return max(self.policy.hedge_min_delay, delay)
+
+    async def _attempt(self, client: ChatCompletionClient, messages, kwargs: dict, timeout: float,
+                       hedge_delay: Optional[float], cancellation_token: Optional[CancellationToken]):
+        """对单个模型发起请求，必要时发出对冲请求，返回最先成功的结果；落后的请求会被取消"""
+        def launch():
+            task = asyncio.ensure_future(client.create(messages, **kwargs))
+            if cancellation_token is not None:
+                cancellation_token.link_future(task)
+            return task
+
+        start = time.monotonic()
+        deadline = start + timeout
+        hedge_at = start + hedge_delay if hedge_delay is not None and hedge_delay < timeout else None
+        primary = launch()
+        tasks = [primary]
+        last_error: BaseException = StageDeadlineExceeded(f"{self.stage} 阶段超时（{timeout:.1f}秒）")
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    raise StageDeadlineExceeded(f"{self.stage} 阶段超时（{timeout:.1f}秒）")
+                wait_until = min(deadline, hedge_at) if hedge_at is not None else deadline
+                done, _ = await asyncio.wait(tasks, timeout=max(0.0, wait_until - now),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.remove(task)
+                    if task.cancelled():
+                        last_error = asyncio.CancelledError()
+                    elif task.exception() is not None:
+                        last_error = task.exception()
+                    else:
+                        if task is not primary:
+                            self.stats.increment("hedge_wins")
+                        return task.result()
+
+                if cancellation_token is not None and cancellation_token.is_cancelled():
+                    raise asyncio.CancelledError()
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    # 首个请求迟迟未返回（或已失败），对同一模型发出对冲请求
+                    hedge_at = None
+                    self.stats.increment("hedges")
+                    tasks.append(launch())
+                elif not tasks:
+                    raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _start_stream(self, client: ChatCompletionClient, messages, kwargs: dict, timeout: float,
+                            hedge_delay: Optional[float], cancellation_token: Optional[CancellationToken]):
+        """
+        发起流式调用并等待首个片段，必要时向同一模型发出对冲的流式请求，先产出首个片段的流胜出
+
+        返回(流, 首个片段)，落后的流会被关闭；流没有任何片段时抛出StopAsyncIteration
+        """
+        def launch():
+            stream = client.create_stream(messages, cancellation_token=cancellation_token, **kwargs)
+            return stream, asyncio.ensure_future(stream.__anext__())
+
+        start = time.monotonic()
+        deadline = start + timeout
+        hedge_at = start + hedge_delay if hedge_delay is not None and hedge_delay < timeout else None
+        primary = launch()
+        pending = [primary]
+        last_error: BaseException = StageDeadlineExceeded(f"首个片段超时（{timeout:.1f}秒）")
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    raise StageDeadlineExceeded(f"首个片段超时（{timeout:.1f}秒）")
+                wait_until = min(deadline, hedge_at) if hedge_at is not None else deadline
+                done, _ = await asyncio.wait([task for _, task in pending], timeout=max(0.0, wait_until - now),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for entry in list(pending):
+                    stream, task = entry
+                    if task not in done:
+                        continue
+                    pending.remove(entry)
+                    if task.cancelled():
+                        last_error = asyncio.CancelledError()
+                    elif task.exception() is not None:
+                        last_error = task.exception()
+                        await stream.aclose()
+                        if isinstance(last_error, StopAsyncIteration):
+                            raise last_error
+                    else:
+                        if entry is not primary:
+                            self.stats.increment("hedge_wins")
+                        return stream, task.result()
+
+                if cancellation_token is not None and cancellation_token.is_cancelled():
+                    raise asyncio.CancelledError()
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    # 首个片段迟迟未到（或首个请求已失败），对同一模型发出对冲的流式请求
+                    hedge_at = None
+                    self.stats.increment("hedges")
+                    pending.append(launch())
+                elif not pending:
+                    raise last_error
+        finally:
+            for stream, task in pending:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await stream.aclose()
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        cancellation_token: Optional[CancellationToken] = None,
+        **kwargs: Any,
+    ) -> CreateResult:
+        self.stats.increment("calls")
+        kwargs["cancellation_token"] = None
+        errors = []
+        for index, client in enumerate(self.clients):
+            timeout = self._attempt_timeout()
+            if timeout <= 0:
+                break
+            start = time.monotonic()
+            hedge_delay = self._hedge_delay() if index == 0 else None
+            try:
+                result = await self._attempt(client, messages, kwargs, timeout, hedge_delay,
+                                             cancellation_token)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError as e:
+                self.stats.record_timeout(time.monotonic() - start)
+                errors.append(f"{_client_name(client, index)}: {e}")
+            except Exception as e:
+                self.stats.increment("errors")
+                errors.append(f"{_client_name(client, index)}: {type(e).__name__}: {e}")
+            else:
+                elapsed = time.monotonic() - start
+                if index == 0:
+                    self.stats.record_latency(elapsed)
+                else:
+                    self.stats.increment("failovers")
+                current = tracer.current_span()
+                if current is not None and index > 0:
+                    current.set_attribute("failover_index", index)
+                return result
+            print(f"[警告] {self.stage} 阶段模型调用失败，尝试下一个候选模型: {errors[-1]}")
+
+        raise StageDeadlineExceeded(f"{self.stage} 阶段所有候选模型均未在时限内返回: {'; '.join(errors) or '时间已用尽'}")
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        cancellation_token: Optional[CancellationToken] = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        """
+        流式调用：在收到首个片段之前超时或出错时切换模型，之后只受整轮截止时间约束
+
+        启用对冲的阶段在首个片段超过历史延迟分位数仍未到达时，再发起一个流式请求，先产出首个片段的流胜出
+        """
+        self.stats.increment("calls")
+        errors = []
+        for index, client in enumerate(self.clients):
+            timeout = self._attempt_timeout()
+            if self.policy.first_token_timeout:
+                timeout = min(timeout, self.policy.first_token_timeout)
+            if timeout <= 0:
+                break
+            start = time.monotonic()
+            hedge_delay = self._hedge_delay(timeout) if index == 0 else None
+            try:
+                stream, first = await self._start_stream(client, messages, kwargs, timeout, hedge_delay,
+                                                         cancellation_token)
+            except StopAsyncIteration:
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats.record_timeout(time.monotonic() - start)
+                    errors.append(f"{_client_name(client, index)}: 首个片段超时（{timeout:.1f}秒）")
+                else:
+                    self.stats.increment("errors")
+                    errors.append(f"{_client_name(client, index)}: {type(e).__name__}: {e}")
+                print(f"[警告] {self.stage} 阶段流式调用未能开始，尝试下一个候选模型: {errors[-1]}")
+                continue
+
+            if index == 0:
+                self.stats.record_latency(time.monotonic() - start)
+            else:
+                self.stats.increment("failovers")
+            yield first
+            async for item in stream:
+                remaining = remaining_time()
+                if remaining is not None and remaining <= 0:
+                    await stream.aclose()
+                    raise StageDeadlineExceeded(f"{self.stage} 阶段超出整轮对话时限")
+                yield item
+            return
+
+        raise StageDeadlineExceeded(f"{self.stage} 阶段所有候选模型均未能开始输出: {'; '.join(errors) or '时间已用尽'}")
+
+    async def close(self) -> None:
+        # 底层客户端及其连接池由ModelClientFactory统一管理，这里不关闭
+        return None
+
+    def actual_usage(self) -> RequestUsage:
+        return self.primary.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self.primary.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], **kwargs: Any) -> int:
+        return self.primary.count_tokens(messages, **kwargs)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], **kwargs: Any) -> int:
+        return self.primary.remaining_tokens(messages, **kwargs)
+
+    @property
+    def capabilities(self):  # type: ignore
+        return self.primary.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self.primary.model_info
+
+
+def resilience_enabled() -> bool:
+    """是否为各阶段启用超时与故障转移（STAGE_DEADLINES_ENABLED）"""
+    return get_env_bool("STAGE_DEADLINES_ENABLED", True)
+
+
+def turn_deadline_seconds() -> float:
+    """整轮对话的时限（秒），0表示不限制"""
+    return get_env_float("TURN_DEADLINE", 90.0)
+
+
+def failover_limit() -> int:
+    """每个阶段最多切换的备用模型数量"""
+    return get_env_int("FAILOVER_MAX_MODELS", 1)
@@ -0,0 +1,226 @@
+"""
+内心思考的解析与结构化状态更新
+思考代理先输出【内心独白】，再在【状态更新】部分输出JSON；独白供主对话代理参考，
+状态更新在对话结束后直接在代码中应用到记忆系统，只有解析失败时才交给memory_manager代理处理
+"""
+
+import ast
+import json
+import re
+from typing import List, Optional, Tuple
+
+from emotional_companion.analysis.emotion_classifier import normalize_emotion_label
+from emotional_companion.memory.operations import MemoryOperation, apply_memory_operations
+
+MONOLOGUE_TAG = "【内心独白】"
+REPLY_TAG = "【回复】"
+STATE_UPDATE_TAG = "【状态更新】"
+
+# 思考代理系统提示中使用的输出格式说明
+STATE_UPDATE_INSTRUCTIONS = f"""{STATE_UPDATE_TAG}部分只输出一个JSON对象，不要添加其他文字，格式如下：
+            {{"emotion": "智能体新的情绪名称（英文，如happy、sad、calm），不需要变化时为null",
+              "intensity": 情绪强度(0.1-1.0),
+              "valence": 情感价值(-1.0到1.0),
+              "relationship_events": [{{"description": "事件描述（包括用户的话和你的反应）", "importance": 0.1-1.0, "impact": -1.0到1.0}}],
+              "preferences": [{{"category": "偏好类别，如食物", "item": "具体偏好", "sentiment": -1.0到1.0, "certainty": 0.1-1.0}}],
+              "profile": [{{"category": "信息类别，如生日、职业", "value": "信息内容（涉及相对时间时换算成具体日期）"}}]}}
+            没有对应内容的列表留空，没有任何需要更新的内容时输出 {{}}"""
+
+_SECTION_PATTERN = re.compile(rf"{STATE_UPDATE_TAG}\s*(.*?)(?=\n\s*【|\Z)", re.S)
+_MONOLOGUE_PATTERN = re.compile(rf"{MONOLOGUE_TAG}(.*?)【", re.S)
+_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def _clamp(value, low: float, high: float, default: Optional[float]) -> Optional[float]:
+    try:
+        return max(low, min(high, float(value)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _load_object(text: str) -> Optional[dict]:
+    """把文本解析为字典，兼容代码块包裹和单引号写法"""
+    text = _FENCE_PATTERN.sub("", text.strip())
+    candidates = [text]
+    match = re.search(r"\{.*\}", text, re.S)
+    if match and match.group(0) != text:
+        candidates.append(match.group(0))
+    for candidate in candidates:
+        for loader in (json.loads, ast.literal_eval):
+            try:
+                data = loader(candidate)
+            except (ValueError, SyntaxError, TypeError):
+                continue
+            if isinstance(data, dict):
+                return data
+    return None
+
+
+def _items(data: dict, key: str, required: tuple) -> List[dict]:
+    """取出列表字段中包含必需键且非空的项"""
+    items = data.get(key) or []
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list):
+        return []
+    return [
+        item for item in items
+        if isinstance(item, dict) and all(str(item.get(field) or "").strip() for field in required)
+    ]
+
+
+def parse_state_update(thoughts: str) -> Optional[dict]:
+    """
+    从内心思考中解析结构化状态更新
+
+    Args:
+        thoughts: 思考代理的完整输出
+
+    Returns:
+        规范化后的更新字典；没有【状态更新】部分或无法解析时返回None
+    """
+    if not thoughts:
+        return None
+    match = _SECTION_PATTERN.search(thoughts)
+    if not match:
+        return None
+    data = _load_object(match.group(1))
+    if data is None:
+        return None
+
+    update = {"emotion": None, "intensity": None, "valence": None,
+              "relationship_events": [], "preferences": [], "profile": [], "visual_effect": None}
+
+    emotion = data.get("emotion")
+    if isinstance(emotion, str) and emotion.strip() and emotion.strip().lower() not in ("null", "none"):
+        update["emotion"] = normalize_emotion_label(emotion)
+        update["intensity"] = _clamp(data.get("intensity"), 0.1, 1.0, None)
+        update["valence"] = _clamp(data.get("valence"), -1.0, 1.0, None)
+
+    visual_effect = data.get("visual_effect")
+    if isinstance(visual_effect, str) and visual_effect.strip():
+        update["visual_effect"] = visual_effect.strip()
+
+    for event in _items(data, "relationship_events", ("description",)):
+        update["relationship_events"].append({
+            "description": str(event["description"]).strip(),
+            "importance": _clamp(event.get("importance"), 0.1, 1.0, 0.7),
+            "impact": _clamp(event.get("impact"), -1.0, 1.0, 0.1),
+        })
+    for preference in _items(data, "preferences", ("category", "item")):
+        update["preferences"].append({
+            "category": str(preference["category"]).strip(),
+            "item": str(preference["item"]).strip(),
+            "sentiment": _clamp(preference.get("sentiment"), -1.0, 1.0, 1.0),
+            "certainty": _clamp(preference.get("certainty"), 0.1, 1.0, 0.8),
+        })
+    for fact in _items(data, "profile", ("category", "value")):
+        update["profile"].append({
+            "category": str(fact["category"]).strip(),
+            "value": str(fact["value"]).strip(),
+            "confidence": _clamp(fact.get("confidence"), 0.1, 1.0, 0.9),
+        })
+    return update
+
+
+def closed_monologue(partial_thoughts: str) -> Optional[str]:
+    """
+    从生成中的内心思考里取出已经结束的【内心独白】部分
+
+    独白之后出现下一个标签时视为独白结束，尚未结束时返回None
+    """
+    match = _MONOLOGUE_PATTERN.search(partial_thoughts)
+    if not match or not match.group(1).strip():
+        return None
+    return match.group(1).rstrip()
+
+
+def _section(text: str, tag: str) -> Optional[str]:
+    """取出标签之后、下一个标签之前的内容，没有该标签时返回None"""
+    start = text.find(tag)
+    if start < 0:
+        return None
+    body = text[start + len(tag):]
+    end = body.find("【")
+    return (body if end < 0 else body[:end]).strip()
+
+
+def split_fused_output(text: str) -> Tuple[str, str, str]:
+    """
+    拆分融合模式的输出
+
+    Returns:
+        (内心独白, 回复, 状态更新部分原文)；没有【回复】标签时整段输出都视为回复
+    """
+    reply = _section(text, REPLY_TAG)
+    if reply is None:
+        return "", strip_state_update(text).replace(MONOLOGUE_TAG, "").strip(), ""
+    return _section(text, MONOLOGUE_TAG) or "", reply, _section(text, STATE_UPDATE_TAG) or ""
+
+
+class SectionStreamFilter:
+    """从流式输出中只转发指定标签部分的文本，遇到下一个标签时停止"""
+
+    def __init__(self, tag: str):
+        self.tag = tag
+        self.buffer = ""
+        self.sent = 0
+        self.closed = False
+
+    def feed(self, delta: str) -> str:
+        """输入新片段，返回本次应转发的文本"""
+        self.buffer += delta
+        if self.closed:
+            return ""
+        start = self.buffer.find(self.tag)
+        if start < 0:
+            return ""
+        body = self.buffer[start + len(self.tag):].lstrip()
+        end = body.find("【")
+        if end >= 0:
+            self.closed = True
+            body = body[:end]
+        # 末尾的空白可能位于下一个标签之前，等后续片段到达后再转发
+        body = body.rstrip()
+        text = body[self.sent:]
+        self.sent = max(self.sent, len(body))
+        return text
+
+
+def strip_state_update(thoughts: str) -> str:
+    """去掉【状态更新】部分，只保留给主对话代理参考的思考内容"""
+    if not thoughts or STATE_UPDATE_TAG not in thoughts:
+        return thoughts
+    return _SECTION_PATTERN.sub("", thoughts).strip()
+
+
+def state_update_operations(update: dict) -> List[MemoryOperation]:
+    """把解析后的状态更新转换为批量记忆操作"""
+    operations = []
+    if update.get("emotion"):
+        operations.append(MemoryOperation(op="update_emotion", emotion=update["emotion"],
+                                          intensity=update.get("intensity"), valence=update.get("valence")))
+    operations += [MemoryOperation(op="record_relationship_event", **event)
+                   for event in update.get("relationship_events", [])]
+    operations += [MemoryOperation(op="save_user_preference", **preference)
+                   for preference in update.get("preferences", [])]
+    operations += [MemoryOperation(op="save_user_profile_info", **fact)
+                   for fact in update.get("profile", [])]
+    return operations
+
+
+def apply_state_update(memory_system, update: dict) -> str:
+    """
+    把解析后的状态更新在一次批量写入中应用到记忆系统
+
+    Args:
+        memory_system: EmotionalMemorySystem实例
+        update: parse_state_update的返回值
+
+    Returns:
+        已执行更新的简要说明
+    """
+    operations = state_update_operations(update)
+    if not operations:
+        return "无状态更新"
+    return apply_memory_operations(memory_system, operations)
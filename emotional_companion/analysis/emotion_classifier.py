@@ -0,0 +1,268 @@
+"""
+本地情绪分类器
+复用记忆系统已加载的bge嵌入模型，结合带标注种子集的kNN投票和情绪词典，
+输出与emotion_analyzer代理相同的 {'emotion', 'intensity', 'valence'} 结构
+"""
+
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 标注种子集: (文本, 情绪, 强度, 价值)
+SEED_EXAMPLES: List[Tuple[str, str, float, float]] = [
+    ("今天超级开心！", "happy", 0.8, 0.8),
+    ("哈哈哈太好笑了", "happy", 0.7, 0.7),
+    ("终于考完试了，好轻松", "happy", 0.6, 0.6),
+    ("今天天气真好，心情不错", "happy", 0.5, 0.6),
+    ("I'm so happy today!", "happy", 0.8, 0.8),
+    ("我拿到offer了！！！", "excited", 0.9, 0.9),
+    ("明天就要去旅行了，好期待", "excited", 0.8, 0.8),
+    ("太激动了，简直不敢相信", "excited", 0.9, 0.8),
+    ("I can't wait for the concert tonight!", "excited", 0.8, 0.8),
+    ("谢谢你一直陪着我", "grateful", 0.7, 0.8),
+    ("有你真好，谢谢", "grateful", 0.7, 0.8),
+    ("Thank you so much for listening", "grateful", 0.6, 0.7),
+    ("我好喜欢你呀", "affectionate", 0.8, 0.9),
+    ("想你了", "affectionate", 0.7, 0.6),
+    ("抱抱你", "affectionate", 0.6, 0.7),
+    ("嗯，知道了", "neutral", 0.3, 0.0),
+    ("我在上班", "neutral", 0.3, 0.0),
+    ("今天吃了面条", "neutral", 0.3, 0.1),
+    ("What time is it now?", "neutral", 0.2, 0.0),
+    ("晚上就在家看看书，挺安静的", "calm", 0.4, 0.3),
+    ("一切都还好，慢慢来", "calm", 0.4, 0.3),
+    ("今天好难过", "sad", 0.7, -0.7),
+    ("我失恋了", "sad", 0.8, -0.8),
+    ("想哭，感觉什么都做不好", "sad", 0.8, -0.8),
+    ("I feel really down today", "sad", 0.7, -0.7),
+    ("一个人在家好孤单", "lonely", 0.7, -0.6),
+    ("没有人理解我", "lonely", 0.7, -0.7),
+    ("周末又是一个人过", "lonely", 0.5, -0.5),
+    ("明天要面试，好紧张", "anxious", 0.7, -0.5),
+    ("最近压力好大，睡不着", "anxious", 0.8, -0.6),
+    ("好担心考不过", "anxious", 0.7, -0.6),
+    ("I'm so worried about tomorrow", "anxious", 0.7, -0.6),
+    ("气死我了！", "angry", 0.9, -0.8),
+    ("老板又让我加班，烦死了", "angry", 0.7, -0.6),
+    ("凭什么这样对我", "angry", 0.8, -0.7),
+    ("This is so annoying", "angry", 0.6, -0.6),
+    ("好累啊，不想动", "tired", 0.6, -0.4),
+    ("加了一天班，累瘫了", "tired", 0.7, -0.5),
+    ("困死了，想睡觉", "tired", 0.6, -0.3),
+    ("啊？真的吗？", "surprised", 0.6, 0.1),
+    ("没想到会这样", "surprised", 0.6, 0.0),
+    ("这是什么意思，我没看懂", "confused", 0.5, -0.1),
+    ("不知道该怎么办", "confused", 0.6, -0.3),
+    ("唉，又失败了", "disappointed", 0.6, -0.6),
+    ("本来很期待的，结果好失望", "disappointed", 0.7, -0.6),
+    ("有点害怕，外面好黑", "scared", 0.7, -0.6),
+    ("做噩梦了，吓死我了", "scared", 0.8, -0.7),
+]
+
+# 情绪词典: 情绪 -> 关键词
+EMOTION_LEXICON: Dict[str, List[str]] = {
+    "happy": ["开心", "高兴", "快乐", "哈哈", "嘻嘻", "愉快", "不错", "棒", "😊", "😄", "😁", "happy", "glad", "great"],
+    "excited": ["激动", "兴奋", "期待", "太棒了", "耶", "🎉", "excited", "can't wait"],
+    "grateful": ["谢谢", "感谢", "感激", "多亏", "thank", "thanks", "grateful"],
+    "affectionate": ["喜欢你", "爱你", "想你", "抱抱", "亲亲", "❤", "💕", "love you", "miss you"],
+    "calm": ["平静", "安静", "放松", "还好", "慢慢来", "calm", "relaxed"],
+    "sad": ["难过", "伤心", "想哭", "哭了", "失恋", "心痛", "😢", "😭", "sad", "upset", "down"],
+    "lonely": ["孤单", "孤独", "寂寞", "一个人", "没人理", "lonely", "alone"],
+    "anxious": ["紧张", "焦虑", "担心", "压力", "睡不着", "不安", "anxious", "worried", "nervous"],
+    "angry": ["生气", "气死", "烦死", "讨厌", "愤怒", "凭什么", "😡", "angry", "annoying", "mad"],
+    "tired": ["累", "困", "疲惫", "没精神", "想睡", "tired", "exhausted", "sleepy"],
+    "surprised": ["惊讶", "没想到", "居然", "竟然", "真的吗", "😮", "wow", "surprised"],
+    "confused": ["不懂", "不明白", "怎么办", "迷茫", "困惑", "confused"],
+    "disappointed": ["失望", "可惜", "唉", "白费", "disappointed"],
+    "scared": ["害怕", "吓死", "恐怖", "噩梦", "scared", "afraid"],
+}
+
+# 情绪名称别名，用于对齐LLM返回的中英文标签
+EMOTION_ALIASES: Dict[str, str] = {
+    "开心": "happy", "高兴": "happy", "快乐": "happy", "愉快": "happy", "joy": "happy", "joyful": "happy",
+    "激动": "excited", "兴奋": "excited", "期待": "excited", "anticipation": "excited",
+    "感激": "grateful", "感谢": "grateful", "gratitude": "grateful", "thankful": "grateful",
+    "喜爱": "affectionate", "爱": "affectionate", "love": "affectionate", "思念": "affectionate",
+    "平静": "calm", "放松": "calm", "relaxed": "calm", "content": "calm", "满足": "calm",
+    "中性": "neutral", "中立": "neutral", "平淡": "neutral",
+    "悲伤": "sad", "难过": "sad", "伤心": "sad", "sadness": "sad", "depressed": "sad",
+    "孤独": "lonely", "寂寞": "lonely", "loneliness": "lonely",
+    "焦虑": "anxious", "紧张": "anxious", "担心": "anxious", "anxiety": "anxious", "worried": "anxious", "nervous": "anxious",
+    "生气": "angry", "愤怒": "angry", "烦躁": "angry", "anger": "angry", "annoyed": "angry", "frustrated": "angry",
+    "疲惫": "tired", "疲倦": "tired", "累": "tired", "exhausted": "tired",
+    "惊讶": "surprised", "surprise": "surprised",
+    "困惑": "confused", "迷茫": "confused", "confusion": "confused",
+    "失望": "disappointed", "disappointment": "disappointed",
+    "害怕": "scared", "恐惧": "scared", "fear": "scared", "afraid": "scared",
+}
+
+def _keyword_pattern(keyword: str) -> re.Pattern:
+    """英文关键词按单词边界匹配（避免"down"命中"download"），中文和表情符号按子串匹配"""
+    escaped = re.escape(keyword.lower())
+    if re.search(r"[a-z]", keyword, re.I):
+        return re.compile(rf"(?<![a-z]){escaped}(?![a-z])")
+    return re.compile(escaped)
+
+
+LEXICON_PATTERNS: Dict[str, List[re.Pattern]] = {
+    emotion: [_keyword_pattern(keyword) for keyword in keywords]
+    for emotion, keywords in EMOTION_LEXICON.items()
+}
+
+_INTENSIFIERS = ["非常", "超级", "特别", "太", "好", "真的", "死了", "极了", "so ", "very ", "really "]
+_NEGATIONS = ("不", "没", "别", "not ", "n't ")
+
+NEUTRAL_EMOTION = {"emotion": "neutral", "intensity": 0.5, "valence": 0.0}
+
+
+def normalize_emotion_label(label: Optional[str]) -> str:
+    """将中英文情绪名称统一为分类器使用的标签"""
+    if not label:
+        return "neutral"
+    key = str(label).strip().lower()
+    if key in EMOTION_LEXICON or key == "neutral":
+        return key
+    return EMOTION_ALIASES.get(key, EMOTION_ALIASES.get(str(label).strip(), key))
+
+
+class LocalEmotionClassifier:
+    """基于嵌入kNN与情绪词典的本地情绪分类器"""
+
+    def __init__(self, embedding_function: Optional[Callable] = None, k: int = 5,
+                 confidence_threshold: float = 0.45, lexicon_weight: float = 0.3,
+                 seed_examples: Optional[List[Tuple[str, str, float, float]]] = None):
+        """
+        初始化分类器
+
+        Args:
+            embedding_function: 文本嵌入函数（接收文本列表返回向量列表），通常复用记忆系统的bge模型；
+                                为None时只使用情绪词典
+            k: kNN近邻数量
+            confidence_threshold: 低于该置信度时建议回退到LLM
+            lexicon_weight: 词典得分在综合得分中的权重
+            seed_examples: 自定义标注种子集
+        """
+        self.embedding_function = embedding_function
+        self.k = k
+        self.confidence_threshold = confidence_threshold
+        self.lexicon_weight = lexicon_weight
+        self.seed_examples = seed_examples or SEED_EXAMPLES
+
+        self._seed_matrix = None
+        self._seed_lock = threading.Lock()
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """计算归一化后的嵌入矩阵"""
+        vectors = np.asarray(self.embedding_function(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-8, None)
+
+    def warmup(self):
+        """预先计算种子集嵌入，避免首条消息承担初始化开销"""
+        if self.embedding_function is None or self._seed_matrix is not None:
+            return
+        with self._seed_lock:
+            if self._seed_matrix is None:
+                self._seed_matrix = self._embed([example[0] for example in self.seed_examples])
+
+    def _knn_scores(self, text: str) -> Tuple[Dict[str, float], Dict[str, List[Tuple[float, int]]], float]:
+        """kNN投票，返回各情绪得分、各情绪命中的(相似度, 种子下标)以及最高相似度"""
+        self.warmup()
+        query = self._embed([text])[0]
+        similarities = self._seed_matrix @ query
+        top_indices = np.argsort(-similarities)[:self.k]
+
+        scores: Dict[str, float] = {}
+        neighbors: Dict[str, List[Tuple[float, int]]] = {}
+        total = 0.0
+        for index in top_indices:
+            similarity = float(max(similarities[index], 0.0))
+            emotion = self.seed_examples[index][1]
+            scores[emotion] = scores.get(emotion, 0.0) + similarity
+            neighbors.setdefault(emotion, []).append((similarity, int(index)))
+            total += similarity
+
+        if total > 0:
+            scores = {emotion: score / total for emotion, score in scores.items()}
+        return scores, neighbors, float(similarities[top_indices[0]]) if len(top_indices) else 0.0
+
+    def _lexicon_scores(self, text: str) -> Dict[str, float]:
+        """统计情绪词典命中，跳过紧跟在否定词之后的关键词"""
+        lowered = text.lower()
+        hits: Dict[str, float] = {}
+        for emotion, patterns in LEXICON_PATTERNS.items():
+            for pattern in patterns:
+                match = pattern.search(lowered)
+                if match is None:
+                    continue
+                position = match.start()
+                prefix = lowered[max(0, position - 4):position]
+                if any(prefix.endswith(negation) for negation in _NEGATIONS):
+                    continue
+                hits[emotion] = hits.get(emotion, 0.0) + 1.0
+        total = sum(hits.values())
+        return {emotion: count / total for emotion, count in hits.items()} if total else {}
+
+    def _estimate_intensity(self, text: str, base: float) -> float:
+        """根据程度副词和标点调整强度"""
+        boost = 0.1 * sum(1 for word in _INTENSIFIERS if word in text.lower())
+        boost += 0.05 * min(len(re.findall(r"[!！]", text)), 4)
+        return round(max(0.1, min(1.0, base + boost)), 2)
+
+    def classify(self, text: str) -> Tuple[dict, float]:
+        """
+        对文本进行情绪分类
+
+        Returns:
+            tuple: ({'emotion', 'intensity', 'valence'}, 置信度0-1)
+        """
+        if not text or not text.strip():
+            return dict(NEUTRAL_EMOTION), 1.0
+
+        lexicon_scores = self._lexicon_scores(text)
+        knn_scores, neighbors, top_similarity = {}, {}, 0.0
+        if self.embedding_function is not None:
+            knn_scores, neighbors, top_similarity = self._knn_scores(text)
+
+        # 综合kNN与词典得分
+        emotions = set(knn_scores) | set(lexicon_scores)
+        if not emotions:
+            return dict(NEUTRAL_EMOTION), 0.0
+
+        if knn_scores and lexicon_scores:
+            combined = {emotion: (1 - self.lexicon_weight) * knn_scores.get(emotion, 0.0)
+                        + self.lexicon_weight * lexicon_scores.get(emotion, 0.0) for emotion in emotions}
+        else:
+            combined = knn_scores or lexicon_scores
+
+        emotion = max(combined, key=combined.get)
+
+        # 置信度 = 综合得分占比 × 近邻相似度（仅有词典时按词典命中打折）
+        if knn_scores:
+            confidence = combined[emotion] * min(1.0, top_similarity / 0.8)
+        else:
+            confidence = combined[emotion] * 0.6
+
+        # 强度与价值取获胜情绪近邻的加权平均，无近邻时使用默认值
+        emotion_neighbors = neighbors.get(emotion, [])
+        weight_sum = sum(similarity for similarity, _ in emotion_neighbors)
+        if weight_sum > 0:
+            intensity = sum(sim * self.seed_examples[i][2] for sim, i in emotion_neighbors) / weight_sum
+            valence = sum(sim * self.seed_examples[i][3] for sim, i in emotion_neighbors) / weight_sum
+        else:
+            seeds = [example for example in self.seed_examples if example[1] == emotion]
+            intensity = sum(example[2] for example in seeds) / len(seeds) if seeds else 0.5
+            valence = sum(example[3] for example in seeds) / len(seeds) if seeds else 0.0
+
+        result = {
+            "emotion": emotion,
+            "intensity": self._estimate_intensity(text, intensity),
+            "valence": round(max(-1.0, min(1.0, valence)), 2),
+        }
+        return result, round(float(confidence), 3)
+
+    def is_confident(self, confidence: float) -> bool:
+        """判断置信度是否足以直接采用本地结果"""
+        return confidence >= self.confidence_threshold
@@ -0,0 +1,181 @@
+"""
+消息分流
+在完整对话流程之前对用户消息做本地分流：问候、应答（"嗯"、"好的"、"晚安"）和纯表情等
+简单消息走轻量流程，实质性消息保留完整的情绪分析、记忆检索和内心思考。
+规则优先，规则无法判断的短消息再用嵌入kNN在简单/实质两类种子集之间投票
+"""
+
+import re
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from emotional_companion.analysis.emotion_classifier import LEXICON_PATTERNS
+
+ROUTE_FULL = "full"
+ROUTE_LIGHT = "light"
+
+# 可以直接走轻量流程的短语（已去除末尾标点、转为小写）
+TRIVIAL_PHRASES = {
+    "嗯", "嗯嗯", "恩", "恩恩", "哦", "哦哦", "噢", "喔", "好", "好的", "好哒", "好滴", "好吧", "行", "可以",
+    "收到", "知道了", "明白", "明白了", "了解", "对", "对的", "是的", "是", "没事", "没关系", "ok", "okay", "k",
+    "早", "早安", "早上好", "午安", "中午好", "下午好", "晚上好", "晚安", "你好", "您好", "嗨", "哈喽", "在吗", "在",
+    "谢谢", "谢啦", "多谢", "拜拜", "再见", "回头见", "hi", "hello", "hey", "thanks", "thx", "bye", "good night",
+    "good morning", "yes", "yeah", "yep", "no", "nope",
+}
+
+# 简单消息种子集
+TRIVIAL_SEEDS: List[str] = [
+    "嗯嗯好的", "好呀", "哈哈哈", "晚安啦", "早安呀", "我来啦", "在的在的", "好嘞", "行吧", "噢噢知道啦",
+    "嘿嘿", "拜拜啦", "谢谢啦", "你好呀", "哈喽哈喽", "ok的", "好滴好滴", "对呀", "是呢", "晚安好梦",
+]
+
+# 实质性消息种子集
+SUBSTANTIVE_SEEDS: List[str] = [
+    "我今天被老板骂了", "明天要考试了", "你还记得我生日吗", "我想换工作", "最近睡不好", "我和朋友吵架了",
+    "推荐一本书吧", "我养了一只猫", "周末去哪玩好", "我生病了", "你觉得我该怎么办", "今天发工资了",
+    "我妈妈住院了", "帮我想个名字", "我喜欢吃火锅", "下周要出差", "你最近在想什么", "我失眠了",
+]
+
+# 短消息中出现这些负面或需要关注的情绪词时保留完整流程
+_ATTENTION_EMOTIONS = ("sad", "lonely", "anxious", "angry", "tired", "scared", "disappointed", "confused")
+
+_TRAILING_PUNCTUATION = re.compile(r"[\s~～!！。.,，…、]+$")
+_LAUGHTER = re.compile(r"^(哈|嘿|呵|嘻|hh|ha|he|lol)+$")
+# 由表情、符号、标点和空白组成的消息
+_SYMBOLS_ONLY = re.compile(r"^[\W_\s☀-➿\U0001F000-\U0001FAFF️‍]*$")
+
+
+def _normalize(text: str) -> str:
+    return _TRAILING_PUNCTUATION.sub("", text.strip().lower())
+
+
+class RouteStats:
+    """单条分流路径的计数与延迟"""
+
+    def __init__(self, window: int = 200):
+        self.count = 0
+        self.latencies = deque(maxlen=window)
+        self.reasons: Dict[str, int] = {}
+
+    def to_dict(self, total: int) -> dict:
+        ordered = sorted(self.latencies)
+
+        def percentile(ratio):
+            return round(ordered[min(len(ordered) - 1, int(ratio * (len(ordered) - 1)))] * 1000, 1) if ordered else None
+
+        return {
+            "count": self.count,
+            "share": round(self.count / total, 3) if total else 0.0,
+            "avg_ms": round(sum(ordered) / len(ordered) * 1000, 1) if ordered else None,
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "reasons": dict(self.reasons),
+        }
+
+
+class TriageRouter:
+    """基于规则和嵌入kNN的消息分流器"""
+
+    def __init__(self, embedding_function: Optional[Callable] = None, max_chars: int = 12,
+                 k: int = 5, light_threshold: float = 0.8, min_similarity: float = 0.6):
+        """
+        初始化分流器
+
+        Args:
+            embedding_function: 文本嵌入函数，通常复用记忆系统的bge模型；为None时只使用规则
+            max_chars: 超过该长度的消息直接走完整流程
+            k: kNN近邻数量
+            light_threshold: 近邻中简单消息的相似度占比达到该值时走轻量流程
+            min_similarity: 最近邻相似度低于该值时不采用嵌入结果
+        """
+        self.embedding_function = embedding_function
+        self.max_chars = max_chars
+        self.k = k
+        self.light_threshold = light_threshold
+        self.min_similarity = min_similarity
+
+        self._seed_texts = TRIVIAL_SEEDS + SUBSTANTIVE_SEEDS
+        self._seed_matrix = None
+        self._seed_lock = threading.Lock()
+
+        self._stats: Dict[str, RouteStats] = {ROUTE_FULL: RouteStats(), ROUTE_LIGHT: RouteStats()}
+        self._stats_lock = threading.Lock()
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.asarray(self.embedding_function(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-8, None)
+
+    def warmup(self):
+        """预先计算种子集嵌入"""
+        if self.embedding_function is None or self._seed_matrix is not None:
+            return
+        with self._seed_lock:
+            if self._seed_matrix is None:
+                self._seed_matrix = self._embed(self._seed_texts)
+
+    def _needs_attention(self, text: str) -> bool:
+        """短消息中是否带有需要认真回应的情绪词或问题"""
+        if "?" in text or "？" in text:
+            return True
+        lowered = text.lower()
+        # 与情绪分类器相同的匹配规则：英文词按单词边界匹配，"download"不会命中"down"
+        return any(pattern.search(lowered)
+                   for emotion in _ATTENTION_EMOTIONS for pattern in LEXICON_PATTERNS[emotion])
+
+    def _embedding_vote(self, text: str) -> Tuple[float, float]:
+        """返回(近邻中简单消息的相似度占比, 最高相似度)"""
+        self.warmup()
+        query = self._embed([text])[0]
+        similarities = self._seed_matrix @ query
+        top_indices = np.argsort(-similarities)[:self.k]
+        weights = np.clip(similarities[top_indices], 0.0, None)
+        total = float(weights.sum())
+        trivial = float(sum(weight for index, weight in zip(top_indices, weights) if index < len(TRIVIAL_SEEDS)))
+        return (trivial / total if total > 0 else 0.0), float(similarities[top_indices[0]])
+
+    def route(self, text: str) -> Tuple[str, str]:
+        """
+        判断消息的处理路径
+
+        Returns:
+            tuple: (路径 full/light, 判定依据)
+        """
+        if not text or _SYMBOLS_ONLY.match(text):
+            return ROUTE_LIGHT, "emoji"
+
+        normalized = _normalize(text)
+        if normalized.rstrip("?？") in TRIVIAL_PHRASES or _LAUGHTER.match(normalized):
+            return ROUTE_LIGHT, "phrase"
+        if len(normalized) > self.max_chars:
+            return ROUTE_FULL, "length"
+        if self._needs_attention(normalized):
+            return ROUTE_FULL, "attention"
+        if self.embedding_function is None:
+            return ROUTE_FULL, "default"
+
+        try:
+            trivial_share, top_similarity = self._embedding_vote(normalized)
+        except Exception as e:
+            print(f"[警告] 消息分流嵌入计算失败，按完整流程处理: {e}")
+            return ROUTE_FULL, "default"
+        if top_similarity >= self.min_similarity and trivial_share >= self.light_threshold:
+            return ROUTE_LIGHT, "embedding"
+        return ROUTE_FULL, "embedding"
+
+    def record(self, route: str, reason: str, seconds: float):
+        """记录一轮对话的分流结果和总耗时"""
+        with self._stats_lock:
+            stats = self._stats.setdefault(route, RouteStats())
+            stats.count += 1
+            stats.latencies.append(seconds)
+            stats.reasons[reason] = stats.reasons.get(reason, 0) + 1
+
+    def get_stats(self) -> Dict[str, dict]:
+        """获取各路径的消息数、占比和延迟"""
+        with self._stats_lock:
+            total = sum(stats.count for stats in self._stats.values())
+            return {route: stats.to_dict(total) for route, stats in self._stats.items()}
@@ -1,9 +1,27 @@
 import chromadb
 import json
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
 import os
 import random
 from chromadb.utils import embedding_functions
+from emotional_companion.memory.journal import JOURNAL_FILENAME, WriteAheadJournal, journal_enabled
+from emotional_companion.memory.unit_of_work import MemoryUnitOfWork, coalesce_operations
+from emotional_companion.memory.schema import build_schema_fields, time_range_filter, to_epoch
+from emotional_companion.utils.tracing import TracedProxy, tracer
+
+# 需要记录耗时的ChromaDB集合操作
+TRACED_COLLECTION_METHODS = ("add", "query", "get", "update", "upsert", "delete", "count")
+
+
+class TracedEmbeddingFunction(embedding_functions.SentenceTransformerEmbeddingFunction):
+    """记录每次嵌入计算耗时的句向量嵌入函数"""
+
+    def __call__(self, input):
+        with tracer.span("embedding", texts=len(input)):
+            return super().__call__(input)
+
 
 class EmotionalMemorySystem:
     def __init__(self, persist_directory="memory_db"):
@@ -26,7 +44,7 @@ class EmotionalMemorySystem:
 
         print(f"✅ ChromaDB客户端已初始化，持久化目录: {persist_directory}")
 
-        self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
+        self.embedding_function = TracedEmbeddingFunction(
             model_name="BAAI/bge-base-zh-v1.5",
             device="cpu"
         )
@@ -64,12 +82,30 @@ class EmotionalMemorySystem:
                                                             embedding_function=self.embedding_function,
                                                             metadata=self.hnsw_metadata_config)
         }
+        # 记录每次集合操作的耗时，嵌入计算另有单独的span
+        self.collections = {
+            name: TracedProxy(collection, f"chroma.{name}", TRACED_COLLECTION_METHODS)
+            for name, collection in self.collections.items()
+        }
 
         
         # 记忆衰减参数
         self.decay_rate = 0.05
         self.importance_threshold = 0.3
         
+        # 当前上下文的工作单元，见batch_writes
+        self._current_unit = ContextVar(f"memory_unit_{id(self)}", default=None)
+        self._write_stats = {"units": 0, "mutations": 0, "writes": 0, "state_saves_collapsed": 0}
+        
+        # 预写日志：写入ChromaDB之前先落盘，启动时重放上次未确认完成的写入
+        self.journal = None
+        if journal_enabled():
+            self.journal = WriteAheadJournal(os.path.join(persist_directory, JOURNAL_FILENAME))
+            try:
+                self.journal.replay(self._apply_write)
+            except Exception as e:
+                print(f"[警告] 重放记忆预写日志失败，日志保留到下次启动: {e}")
+        
         # 情感状态
         self.emotional_state = {
             "current_emotion": "neutral",
@@ -92,8 +128,136 @@ class EmotionalMemorySystem:
         except Exception as e:
             print(f"加载情感状态失败: {e}")
     
+    @contextmanager
+    def batch_writes(self):
+        """
+        批量写入上下文（工作单元）
+        
+        期间的所有集合写入先收集起来，多次保存情感状态合并为结束时的一次保存，同一集合的连续插入合并为一次写入，
+        最后作为一条预写日志记录一次提交。工作单元沿上下文传递，asyncio.to_thread和工具线程中的写入也归入其中。
+        嵌套使用时并入外层工作单元：内层出错只回滚内层收集的写入，外层结束时统一提交。
+        出错时只撤销本单元对内存中情感状态字段的修改，其他会话或任务同时做出的修改不受影响
+        """
+        outer = self._current_unit.get()
+        if outer is not None:
+            savepoint = outer.savepoint()
+            try:
+                yield
+            except Exception:
+                self._undo_state_changes(outer.rollback_to(savepoint))
+                raise
+            return
+        
+        unit = MemoryUnitOfWork()
+        token = self._current_unit.set(unit)
+        try:
+            yield
+        except Exception:
+            self._undo_state_changes(unit.rollback_to((0, False, 0, 0)))
+            raise
+        finally:
+            self._current_unit.reset(token)
+        self._commit_unit(unit)
+    
+    def _set_state(self, field, value):
+        """修改内存中的情感状态字段，处于工作单元中时记录修改以便回滚"""
+        unit = self._current_unit.get()
+        if unit is not None:
+            unit.record_state_change(field, self.emotional_state.get(field), value)
+        self.emotional_state[field] = value
+    
+    def _undo_state_changes(self, changes):
+        """按相反顺序撤销修改；字段在此期间已被其他任务再次修改的保持不变"""
+        for field, old_value, new_value in reversed(changes):
+            if self.emotional_state.get(field) == new_value:
+                self.emotional_state[field] = old_value
+    
+    @contextmanager
+    def unit_of_work(self):
+        """
+        一轮对话的工作单元：与batch_writes相同，但块内抛出的异常不会丢弃已收集的写入，
+        退出时总是提交，保证对话后处理中途出错时已完成的部分仍被保存
+        """
+        if self._current_unit.get() is not None:
+            yield
+            return
+        unit = MemoryUnitOfWork()
+        token = self._current_unit.set(unit)
+        try:
+            yield
+        finally:
+            self._current_unit.reset(token)
+            self._commit_unit(unit)
+    
+    def _commit_unit(self, unit):
+        """合并并提交工作单元中的写入"""
+        if unit.is_empty:
+            return
+        operations = coalesce_operations(unit.operations)
+        if unit.state_dirty:
+            operations.append(self._emotional_state_write())
+        self._write_stats["units"] += 1
+        self._write_stats["mutations"] += len(unit.operations) + unit.state_saves
+        self._write_stats["writes"] += len(operations)
+        self._write_stats["state_saves_collapsed"] += max(0, unit.state_saves - 1)
+        # 整个工作单元作为一条日志记录，只需一次fsync
+        self._apply_operations(operations)
+    
+    def _apply_write(self, collection_name, method, args):
+        getattr(self.collections[collection_name], method)(**args)
+    
+    def _apply_operations(self, operations):
+        """
+        执行一组集合写入：先记入预写日志，全部写入ChromaDB后标记为已应用
+
+        写入中途出错时日志记录保留，下次启动时重放
+        """
+        if not operations:
+            return
+        seq = self.journal.record(operations) if self.journal is not None else None
+        for collection_name, method, args in operations:
+            self._apply_write(collection_name, method, args)
+        if seq is not None:
+            self.journal.applied(seq)
+    
+    def _write_many(self, operations):
+        """执行一组集合写入，处于工作单元中时收集到单元结束时提交"""
+        unit = self._current_unit.get()
+        if unit is not None:
+            unit.add(operations)
+            return
+        self._write_stats["writes"] += len(operations)
+        self._apply_operations(operations)
+    
+    def _write(self, collection_name, method, **args):
+        """执行单个集合写入，见_write_many"""
+        self._write_many([(collection_name, method, args)])
+    
+    def _pending_record_id(self, collection_name, category):
+        """本工作单元中尚未提交的该类别记录ID，不在工作单元中或没有时返回None"""
+        unit = self._current_unit.get()
+        return unit.pending_record_id(collection_name, category) if unit is not None else None
+    
+    def _add_record(self, collection_name, record_id, metadata, document):
+        """写入一条记录"""
+        self._write(collection_name, "add", ids=[record_id], metadatas=[metadata], documents=[document])
+    
     def save_emotional_state(self):
-        """保存当前情感状态"""
+        """保存当前情感状态，处于工作单元中时只在单元结束时保存最终状态"""
+        unit = self._current_unit.get()
+        if unit is not None:
+            unit.mark_state_dirty()
+            return
+        self._write_many([self._emotional_state_write()])
+    
+    def get_write_stats(self) -> dict:
+        """获取工作单元合并写入的统计和预写日志状态"""
+        stats = dict(self._write_stats)
+        stats["journal"] = self.journal.get_stats() if self.journal is not None else None
+        return stats
+    
+    def _emotional_state_write(self):
+        """生成保存当前情感状态的集合写入"""
         self.emotional_state["last_updated"] = datetime.now().isoformat()
         state_id = f"emotional_state_{datetime.now().isoformat()}"
         
@@ -101,11 +265,10 @@ class EmotionalMemorySystem:
                      f"强度: {self.emotional_state['emotion_intensity']}, " \
                      f"关系程度: {self.emotional_state['relationship_level']}"
         
-        self.collections["emotional"].add(
-            ids=[state_id],
-            metadatas=[{"state_data": json.dumps(self.emotional_state)}],
-            documents=[state_text]
-        )
+        metadata = {"state_data": json.dumps(self.emotional_state)}
+        metadata.update(build_schema_fields(state_text, self.emotional_state["last_updated"]))
+        
+        return "emotional", "add", {"ids": [state_id], "metadatas": [metadata], "documents": [state_text]}
     
     def add_episodic_memory(self, user_message, agent_response, 
                            user_emotion=None, context=None, importance=0.5):
@@ -140,12 +303,10 @@ class EmotionalMemorySystem:
         if context:
             metadata["context"] = context
         
+        metadata.update(build_schema_fields(memory_text, timestamp, timestamp))
+        
         # 保存到ChromaDB
-        self.collections["episodic"].add(
-            ids=[memory_id],
-            metadatas=[metadata],
-            documents=[memory_text]
-        )
+        self._write("episodic", "add", ids=[memory_id], metadatas=[metadata], documents=[memory_text])
         
         # 如果是积极互动，可能增加关系亲密度
         if user_emotion and user_emotion.get("valence", 0) > 0.6:
@@ -162,17 +323,16 @@ class EmotionalMemorySystem:
         self.update_relationship_level(impact)
         
         # 保存事件
-        self.collections["relationship"].add(
-            ids=[event_id],
-            metadatas=[{
-                "timestamp": timestamp,
-                "type": "relationship_event",
-                "importance": importance,
-                "relationship_level": self.emotional_state["relationship_level"],
-                "impact": impact
-            }],
-            documents=[event_description]
-        )
+        metadata = {
+            "timestamp": timestamp,
+            "type": "relationship_event",
+            "importance": importance,
+            "relationship_level": self.emotional_state["relationship_level"],
+            "impact": impact
+        }
+        metadata.update(build_schema_fields(event_description, timestamp))
+        
+        self._add_record("relationship", event_id, metadata, event_description)
     
     def add_user_preference(self, category, item, sentiment=1.0, certainty=0.8):
         """添加用户偏好记忆"""
@@ -181,41 +341,34 @@ class EmotionalMemorySystem:
         
         preference_text = f"用户{sentiment>0 and '喜欢' or '不喜欢'}{category}: {item}"
         
-        # 查询是否已存在相同偏好
-        existing = self.collections["preferences"].query(
-            query_texts=[f"{category} {item}"],
-            n_results=1,
-            where={"category": category}
-        )
+        # 查询是否已存在相同偏好，本轮已写入但尚未提交的优先
+        pending_id = self._pending_record_id("preferences", category)
+        if pending_id is not None:
+            existing = {"ids": [[pending_id]]}
+        else:
+            existing = self.collections["preferences"].query(
+                query_texts=[f"{category} {item}"],
+                n_results=1,
+                where={"category": category}
+            )
+        
+        metadata = {
+            "category": category,
+            "item": item,
+            "sentiment": sentiment,
+            "certainty": certainty,
+            "timestamp": timestamp,
+            "last_confirmed": timestamp
+        }
+        metadata.update(build_schema_fields(preference_text, timestamp))
         
         # 如果存在且确定性较高，则更新
         if existing and len(existing["ids"]) > 0 and len(existing["ids"][0]) > 0 and certainty > 0.7:
-            self.collections["preferences"].update(
-                ids=[existing["ids"][0][0]],
-                metadatas=[{
-                    "category": category,
-                    "item": item,
-                    "sentiment": sentiment, 
-                    "certainty": certainty,
-                    "timestamp": timestamp,
-                    "last_confirmed": timestamp
-                }],
-                documents=[preference_text]
-            )
+            self._write("preferences", "update",
+                        ids=[existing["ids"][0][0]], metadatas=[metadata], documents=[preference_text])
         else:
             # 否则添加新偏好
-            self.collections["preferences"].add(
-                ids=[preference_id],
-                metadatas=[{
-                    "category": category,
-                    "item": item,
-                    "sentiment": sentiment,
-                    "certainty": certainty,
-                    "timestamp": timestamp,
-                    "last_confirmed": timestamp
-                }],
-                documents=[preference_text]
-            )
+            self._write("preferences", "add", ids=[preference_id], metadatas=[metadata], documents=[preference_text])
     
     def update_relationship_level(self, change):
         """更新关系亲密度"""
@@ -229,7 +382,7 @@ class EmotionalMemorySystem:
             adjusted_change = change
             
         new_level = max(1.0, min(10.0, current + adjusted_change))
-        self.emotional_state["relationship_level"] = new_level
+        self._set_state("relationship_level", new_level)
         self.save_emotional_state()
         
         # 记录重要关系变化
@@ -239,26 +392,35 @@ class EmotionalMemorySystem:
     
     def update_emotional_state(self, emotion, intensity=None, valence=None):
         """更新情感状态"""
-        self.emotional_state["current_emotion"] = emotion
+        self._set_state("current_emotion", emotion)
         
         if intensity is not None:
-            self.emotional_state["emotion_intensity"] = intensity
+            self._set_state("emotion_intensity", intensity)
             
         if valence is not None:
-            self.emotional_state["valence"] = valence
+            self._set_state("valence", valence)
             
         self.save_emotional_state()
     
     def semantic_memory_search(self, query, collection_name="episodic", n_results=5, 
-                              where_filter=None, threshold=0.6):
-        """语义记忆搜索"""
+                              where_filter=None, threshold=0.6, time_range=None):
+        """
+        语义记忆搜索
+        
+        Args:
+            time_range: 可选的时间范围，支持TimeRange对象或(start, end)元组，
+                        在存储层按timestamp_epoch过滤
+        """
         search_params = {
             "query_texts": [query],
             "n_results": n_results
         }
         
-        if where_filter:
-            search_params["where"] = where_filter
+        time_filter = self._build_time_filter(time_range)
+        if where_filter and time_filter:
+            search_params["where"] = {"$and": [where_filter, time_filter]}
+        elif where_filter or time_filter:
+            search_params["where"] = where_filter or time_filter
             
         results = self.collections[collection_name].query(**search_params)
         
@@ -299,6 +461,15 @@ class EmotionalMemorySystem:
                 
         return memories
     
+    def _build_time_filter(self, time_range):
+        """将时间范围转换为ChromaDB过滤条件"""
+        if not time_range:
+            return None
+        if hasattr(time_range, "to_filter"):
+            return time_range.to_filter()
+        start, end = time_range
+        return time_range_filter(start, end)
+    
     def update_memory_access(self, memory_id):
         """更新记忆访问时间和重要性"""
         try:
@@ -308,7 +479,9 @@ class EmotionalMemorySystem:
                 metadata = result["metadatas"][0]
                 
                 # 更新最后访问时间
-                metadata["last_accessed"] = datetime.now().isoformat()
+                now = datetime.now()
+                metadata["last_accessed"] = now.isoformat()
+                metadata["last_accessed_epoch"] = now.timestamp()
                 
                 # 增强记忆重要性(被访问的记忆变得更重要)
                 metadata["importance"] = min(1.0, metadata.get("importance", 0.5) + 0.05)
@@ -316,11 +489,8 @@ class EmotionalMemorySystem:
                 # 重置衰减因子
                 metadata["decay_factor"] = 1.0
                 
-                # 更新记忆
-                self.collections["episodic"].update(
-                    ids=[memory_id],
-                    metadatas=[metadata]
-                )
+                # 更新记忆（经过预写日志，处于工作单元中时随单元一起提交）
+                self._write("episodic", "update", ids=[memory_id], metadatas=[metadata])
         except Exception as e:
             print(f"更新记忆访问失败: {e}")
     
@@ -331,15 +501,17 @@ class EmotionalMemorySystem:
             all_memories = self.collections["episodic"].get()
             
             if all_memories and all_memories["ids"]:
-                now = datetime.now()
+                now = datetime.now().timestamp()
                 updated_metadatas = []
                 
                 for i, memory_id in enumerate(all_memories["ids"]):
                     metadata = all_memories["metadatas"][i]
                     
-                    # 计算时间差(以天为单位)
-                    last_accessed = datetime.fromisoformat(metadata.get("last_accessed", metadata.get("timestamp")))
-                    days_since_access = (now - last_accessed).days
+                    # 计算时间差(以天为单位)，优先使用数值时间戳，旧数据回退到ISO字符串
+                    last_accessed = metadata.get("last_accessed_epoch")
+                    if last_accessed is None:
+                        last_accessed = to_epoch(metadata.get("last_accessed", metadata.get("timestamp")))
+                    days_since_access = int((now - last_accessed) // 86400) if last_accessed else 0
                     
                     # 更新衰减因子
                     importance = metadata.get("importance", 0.5)
@@ -349,11 +521,8 @@ class EmotionalMemorySystem:
                     metadata["decay_factor"] = new_decay_factor
                     updated_metadatas.append(metadata)
                 
-                # 批量更新
-                self.collections["episodic"].update(
-                    ids=all_memories["ids"],
-                    metadatas=updated_metadatas
-                )
+                # 批量更新：全部记忆的衰减作为一条预写日志记录，中途崩溃时下次启动重放整批更新
+                self._write("episodic", "update", ids=all_memories["ids"], metadatas=updated_metadatas)
         except Exception as e:
             print(f"应用记忆衰减失败: {e}")
     
@@ -385,12 +554,27 @@ class EmotionalMemorySystem:
             "last_updated": self.emotional_state["last_updated"]
         }
     
-    def get_relevant_context(self, query, full_context=False):
-        """获取完整的相关上下文，包括对话记忆、用户偏好和关系状态"""
+    def get_relevant_context(self, query, full_context=False, time_range=None, fallback_unfiltered=False):
+        """
+        获取完整的相关上下文，包括对话记忆、用户偏好和关系状态
+        
+        Args:
+            time_range: 可选的时间范围，仅作用于对话记忆和关系事件
+            fallback_unfiltered: 时间范围内没有对话记忆时，是否改为不限时间检索
+        """
+        # 限定时间范围后候选已足够相关，放宽相似度阈值，按相似度排序返回
+        time_threshold = 2.0 if time_range else 0.6
+        
         # 获取相关对话记忆
         episodic_memories = self.semantic_memory_search(
-            query, "episodic", n_results=5
+            query, "episodic", n_results=5,
+            threshold=time_threshold, time_range=time_range
         )
+        if time_range and not episodic_memories and fallback_unfiltered:
+            # 时间范围内没有记忆（可能是时间表达被误识别），按内容重新检索
+            time_range = None
+            time_threshold = 0.6
+            episodic_memories = self.semantic_memory_search(query, "episodic", n_results=5)
         
         # 获取相关用户偏好
         preference_memories = self.semantic_memory_search(
@@ -402,7 +586,8 @@ class EmotionalMemorySystem:
         if self.emotional_state["relationship_level"] >= 5:
             # 关系较好时，更可能回忆起重要关系事件
             relationship_memories = self.semantic_memory_search(
-                query, "relationship", n_results=2
+                query, "relationship", n_results=2,
+                threshold=time_threshold, time_range=time_range
             )
         
         # 情感状态摘要
@@ -410,6 +595,8 @@ class EmotionalMemorySystem:
         
         # 格式化输出
         context = "## 相关记忆\n\n"
+        if time_range and hasattr(time_range, "describe"):
+            context += f"（检索时间范围: {time_range.describe()}）\n\n"
         
         if episodic_memories:
             context += "### 过去的对话\n"
@@ -519,12 +706,26 @@ class EmotionalMemorySystem:
         # 创建可搜索的文本描述
         profile_text = f"用户{category}: {value}"
         
-        # 查询是否已存在相同类别的信息
-        existing = self.collections["user_profile"].query(
-            query_texts=[category],
-            n_results=5,
-            where={"category": category}
-        )
+        # 查询是否已存在相同类别的信息，本轮已写入但尚未提交的优先
+        pending_id = self._pending_record_id("user_profile", category)
+        if pending_id is not None:
+            existing = {"ids": [[pending_id]]}
+        else:
+            existing = self.collections["user_profile"].query(
+                query_texts=[category],
+                n_results=5,
+                where={"category": category}
+            )
+        
+        metadata = {
+            "category": category,
+            "value": value,
+            "confidence": confidence,
+            "source": source,
+            "timestamp": timestamp,
+            "last_updated": timestamp
+        }
+        metadata.update(build_schema_fields(profile_text, timestamp))
         
         # 如果存在相同类别且可信度较高，则更新最新的记录
         if (existing and len(existing["ids"]) > 0 and len(existing["ids"][0]) > 0 
@@ -532,32 +733,10 @@ class EmotionalMemorySystem:
             
             # 更新最近的记录
             latest_id = existing["ids"][0][0]
-            self.collections["user_profile"].update(
-                ids=[latest_id],
-                metadatas=[{
-                    "category": category,
-                    "value": value,
-                    "confidence": confidence,
-                    "source": source,
-                    "timestamp": timestamp,
-                    "last_updated": timestamp
-                }],
-                documents=[profile_text]
-            )
+            self._write("user_profile", "update", ids=[latest_id], metadatas=[metadata], documents=[profile_text])
         else:
             # 添加新信息
-            self.collections["user_profile"].add(
-                ids=[profile_id],
-                metadatas=[{
-                    "category": category,
-                    "value": value,
-                    "confidence": confidence,
-                    "source": source,
-                    "timestamp": timestamp,
-                    "last_updated": timestamp
-                }],
-                documents=[profile_text]
-            )
+            self._write("user_profile", "add", ids=[profile_id], metadatas=[metadata], documents=[profile_text])
         print(f"✅ 用户信息已添加/更新: {category} - {value} (来源: {source}, 置信度: {confidence})")
     
     def get_user_profile(self, category=None):
@@ -648,9 +827,7 @@ class EmotionalMemorySystem:
             
             if results and "ids" in results and results["ids"]:
                 # 删除所有匹配的记录
-                self.collections["user_profile"].delete(
-                    ids=results["ids"]
-                )
+                self._write("user_profile", "delete", ids=results["ids"])
                 print(f"✅ 已删除用户信息类别: {category} ({len(results['ids'])}条记录)")
                 return True
             else:
@@ -679,9 +856,7 @@ class EmotionalMemorySystem:
             
             if results and "ids" in results and results["ids"]:
                 # 删除所有匹配的记录
-                self.collections["preferences"].delete(
-                    ids=results["ids"]
-                )
+                self._write("preferences", "delete", ids=results["ids"])
                 print(f"✅ 已删除用户偏好类别: {category} ({len(results['ids'])}条记录)")
                 return True
             else:
@@ -747,73 +922,36 @@ class EmotionalMemorySystem:
         
         return summary
     
-    def get_recent_conversations(self, minutes=30, n_results=3):
+    def get_recent_conversations(self, minutes=30, limit=3):
         """
         获取最近的对话记录
         
         Args:
             minutes: 限定时间范围，单位为分钟，默认过去30分钟
-            n_results: 返回的对话记录条数，默认3条
+            limit: 返回的对话记录条数，默认3条
             
         Returns:
-            list: 最近的对话记录列表
+            list: 按时间倒序排列的最近对话记录列表
         """
         try:
-            # 计算时间范围
+            # 使用数值时间戳在存储层完成时间过滤
             time_threshold = datetime.now() - timedelta(minutes=minutes)
-            
-            # 查询最近的对话记录
-            results = self.collections["episodic"].query(
-                query_texts=["*"],  # 匹配所有对话
-                where={
-                    "timestamp": {
-                        "$gte": time_threshold.isoformat()  # 过滤条件：时间戳大于等于计算出的阈值
-                    }
-                }
+            results = self.collections["episodic"].get(
+                where=time_range_filter(start=time_threshold)
             )
             
-            conversations = []
-            if results and "documents" in results and results["documents"]:
-                docs_list = results["documents"][0]
-                metadatas_list = results["metadatas"][0]
-                
-                for i, doc_content in enumerate(docs_list):
-                    metadata = metadatas_list[i]
-                    conversation = {
-                        "content": doc_content,
-                        "metadata": metadata
-                    }
-                    conversations.append(conversation)
-            
-            return conversations
-        
-        except Exception as e:
-            print(f"获取最近对话记录失败: {e}")
-            return []
-    
-    def get_recent_conversations(self, minutes=30, limit=3):
-        """获取指定时间范围内最近的对话记录"""
-        try:
-            # 计算时间阈值
-            time_threshold = datetime.now() - timedelta(minutes=minutes)
-            # 获取所有情节记忆
-            all_memories = self.get_recent_conversations(minutes=minutes, limit=limit)
-
-            if not all_memories or not all_memories["metadatas"]:
+            if not results or not results["ids"]:
                 return []
             
-            # 筛选指定时间内的记忆并按时间排序
             recent_memories = []
-            for i, metadata in enumerate(all_memories["metadatas"]):
-                if metadata and metadata.get("timestamp"):
-                    memory_time = datetime.fromisoformat(metadata["timestamp"])
-                    if memory_time >= time_threshold:
-                        recent_memories.append({
-                            "content": all_memories["documents"][i],
-                            "metadata": metadata,
-                            "id": all_memories["ids"][i],
-                            "timestamp": memory_time
-                        })
+            for i, memory_id in enumerate(results["ids"]):
+                metadata = results["metadatas"][i] or {}
+                recent_memories.append({
+                    "content": results["documents"][i],
+                    "metadata": metadata,
+                    "id": memory_id,
+                    "timestamp": metadata.get("timestamp_epoch", 0)
+                })
             
             # 按时间倒序排序，取最近的N条
             recent_memories.sort(key=lambda x: x["timestamp"], reverse=True)
@@ -821,4 +959,4 @@ class EmotionalMemorySystem:
             
         except Exception as e:
             print(f"获取最近对话记录失败: {e}")
-            return []
\ No newline at end of file
+            return []
@@ -0,0 +1,181 @@
+"""
+记忆写入预写日志
+每次写入ChromaDB之前，先把写入操作（集合、方法和参数）追加到记忆目录下的日志文件并fsync，
+写入完成后标记为已应用；所有写入都已应用时截断日志。
+并发的写入在短暂的提交窗口内合并为一次fsync（组提交）。
+启动时重放日志中的全部操作：add按upsert执行，update和delete本身幂等，重复执行不会产生重复记录
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from emotional_companion.utils.env_utils import get_env_bool, get_env_int
+
+# (集合名, 方法名, 参数)
+WriteOperation = Tuple[str, str, dict]
+
+JOURNAL_FILENAME = "memory_journal.jsonl"
+
+# 日志中允许记录的写入方法
+JOURNALED_METHODS = ("add", "upsert", "update", "delete")
+
+
+def journal_enabled() -> bool:
+    """是否启用记忆写入预写日志（MEMORY_JOURNAL_ENABLED）"""
+    return get_env_bool("MEMORY_JOURNAL_ENABLED", True)
+
+
+class WriteAheadJournal:
+    """追加写入、组提交fsync的预写日志"""
+
+    def __init__(self, path: str, commit_delay_ms: Optional[int] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            path: 日志文件路径
+            commit_delay_ms: 组提交窗口（毫秒），提交者等待该时间以合并其他线程的写入，
+                             为None时读取MEMORY_JOURNAL_COMMIT_DELAY_MS
+            max_bytes: 仍有未应用的写入时，日志超过该大小后压缩为只包含未应用的记录，
+                       为None时读取MEMORY_JOURNAL_MAX_BYTES
+        """
+        self.path = path
+        self.commit_delay = (get_env_int("MEMORY_JOURNAL_COMMIT_DELAY_MS", 2)
+                             if commit_delay_ms is None else commit_delay_ms) / 1000
+        self.max_bytes = max_bytes or get_env_int("MEMORY_JOURNAL_MAX_BYTES", 1024 * 1024)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._synced_seq = 0
+        self._syncing = False
+        # 已写入日志、尚未应用到ChromaDB的记录：序号 -> 日志行
+        self._outstanding: Dict[int, str] = {}
+
+        self.records = 0
+        self.fsyncs = 0
+        self.truncations = 0
+        self.compactions = 0
+        self.replayed = 0
+
+    def record(self, operations: Iterable[WriteOperation]) -> int:
+        """
+        把一组写入操作作为一条记录追加到日志，fsync完成后返回记录序号
+
+        同一组操作在重放时一起执行
+        """
+        entry = {
+            "ts": time.time(),
+            "ops": [{"collection": collection, "method": method, "args": args}
+                    for collection, method, args in operations],
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._cond:
+            self._seq += 1
+            seq = self._seq
+            self._file.write(line)
+            self._outstanding[seq] = line
+            self.records += 1
+            while self._synced_seq < seq:
+                if self._syncing:
+                    # 已有提交者，等待其fsync覆盖本条记录
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                try:
+                    if self.commit_delay > 0:
+                        # 等待期间释放锁，让其他线程的记录并入本次提交
+                        self._cond.wait(self.commit_delay)
+                    target = self._seq
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    self._synced_seq = target
+                    self.fsyncs += 1
+                finally:
+                    self._syncing = False
+                    self._cond.notify_all()
+        return seq
+
+    def applied(self, seq: int):
+        """标记记录已应用；所有记录都已应用时截断日志，否则在日志过大时压缩"""
+        with self._cond:
+            self._outstanding.pop(seq, None)
+            if not self._outstanding:
+                # 等待中的提交者会在之后fsync，截断前先让其完成，避免与截断交错
+                if self._syncing:
+                    return
+                self._file.seek(0)
+                self._file.truncate()
+                self.truncations += 1
+            elif self._file.tell() > self.max_bytes:
+                self._compact()
+
+    def _compact(self):
+        """把日志重写为只包含未应用的记录（需持有锁）"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(self._outstanding[seq] for seq in sorted(self._outstanding))
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self.compactions += 1
+
+    def _read_entries(self) -> List[dict]:
+        entries = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # 崩溃时写到一半的最后一行没有完成fsync，对应的写入也未执行
+                    print("[警告] 记忆预写日志中存在不完整的记录，已跳过")
+        return entries
+
+    def replay(self, apply: Callable[[str, str, dict], None]) -> int:
+        """
+        重放日志中的全部写入并截断日志，返回重放的记录数
+
+        Args:
+            apply: 执行单个写入的函数，参数为(集合名, 方法名, 参数)
+        """
+        with self._cond:
+            entries = self._read_entries()
+            if not entries:
+                return 0
+            for entry in entries:
+                for op in entry.get("ops", []):
+                    method = op["method"]
+                    if method not in JOURNALED_METHODS:
+                        continue
+                    apply(op["collection"], "upsert" if method == "add" else method, op["args"])
+            self._file.seek(0)
+            self._file.truncate()
+            self.replayed += len(entries)
+            self.truncations += 1
+            print(f"[系统] 已重放记忆预写日志中的 {len(entries)} 条记录")
+            return len(entries)
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            return {
+                "path": self.path,
+                "records": self.records,
+                "fsyncs": self.fsyncs,
+                "records_per_fsync": round(self.records / self.fsyncs, 2) if self.fsyncs else None,
+                "outstanding": len(self._outstanding),
+                "size_bytes": self._file.tell(),
+                "truncations": self.truncations,
+                "compactions": self.compactions,
+                "replayed": self.replayed,
+                "commit_delay_ms": self.commit_delay * 1000,
+            }
+
+    def close(self):
+        with self._cond:
+            self._file.close()
@@ -0,0 +1,133 @@
+"""
+批量记忆操作
+一次提交多项情感状态、关系事件、用户偏好和用户信息的更新，在同一个批量写入中执行，
+供memory_manager代理的update_memory_batch工具和结构化状态更新共用
+"""
+
+from typing import Iterable, List, Literal, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+OperationType = Literal[
+    "update_emotion",
+    "record_relationship_event",
+    "save_user_preference",
+    "save_user_profile_info",
+    "delete_user_preference",
+    "delete_user_profile_info",
+]
+
+
+class MemoryOperation(BaseModel):
+    """单项记忆操作，按op类型使用对应字段，其余字段留空"""
+
+    op: OperationType = Field(description=(
+        "操作类型：update_emotion更新智能体情感(emotion/intensity/valence)；"
+        "record_relationship_event记录关系事件(description/importance/impact)；"
+        "save_user_preference保存用户偏好(category/item/sentiment/certainty)；"
+        "save_user_profile_info保存用户关键信息(category/value/confidence)；"
+        "delete_user_preference、delete_user_profile_info按category删除"
+    ))
+    emotion: Optional[str] = Field(default=None, description="情感名称")
+    intensity: Optional[float] = Field(default=None, description="情感强度(0.1-1.0)")
+    valence: Optional[float] = Field(default=None, description="情感价值(-1.0至1.0)")
+    description: Optional[str] = Field(default=None, description="关系事件描述")
+    importance: Optional[float] = Field(default=None, description="关系事件重要性(0.1-1.0)")
+    impact: Optional[float] = Field(default=None, description="对关系的影响(-1.0到1.0)")
+    category: Optional[str] = Field(default=None, description="偏好或用户信息的类别")
+    item: Optional[str] = Field(default=None, description="具体偏好项目")
+    sentiment: Optional[float] = Field(default=None, description="偏好的情感倾向(-1.0到1.0)")
+    certainty: Optional[float] = Field(default=None, description="偏好的确定性(0.1-1.0)")
+    value: Optional[str] = Field(default=None, description="用户信息内容")
+    confidence: Optional[float] = Field(default=None, description="用户信息可信度(0.1-1.0)")
+
+
+# 各操作类型必须提供的字段
+REQUIRED_FIELDS = {
+    "update_emotion": ("emotion",),
+    "record_relationship_event": ("description",),
+    "save_user_preference": ("category", "item"),
+    "save_user_profile_info": ("category", "value"),
+    "delete_user_preference": ("category",),
+    "delete_user_profile_info": ("category",),
+}
+
+
+def _clamp(value: Optional[float], low: float, high: float, default: Optional[float]) -> Optional[float]:
+    return default if value is None else max(low, min(high, float(value)))
+
+
+def validate_operation(operation: MemoryOperation) -> Optional[str]:
+    """检查操作是否提供了必需字段，返回错误说明，合法时返回None"""
+    missing = [name for name in REQUIRED_FIELDS[operation.op]
+               if not str(getattr(operation, name) or "").strip()]
+    return f"{operation.op}缺少{'、'.join(missing)}" if missing else None
+
+
+def _apply(memory_system, operation: MemoryOperation) -> Tuple[str, str]:
+    """执行单项操作，返回(统计键, 说明)"""
+    op = operation.op
+    if op == "update_emotion":
+        memory_system.update_emotional_state(
+            operation.emotion.strip(),
+            _clamp(operation.intensity, 0.1, 1.0, None),
+            _clamp(operation.valence, -1.0, 1.0, None),
+        )
+        return "情感", operation.emotion.strip()
+    if op == "record_relationship_event":
+        memory_system.add_relationship_event(
+            operation.description.strip(),
+            _clamp(operation.importance, 0.1, 1.0, 0.7),
+            _clamp(operation.impact, -1.0, 1.0, 0.1),
+        )
+        return "关系事件", operation.description.strip()[:30]
+    if op == "save_user_preference":
+        memory_system.add_user_preference(
+            operation.category.strip(), operation.item.strip(),
+            _clamp(operation.sentiment, -1.0, 1.0, 1.0),
+            _clamp(operation.certainty, 0.1, 1.0, 0.8),
+        )
+        return "偏好", f"{operation.category.strip()}-{operation.item.strip()}"
+    if op == "save_user_profile_info":
+        memory_system.add_user_profile_info(
+            operation.category.strip(), operation.value.strip(),
+            _clamp(operation.confidence, 0.1, 1.0, 0.9), "conversation",
+        )
+        return "用户信息", f"{operation.category.strip()}-{operation.value.strip()}"
+    if op == "delete_user_preference":
+        deleted = memory_system.delete_user_preference(operation.category.strip())
+        return "删除偏好", operation.category.strip() + ("" if deleted else "(不存在)")
+    deleted = memory_system.delete_user_profile_info(operation.category.strip())
+    return "删除用户信息", operation.category.strip() + ("" if deleted else "(不存在)")
+
+
+def apply_memory_operations(memory_system, operations: Iterable[MemoryOperation]) -> str:
+    """
+    在一次批量写入中执行多项记忆操作
+
+    先校验全部操作，缺少必需字段的操作会被跳过并在结果中说明；
+    其余操作在memory_system.batch_writes()中执行，情感状态只保存一次，关系事件一次性写入
+
+    Returns:
+        紧凑的执行结果说明，如"已执行3项：情感 happy；偏好 食物-草莓；关系事件 一起看了电影"
+    """
+    valid: List[MemoryOperation] = []
+    skipped = []
+    for operation in operations:
+        error = validate_operation(operation)
+        if error:
+            skipped.append(error)
+        else:
+            valid.append(operation)
+
+    applied = []
+    if valid:
+        with memory_system.batch_writes():
+            applied = [_apply(memory_system, operation) for operation in valid]
+
+    parts = [f"已执行{len(applied)}项"]
+    if applied:
+        parts[0] += "：" + "；".join(f"{kind} {detail}" for kind, detail in applied)
+    if skipped:
+        parts.append(f"跳过{len(skipped)}项（{'；'.join(skipped)}）")
+    return "，".join(parts)
@@ -0,0 +1,122 @@
+"""
+记忆元数据结构定义
+统一管理记忆元数据的版本号、数值时间戳和内容哈希
+"""
+
+import hashlib
+import json
+from datetime import datetime
+from typing import Optional, Union
+
+# 当前记忆元数据结构版本
+# v1: 仅包含ISO字符串格式的timestamp/last_accessed
+# v2: 新增timestamp_epoch/last_accessed_epoch数值字段、content_hash和schema_version
+SCHEMA_VERSION = 2
+
+
+def to_epoch(value: Union[str, datetime, float, int, None]) -> Optional[float]:
+    """将ISO时间字符串、datetime或数值统一转换为epoch秒"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+def content_hash(text: Optional[str]) -> str:
+    """计算记忆文本的内容哈希，用于去重和迁移校验"""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+def build_schema_fields(document: str, timestamp: Union[str, datetime, None] = None,
+                        last_accessed: Union[str, datetime, None] = None) -> dict:
+    """
+    生成v2结构需要的附加元数据字段
+
+    Args:
+        document: 记忆文本内容
+        timestamp: 记忆创建时间
+        last_accessed: 最后访问时间（仅情节记忆使用）
+
+    Returns:
+        dict: 可直接合并进元数据的字段
+    """
+    fields = {
+        "schema_version": SCHEMA_VERSION,
+        "content_hash": content_hash(document),
+    }
+
+    timestamp_epoch = to_epoch(timestamp)
+    if timestamp_epoch is not None:
+        fields["timestamp_epoch"] = timestamp_epoch
+
+    last_accessed_epoch = to_epoch(last_accessed)
+    if last_accessed_epoch is not None:
+        fields["last_accessed_epoch"] = last_accessed_epoch
+
+    return fields
+
+
+def needs_migration(metadata: Optional[dict]) -> bool:
+    """判断一条元数据是否仍需升级到当前结构版本"""
+    if not metadata:
+        return True
+    return int(metadata.get("schema_version", 1)) < SCHEMA_VERSION
+
+
+def upgrade_metadata(metadata: Optional[dict], document: Optional[str]) -> dict:
+    """
+    将旧版元数据升级为当前结构版本，保留所有原有字段
+
+    Args:
+        metadata: 原始元数据
+        document: 对应的记忆文本
+
+    Returns:
+        dict: 升级后的元数据
+    """
+    upgraded = dict(metadata or {})
+
+    timestamp = upgraded.get("timestamp")
+    # 情感状态集合的时间保存在state_data中
+    if not timestamp and upgraded.get("state_data"):
+        try:
+            timestamp = json.loads(upgraded["state_data"]).get("last_updated")
+        except (ValueError, TypeError):
+            timestamp = None
+
+    last_accessed = upgraded.get("last_accessed")
+    upgraded.update(build_schema_fields(document or "", timestamp, last_accessed))
+    return upgraded
+
+
+def time_range_filter(start=None, end=None, field: str = "timestamp_epoch") -> Optional[dict]:
+    """
+    构造基于数值时间戳的ChromaDB where过滤条件
+
+    Args:
+        start: 起始时间（包含），支持ISO字符串、datetime或epoch秒
+        end: 结束时间（不包含）
+        field: 过滤使用的元数据字段
+
+    Returns:
+        dict: where过滤条件，起止时间都为空时返回None
+    """
+    conditions = []
+    start_epoch = to_epoch(start)
+    end_epoch = to_epoch(end)
+    if start_epoch is not None:
+        conditions.append({field: {"$gte": start_epoch}})
+    if end_epoch is not None:
+        conditions.append({field: {"$lt": end_epoch}})
+
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
@@ -0,0 +1,190 @@
+"""
+记忆数据库结构迁移工具
+将已有memory_db中的记忆元数据分页回填为当前结构版本，支持断点续传
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目根目录到系统路径，支持容器环境
+if os.getenv('DOCKER_ENV'):
+    sys.path.append('/app')
+else:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import chromadb
+
+from emotional_companion.memory.schema import SCHEMA_VERSION, needs_migration, upgrade_metadata
+
+# 需要迁移的集合名称
+MEMORY_COLLECTIONS = [
+    "episodic_memory",
+    "semantic_memory",
+    "emotional_memory",
+    "relationship_memory",
+    "preferences_memory",
+    "user_profile_memory",
+]
+
+# 迁移进度文件名，保存在记忆数据库目录下
+STATE_FILE_NAME = "schema_migration_state.json"
+
+
+class MemorySchemaMigrator:
+    """记忆元数据结构迁移器"""
+
+    def __init__(self, persist_directory: str, batch_size: int = 200):
+        """
+        初始化迁移器
+
+        Args:
+            persist_directory: 记忆数据库目录
+            batch_size: 每页处理的记录数
+        """
+        self.persist_directory = Path(persist_directory)
+        if not self.persist_directory.exists():
+            raise FileNotFoundError(f"找不到记忆数据库目录: {self.persist_directory}")
+
+        self.batch_size = max(1, batch_size)
+        self.state_file = self.persist_directory / STATE_FILE_NAME
+        # 迁移只更新元数据，不需要加载嵌入模型
+        self.client = chromadb.PersistentClient(path=str(self.persist_directory))
+
+    def _load_state(self) -> dict:
+        """读取迁移进度"""
+        if not self.state_file.exists():
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            # 目标版本变化后需要重新迁移
+            if state.get("schema_version") != SCHEMA_VERSION:
+                return {}
+            return state
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state: dict):
+        """原子写入迁移进度"""
+        state["schema_version"] = SCHEMA_VERSION
+        state["updated_at"] = datetime.now().isoformat()
+        tmp_file = self.state_file.with_suffix(".tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def migrate_collection(self, name: str, state: dict, dry_run: bool = False) -> dict:
+        """
+        分页迁移单个集合
+
+        Args:
+            name: 集合名称
+            state: 全局迁移进度，会被原地更新
+            dry_run: 只统计不写入
+
+        Returns:
+            dict: 该集合的迁移统计
+        """
+        collection_state = state.setdefault("collections", {}).setdefault(
+            name, {"offset": 0, "scanned": 0, "updated": 0, "completed": False}
+        )
+        if collection_state.get("completed"):
+            print(f"⏭️  {name} 已完成迁移，跳过")
+            return collection_state
+
+        try:
+            collection = self.client.get_collection(name=name)
+        except Exception:
+            print(f"⚠️ 集合不存在，跳过: {name}")
+            collection_state["completed"] = True
+            return collection_state
+
+        total = collection.count()
+        offset = collection_state.get("offset", 0)
+        print(f"🔄 开始迁移 {name}: 共{total}条，从第{offset}条继续")
+
+        while offset < total:
+            page = collection.get(
+                limit=self.batch_size,
+                offset=offset,
+                include=["metadatas", "documents"]
+            )
+            ids = page.get("ids") or []
+            if not ids:
+                break
+
+            update_ids = []
+            update_metadatas = []
+            for i, memory_id in enumerate(ids):
+                metadata = page["metadatas"][i]
+                if needs_migration(metadata):
+                    update_ids.append(memory_id)
+                    update_metadatas.append(upgrade_metadata(metadata, page["documents"][i]))
+
+            # 只更新元数据，不会触发重新嵌入
+            if update_ids and not dry_run:
+                collection.update(ids=update_ids, metadatas=update_metadatas)
+
+            offset += len(ids)
+            collection_state["offset"] = offset
+            collection_state["scanned"] = collection_state.get("scanned", 0) + len(ids)
+            collection_state["updated"] = collection_state.get("updated", 0) + len(update_ids)
+
+            # 每页提交一次进度，中断后可从此处继续
+            if not dry_run:
+                self._save_state(state)
+            print(f"   {name}: {offset}/{total} (本页更新{len(update_ids)}条)")
+
+        collection_state["completed"] = True
+        if not dry_run:
+            self._save_state(state)
+        return collection_state
+
+    def run(self, collections=None, resume: bool = True, dry_run: bool = False) -> dict:
+        """
+        执行迁移
+
+        Args:
+            collections: 要迁移的集合列表，默认全部
+            resume: 是否从上次中断处继续
+            dry_run: 只统计不写入
+
+        Returns:
+            dict: 迁移进度与统计
+        """
+        state = self._load_state() if resume else {}
+        for name in collections or MEMORY_COLLECTIONS:
+            self.migrate_collection(name, state, dry_run=dry_run)
+        return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="记忆数据库元数据结构迁移工具")
+    parser.add_argument("--db-path", "-d", type=str,
+                        default=os.getenv('CHROMA_DB_DIR', os.getenv('MEMORY_DB_DIR', 'memory_db')),
+                        help="记忆数据库目录")
+    parser.add_argument("--batch-size", "-b", type=int, default=200, help="每页处理的记录数")
+    parser.add_argument("--collection", "-c", action="append", choices=MEMORY_COLLECTIONS,
+                        help="只迁移指定集合，可重复指定")
+    parser.add_argument("--restart", action="store_true", help="忽略已有进度，从头开始迁移")
+    parser.add_argument("--dry-run", action="store_true", help="只统计需要迁移的记录，不写入")
+    args = parser.parse_args()
+
+    try:
+        migrator = MemorySchemaMigrator(args.db_path, batch_size=args.batch_size)
+        state = migrator.run(args.collection, resume=not args.restart, dry_run=args.dry_run)
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    print(f"\n===== 迁移完成 (schema v{SCHEMA_VERSION}) =====")
+    for name, info in state.get("collections", {}).items():
+        print(f"{name}: 扫描{info.get('scanned', 0)}条，更新{info.get('updated', 0)}条")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+记忆写入的工作单元
+一轮对话期间（包括在工具线程和asyncio.to_thread中执行的记忆操作）产生的全部集合写入先收集在工作单元中，
+多次保存情感状态合并为结束时的一次保存，同一集合的连续插入合并为一次写入（一次嵌入计算），
+最后作为一条预写日志记录一次提交
+"""
+
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from emotional_companion.memory.journal import WriteOperation
+
+# (字段, 修改前的值, 修改后的值)
+StateChange = Tuple[str, Any, Any]
+
+# 合并插入时需要拼接的字段
+_RECORD_FIELDS = ("ids", "metadatas", "documents")
+
+
+class MemoryUnitOfWork:
+    """一轮对话的记忆写入集合"""
+
+    def __init__(self):
+        self.operations: List[WriteOperation] = []
+        self.state_dirty = False
+        # 被合并掉的情感状态保存次数
+        self.state_saves = 0
+        # 本单元对内存中情感状态字段的修改，回滚时只撤销这些修改
+        self.state_changes: List[StateChange] = []
+        self._lock = threading.Lock()
+
+    def add(self, operations: List[WriteOperation]):
+        with self._lock:
+            self.operations.extend(operations)
+
+    def pending_record_id(self, collection: str, category: str) -> Optional[str]:
+        """
+        返回本单元中最近一次写入的、指定集合中该类别记录的ID
+
+        写入要到单元提交时才执行，按类别更新已有记录的方法需要先在这里查找，否则查询ChromaDB找不到本轮刚写入的记录
+        """
+        with self._lock:
+            for op_collection, method, args in reversed(self.operations):
+                if op_collection != collection or method not in ("add", "update", "upsert"):
+                    continue
+                for record_id, metadata in zip(reversed(args["ids"]), reversed(args.get("metadatas") or [])):
+                    if (metadata or {}).get("category") == category:
+                        return record_id
+        return None
+
+    def mark_state_dirty(self):
+        with self._lock:
+            self.state_dirty = True
+            self.state_saves += 1
+
+    def record_state_change(self, field: str, old_value, new_value):
+        with self._lock:
+            self.state_changes.append((field, old_value, new_value))
+
+    def savepoint(self) -> tuple:
+        """记录当前位置，出错时可回滚到这里"""
+        with self._lock:
+            return len(self.operations), self.state_dirty, self.state_saves, len(self.state_changes)
+
+    def rollback_to(self, savepoint: tuple) -> List[StateChange]:
+        """丢弃savepoint之后收集的写入，返回需要撤销的情感状态修改（按修改顺序）"""
+        with self._lock:
+            length, self.state_dirty, self.state_saves, changes = savepoint
+            del self.operations[length:]
+            undone = self.state_changes[changes:]
+            del self.state_changes[changes:]
+            return undone
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.operations and not self.state_dirty
+
+
+def coalesce_operations(operations: List[WriteOperation]) -> List[WriteOperation]:
+    """
+    合并同一集合的插入
+
+    插入会并入该集合之前的插入，除非两者之间该集合有update或delete（保证删除后再添加的顺序不变）；
+    只更新这些待插入记录的update直接改写待插入的内容，不打断合并。
+    不同集合的写入互不影响，合并后的插入位于该集合第一次插入的位置。同一批次中重复的ID加后缀区分
+    """
+    result: List[WriteOperation] = []
+    open_adds: Dict[str, int] = {}
+    for collection, method, args in operations:
+        index: Optional[int] = open_adds.get(collection)
+        if method == "add" and index is not None:
+            merged = result[index][2]
+            for record_id, metadata, document in zip(args["ids"], args["metadatas"], args["documents"]):
+                if record_id in merged["ids"]:
+                    record_id = f"{record_id}_{len(merged['ids'])}"
+                merged["ids"].append(record_id)
+                merged["metadatas"].append(metadata)
+                merged["documents"].append(document)
+            continue
+        if method == "update" and index is not None and set(args["ids"]) <= set(result[index][2]["ids"]):
+            merged = result[index][2]
+            for i, record_id in enumerate(args["ids"]):
+                position = merged["ids"].index(record_id)
+                for field in ("metadatas", "documents"):
+                    if args.get(field) is not None:
+                        merged[field][position] = args[field][i]
+            continue
+        if method == "add":
+            open_adds[collection] = len(result)
+            args = {field: list(args[field]) for field in _RECORD_FIELDS}
+        else:
+            open_adds.pop(collection, None)
+        result.append((collection, method, args))
+    return result
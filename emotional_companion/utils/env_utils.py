@@ -0,0 +1,38 @@
+"""
+环境变量读取工具
+为开关类和数值类配置提供统一的解析方式
+"""
+
+import os
+
+_TRUE_VALUES = {"1", "true", "yes", "on", "y"}
+_FALSE_VALUES = {"0", "false", "no", "off", "n"}
+
+
+def get_env_bool(name: str, default: bool = False) -> bool:
+    """读取布尔型环境变量，无法识别时返回默认值"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value in _TRUE_VALUES:
+        return True
+    if value in _FALSE_VALUES:
+        return False
+    return default
+
+
+def get_env_int(name: str, default: int) -> int:
+    """读取整型环境变量，无法解析时返回默认值"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_env_float(name: str, default: float) -> float:
+    """读取浮点型环境变量，无法解析时返回默认值"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,246 @@
+"""
+提示词token预算管理
+为拼接进提示词的各段内容（记忆上下文、内心思考、上一轮回复等）设置token预算，
+超出时按优先级和与用户输入的相关度裁剪，并记录每个阶段的token用量
+"""
+
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from emotional_companion.utils.env_utils import get_env_bool, get_env_int
+from emotional_companion.utils.tracing import tracer
+
+TRUNCATION_MARK = "…（已截断）"
+
+_CJK_PATTERN = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+
+@lru_cache(maxsize=1)
+def _get_encoder():
+    """加载tiktoken编码器，未安装或无法加载编码文件时返回None"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    本地估算文本token数
+
+    优先使用tiktoken，不可用时按中日韩字符每字约1个token、其余字符每4个约1个token估算
+    """
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def _bigrams(text: str) -> set:
+    text = re.sub(r"\s+", "", text.lower())
+    return {text[i:i + 2] for i in range(len(text) - 1)} if len(text) > 1 else {text}
+
+
+def relevance_score(segment: str, query: str) -> float:
+    """以字符二元组重合度衡量片段与查询的相关度，适用于中英文混合文本"""
+    query_grams = _bigrams(query)
+    if not query_grams or not segment.strip():
+        return 0.0
+    return len(_bigrams(segment) & query_grams) / len(query_grams)
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """将文本截断到预算以内，保留开头部分"""
+    if budget <= 0:
+        return ""
+    if count_tokens(text) <= budget:
+        return text
+    mark_tokens = count_tokens(TRUNCATION_MARK)
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) + mark_tokens <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + TRUNCATION_MARK if low else ""
+
+
+def trim_to_budget(text: str, budget: int, query: Optional[str] = None) -> str:
+    """
+    按行裁剪文本到预算以内
+
+    给出query时优先保留与之相关度高的行（标题行始终保留），否则按顺序保留开头的行；
+    保留下来的行维持原有顺序，放不下的最后一行会被截断
+    """
+    if count_tokens(text) <= budget:
+        return text
+
+    lines = text.split("\n")
+    costs = [count_tokens(line) + 1 for line in lines]
+    if query:
+        order = sorted(range(len(lines)), key=lambda i: (
+            not lines[i].lstrip().startswith("#"), -relevance_score(lines[i], query), i
+        ))
+    else:
+        order = list(range(len(lines)))
+
+    kept, used = set(), 0
+    partial_index, partial_text = None, ""
+    for index in order:
+        if used + costs[index] <= budget:
+            kept.add(index)
+            used += costs[index]
+        elif partial_index is None and budget - used > count_tokens(TRUNCATION_MARK) + 8:
+            partial_index = index
+            partial_text = truncate_to_tokens(lines[index], budget - used - 1)
+            used += count_tokens(partial_text) + 1
+            if query is None:
+                break
+
+    result = []
+    for index, line in enumerate(lines):
+        if index in kept:
+            result.append(line)
+        elif index == partial_index and partial_text:
+            result.append(partial_text)
+    return "\n".join(result).strip("\n")
+
+
+class PromptMetrics:
+    """按阶段统计提示词token用量"""
+
+    def __init__(self):
+        self._stats: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, prompt_tokens: int, original_tokens: int, trimmed_sections: List[str]):
+        with self._lock:
+            stats = self._stats.setdefault(stage, {
+                "calls": 0, "total_prompt_tokens": 0, "max_prompt_tokens": 0,
+                "last_prompt_tokens": 0, "trimmed_calls": 0, "tokens_removed": 0,
+                "trimmed_sections": {},
+            })
+            stats["calls"] += 1
+            stats["total_prompt_tokens"] += prompt_tokens
+            stats["max_prompt_tokens"] = max(stats["max_prompt_tokens"], prompt_tokens)
+            stats["last_prompt_tokens"] = prompt_tokens
+            if trimmed_sections:
+                stats["trimmed_calls"] += 1
+                stats["tokens_removed"] += max(0, original_tokens - prompt_tokens)
+                for name in trimmed_sections:
+                    stats["trimmed_sections"][name] = stats["trimmed_sections"].get(name, 0) + 1
+
+    def snapshot(self) -> Dict[str, dict]:
+        """获取各阶段的token统计"""
+        with self._lock:
+            result = {}
+            for stage, stats in self._stats.items():
+                entry = dict(stats, trimmed_sections=dict(stats["trimmed_sections"]))
+                entry["avg_prompt_tokens"] = round(stats["total_prompt_tokens"] / stats["calls"], 1)
+                result[stage] = entry
+            return result
+
+
+prompt_metrics = PromptMetrics()
+
+
+class PromptAssembler:
+    """
+    带token预算的提示词拼装器
+
+    用法:
+        assembler = PromptAssembler("thinker", total_budget=2000)
+        assembler.add("memory", context_result, budget=1200, priority=1, query=user_input)
+        sections = assembler.build()
+        prompt = f"...{sections['memory']}..."
+        assembler.record(prompt)
+    """
+
+    def __init__(self, stage: str, total_budget: Optional[int] = None, enabled: Optional[bool] = None):
+        """
+        Args:
+            stage: 阶段名称，用于token统计
+            total_budget: 所有可裁剪段落的总预算，为None时只应用各段自身的预算
+            enabled: 是否启用裁剪，为None时读取环境变量PROMPT_BUDGET_ENABLED
+        """
+        self.stage = stage
+        self.total_budget = total_budget
+        self.enabled = get_env_bool("PROMPT_BUDGET_ENABLED", True) if enabled is None else enabled
+        self._sections: List[dict] = []
+        self._trimmed: List[str] = []
+        self._original_tokens = 0
+
+    def add(self, name: str, content: str, budget: Optional[int] = None, priority: int = 0,
+            query: Optional[str] = None) -> "PromptAssembler":
+        """
+        添加一段内容
+
+        Args:
+            name: 段落名称
+            content: 段落内容
+            budget: 该段的token预算，为None时不限制
+            priority: 优先级，超出总预算时先压缩优先级低的段落
+            query: 用于按相关度裁剪的查询文本，通常是用户输入
+        """
+        content = content or ""
+        self._sections.append({
+            "name": name, "content": content, "budget": budget,
+            "priority": priority, "query": query, "tokens": count_tokens(content),
+        })
+        return self
+
+    def _trim(self, section: dict, budget: int):
+        section["content"] = trim_to_budget(section["content"], budget, section["query"])
+        section["tokens"] = count_tokens(section["content"])
+        if section["name"] not in self._trimmed:
+            self._trimmed.append(section["name"])
+
+    def build(self) -> Dict[str, str]:
+        """按预算裁剪各段内容，返回 段落名称 -> 内容"""
+        self._original_tokens = sum(section["tokens"] for section in self._sections)
+        if self.enabled:
+            for section in self._sections:
+                if section["budget"] is not None and section["tokens"] > section["budget"]:
+                    self._trim(section, section["budget"])
+
+            if self.total_budget is not None:
+                overflow = sum(section["tokens"] for section in self._sections) - self.total_budget
+                for section in sorted(self._sections, key=lambda s: s["priority"]):
+                    if overflow <= 0:
+                        break
+                    if section["budget"] is None:
+                        continue
+                    target = max(0, section["tokens"] - overflow)
+                    before = section["tokens"]
+                    self._trim(section, target)
+                    overflow -= before - section["tokens"]
+
+        return {section["name"]: section["content"] for section in self._sections}
+
+    def record(self, prompt: str) -> int:
+        """记录最终提示词的token数，返回该数值"""
+        prompt_tokens = count_tokens(prompt)
+        fixed_tokens = prompt_tokens - sum(section["tokens"] for section in self._sections)
+        prompt_metrics.record(self.stage, prompt_tokens, self._original_tokens + fixed_tokens, self._trimmed)
+
+        current = tracer.current_span()
+        if current is not None:
+            current.set_attribute("prompt_tokens", prompt_tokens)
+            if self._trimmed:
+                current.set_attribute("trimmed_sections", list(self._trimmed))
+        return prompt_tokens
+
+
+# 各段默认预算，可通过环境变量调整
+MEMORY_CONTEXT_BUDGET = get_env_int("PROMPT_BUDGET_MEMORY", 1500)
+INNER_THOUGHTS_BUDGET = get_env_int("PROMPT_BUDGET_THOUGHTS", 800)
+PREVIOUS_REPLY_BUDGET = get_env_int("PROMPT_BUDGET_PREVIOUS_REPLY", 300)
+DIALOGUE_BUDGET = get_env_int("PROMPT_BUDGET_DIALOGUE", 600)
+PROMPT_TOTAL_BUDGET = get_env_int("PROMPT_BUDGET_TOTAL", 2500)
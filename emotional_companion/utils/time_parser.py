@@ -0,0 +1,318 @@
+"""
+时间表达式解析模块
+基于规则在本地把中英文相对时间表达（如"昨天"、"上周"、"last week"）解析为时间范围，
+供记忆检索直接使用，无需LLM参与
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+from emotional_companion.memory.schema import time_range_filter
+
+
+@dataclass
+class TimeRange:
+    """解析得到的时间范围，start包含、end不包含"""
+    start: datetime
+    end: datetime
+    expression: str
+
+    def to_filter(self, field: str = "timestamp_epoch") -> Optional[dict]:
+        """转换为ChromaDB的数值时间过滤条件"""
+        return time_range_filter(self.start, self.end, field=field)
+
+    def describe(self) -> str:
+        """生成便于放入提示词的时间范围描述"""
+        return (f"{self.expression}（{self.start.strftime('%Y-%m-%d %H:%M')} 至 "
+                f"{self.end.strftime('%Y-%m-%d %H:%M')}）")
+
+
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4,
+              "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+
+_EN_NUMBERS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+               "seven": 7, "eight": 8, "nine": 9, "ten": 10, "a": 1, "an": 1,
+               "a couple of": 2, "a few": 3, "few": 3, "several": 3}
+
+_WEEKDAYS_CN = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6}
+
+_WEEKDAYS_EN = {"monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3,
+                "friday": 4, "saturday": 5, "sunday": 6}
+
+# 一天中的时段 (起始小时, 结束小时)
+_DAY_PARTS = {
+    "凌晨": (0, 6), "早上": (5, 12), "早晨": (5, 12), "上午": (5, 12), "今早": (5, 12),
+    "中午": (11, 14), "下午": (12, 18), "傍晚": (17, 20), "晚上": (18, 24), "今晚": (18, 24),
+    "夜里": (20, 24), "昨晚": (18, 24), "morning": (5, 12), "noon": (11, 14),
+    "afternoon": (12, 18), "evening": (17, 24), "night": (18, 24), "tonight": (18, 24),
+}
+
+_NUM = r"(\d+|[零〇一二两三四五六七八九十]+)"
+_EN_NUM = r"(\d+|one|two|three|four|five|six|seven|eight|nine|ten|a couple of|a few|few|several|an|a)"
+
+
+def _parse_number(token: str) -> int:
+    """解析阿拉伯数字、中文数字或英文数词"""
+    token = token.strip().lower()
+    if token.isdigit():
+        return int(token)
+    if token in _EN_NUMBERS:
+        return _EN_NUMBERS[token]
+    if token == "十":
+        return 10
+    if "十" in token:
+        tens, _, ones = token.partition("十")
+        return (_CN_DIGITS.get(tens, 1) if tens else 1) * 10 + (_CN_DIGITS.get(ones, 0) if ones else 0)
+    value = 0
+    for char in token:
+        value = value * 10 + _CN_DIGITS.get(char, 0)
+    return value
+
+
+def _day_start(dt: datetime) -> datetime:
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _day(now: datetime, offset: int) -> Tuple[datetime, datetime]:
+    start = _day_start(now) + timedelta(days=offset)
+    return start, start + timedelta(days=1)
+
+
+def _week(now: datetime, offset: int) -> Tuple[datetime, datetime]:
+    """以周一为一周起点"""
+    start = _day_start(now) - timedelta(days=now.weekday()) + timedelta(weeks=offset)
+    return start, start + timedelta(days=7)
+
+
+def _month(now: datetime, offset: int) -> Tuple[datetime, datetime]:
+    month_index = now.year * 12 + (now.month - 1) + offset
+    start = datetime(month_index // 12, month_index % 12 + 1, 1)
+    next_index = month_index + 1
+    return start, datetime(next_index // 12, next_index % 12 + 1, 1)
+
+
+def _months_ago(now: datetime, months: int) -> Tuple[datetime, datetime]:
+    """"N个月前"指的是N个月前的这一天前后，取前后半个月，而不是整个自然月"""
+    month_index = now.year * 12 + (now.month - 1) - months
+    year, month = month_index // 12, month_index % 12 + 1
+    next_index = month_index + 1
+    days_in_month = (datetime(next_index // 12, next_index % 12 + 1, 1) - datetime(year, month, 1)).days
+    anchor = _day_start(now).replace(year=year, month=month, day=min(now.day, days_in_month))
+    return anchor - timedelta(days=15), anchor + timedelta(days=16)
+
+
+def _year(now: datetime, offset: int) -> Tuple[datetime, datetime]:
+    return datetime(now.year + offset, 1, 1), datetime(now.year + offset + 1, 1, 1)
+
+
+def _recent(now: datetime, days: float) -> Tuple[datetime, datetime]:
+    return now - timedelta(days=days), now
+
+
+def _weekday(now: datetime, weekday: int, week_offset: Optional[int]) -> Tuple[datetime, datetime]:
+    """解析"周三"、"上周三"这类星期表达，未指定周时取最近一个已过去的该星期几"""
+    if week_offset is None:
+        days_back = (now.weekday() - weekday) % 7
+        return _day(now, -days_back)
+    week_start, _ = _week(now, week_offset)
+    start = week_start + timedelta(days=weekday)
+    return start, start + timedelta(days=1)
+
+
+def _weekend(now: datetime, week_offset: int) -> Tuple[datetime, datetime]:
+    week_start, week_end = _week(now, week_offset)
+    return week_start + timedelta(days=5), week_end
+
+
+def _week_offset_cn(prefix: str) -> Optional[int]:
+    return {"上上": -2, "上": -1, "这": 0, "本": 0, "下": 1}.get(prefix)
+
+
+def _absolute_date(now: datetime, year: Optional[str], month: str, day: str) -> Tuple[datetime, datetime]:
+    target_year = int(year) if year else now.year
+    start = datetime(target_year, int(month), int(day))
+    # 未写年份且日期在未来时，通常指的是去年
+    if not year and start > now + timedelta(days=1):
+        start = start.replace(year=target_year - 1)
+    return start, start + timedelta(days=1)
+
+
+# 规则表：按顺序匹配，越具体的规则越靠前
+_Resolver = Callable[[re.Match, datetime], Tuple[datetime, datetime]]
+_RULES: List[Tuple[re.Pattern, _Resolver]] = [
+    # 绝对日期
+    (re.compile(r"(\d{4})[-/年](\d{1,2})[-/月](\d{1,2})[日号]?"),
+     lambda m, now: _absolute_date(now, m.group(1), m.group(2), m.group(3))),
+    (re.compile(r"(\d{1,2})月(\d{1,2})[日号]"),
+     lambda m, now: _absolute_date(now, None, m.group(1), m.group(2))),
+    # 刚才
+    (re.compile(r"刚才|刚刚|方才|just now|a moment ago|earlier today", re.I),
+     lambda m, now: (now - timedelta(hours=1), now)),
+    # N天/周/月前
+    (re.compile(_NUM + r"\s*天(?:之|以)?前"),
+     lambda m, now: _day(now, -_parse_number(m.group(1)))),
+    (re.compile(r"\b" + _EN_NUM + r"\s+days?\s+ago\b", re.I),
+     lambda m, now: _day(now, -_parse_number(m.group(1)))),
+    (re.compile(_NUM + r"\s*个?(?:星期|周|礼拜)(?:之|以)?前"),
+     lambda m, now: _week(now, -_parse_number(m.group(1)))),
+    (re.compile(r"\b" + _EN_NUM + r"\s+weeks?\s+ago\b", re.I),
+     lambda m, now: _week(now, -_parse_number(m.group(1)))),
+    (re.compile(_NUM + r"\s*个月(?:之|以)?前"),
+     lambda m, now: _months_ago(now, _parse_number(m.group(1)))),
+    (re.compile(r"\b" + _EN_NUM + r"\s+months?\s+ago\b", re.I),
+     lambda m, now: _months_ago(now, _parse_number(m.group(1)))),
+    # 最近N天/周
+    (re.compile(r"(?:最近|过去|近|前)\s*" + _NUM + r"\s*天"),
+     lambda m, now: _recent(now, _parse_number(m.group(1)))),
+    (re.compile(r"(?:最近|过去|近|前)\s*" + _NUM + r"\s*个?(?:星期|周|礼拜)"),
+     lambda m, now: _recent(now, 7 * _parse_number(m.group(1)))),
+    (re.compile(r"\b(?:past|last)\s+" + _EN_NUM + r"\s+days\b", re.I),
+     lambda m, now: _recent(now, _parse_number(m.group(1)))),
+    (re.compile(r"\b(?:past|last)\s+" + _EN_NUM + r"\s+weeks\b", re.I),
+     lambda m, now: _recent(now, 7 * _parse_number(m.group(1)))),
+    # 相对日
+    (re.compile(r"大前天"), lambda m, now: _day(now, -3)),
+    (re.compile(r"前天|the day before yesterday", re.I), lambda m, now: _day(now, -2)),
+    (re.compile(r"昨天|昨日|昨晚|昨夜|yesterday|last night", re.I), lambda m, now: _day(now, -1)),
+    (re.compile(r"大后天"), lambda m, now: _day(now, 3)),
+    (re.compile(r"后天|the day after tomorrow", re.I), lambda m, now: _day(now, 2)),
+    (re.compile(r"明天|明日|明早|明晚|tomorrow", re.I), lambda m, now: _day(now, 1)),
+    (re.compile(r"今天|今日|今早|今晚|today|tonight|this (?:morning|afternoon|evening)", re.I),
+     lambda m, now: _day(now, 0)),
+    # 周末与星期几
+    (re.compile(r"(上上|上|这|本|下)个?周末"),
+     lambda m, now: _weekend(now, _week_offset_cn(m.group(1)))),
+    (re.compile(r"周末|\bweekend\b", re.I),
+     lambda m, now: _weekend(now, 0 if now.weekday() >= 5 else -1)),
+    (re.compile(r"\b(last|this|next) weekend\b", re.I),
+     lambda m, now: _weekend(now, {"last": -1, "this": 0, "next": 1}[m.group(1).lower()])),
+    # "这周一直"、"这周天气"中的"周一"、"周天"不是星期几
+    (re.compile(r"(上上|上|这|本|下)?个?(?:星期|周|礼拜)"
+                r"(一(?![直起样定般下切些点次个共])|[二三四五六日]|天(?![气空天]))"),
+     lambda m, now: _weekday(now, _WEEKDAYS_CN[m.group(2)],
+                             _week_offset_cn(m.group(1)) if m.group(1) else None)),
+    (re.compile(r"\b(last|this|next)?\s*(monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b", re.I),
+     lambda m, now: _weekday(now, _WEEKDAYS_EN[m.group(2).lower()],
+                             {"last": -1, "this": 0, "next": 1}[m.group(1).lower()] if m.group(1) else None)),
+    # 周
+    (re.compile(r"上上(?:个)?(?:星期|周|礼拜)"), lambda m, now: _week(now, -2)),
+    (re.compile(r"上(?:个)?(?:星期|周|礼拜)|last week", re.I), lambda m, now: _week(now, -1)),
+    (re.compile(r"(?:这|本)(?:个)?(?:星期|周|礼拜)|this week", re.I), lambda m, now: _week(now, 0)),
+    (re.compile(r"下(?:个)?(?:星期|周|礼拜)|next week", re.I), lambda m, now: _week(now, 1)),
+    # 月
+    (re.compile(r"上上个?月"), lambda m, now: _month(now, -2)),
+    (re.compile(r"上个?月|last month", re.I), lambda m, now: _month(now, -1)),
+    (re.compile(r"(?:这|本)个?月|this month", re.I), lambda m, now: _month(now, 0)),
+    (re.compile(r"下个?月|next month", re.I), lambda m, now: _month(now, 1)),
+    # 年
+    (re.compile(r"前年"), lambda m, now: _year(now, -2)),
+    (re.compile(r"去年|last year", re.I), lambda m, now: _year(now, -1)),
+    (re.compile(r"今年|this year", re.I), lambda m, now: _year(now, 0)),
+    # 模糊的近期表达
+    (re.compile(r"这两天|这俩天"), lambda m, now: _recent(now, 2)),
+    (re.compile(r"前几天|前些天|前段时间|a few days ago|the other day", re.I),
+     lambda m, now: (_day_start(now) - timedelta(days=7), _day_start(now) - timedelta(days=1))),
+    (re.compile(r"最近|近期|近来|这几天|这些天|这段时间|recently|lately|these days", re.I),
+     lambda m, now: _recent(now, 7)),
+]
+
+# 表示回忆过去的用语，包含今天的时间范围只在带有这些用语时才用于过滤记忆
+_RECALL_CUES = re.compile(
+    r"记得|回忆|想起|聊过|聊了|聊的|说过|说了|讲过|讲了|提过|提到|告诉过|上次|那次|那天|之前|以前|"
+    r"remember|recall|talked|told you|mentioned|did (?:i|we|you)|last time",
+    re.I,
+)
+
+# 未指明哪一周的星期几或周末（如"周三"、"周末"、"on Friday"），既可能指过去也可能指未来
+_BARE_WEEKDAY = re.compile(
+    r"^(?:个?(?:星期|周|礼拜)[一二三四五六日天]|周末|weekend|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday)$",
+    re.I,
+)
+
+# 表示打算、计划的用语，带有这些用语时未指明哪一周的星期几通常指未来
+_FUTURE_INTENT = re.compile(
+    r"要|打算|准备|计划|将|想去|会去|"
+    r"\b(?:going to|gonna|planning to|plan to|about to|will)\b|'ll",
+    re.I,
+)
+
+_DAY_PART_PATTERN = re.compile("|".join(sorted(map(re.escape, _DAY_PARTS), key=len, reverse=True)), re.I)
+
+
+def _narrow_to_day_part(text: str, match: re.Match, start: datetime, end: datetime) -> Tuple[datetime, datetime]:
+    """对单日范围，按"早上"、"晚上"等时段进一步收窄"""
+    if end - start != timedelta(days=1):
+        return start, end
+    # 表达式本身或紧随其后的几个字符中包含时段词
+    window = text[match.start():match.end() + 6]
+    part = _DAY_PART_PATTERN.search(window)
+    if not part:
+        return start, end
+    begin_hour, end_hour = _DAY_PARTS[part.group(0).lower()]
+    return start + timedelta(hours=begin_hour), start + timedelta(hours=end_hour)
+
+
+def parse_time_expression(text: str, now: Optional[datetime] = None) -> Optional[TimeRange]:
+    """
+    从文本中解析第一个可识别的时间表达式
+
+    Args:
+        text: 用户输入或时间表达式，如"昨天晚上我们聊了什么"、"last week"
+        now: 参考时间，默认当前时间
+
+    Returns:
+        TimeRange: 解析出的时间范围；没有时间表达时返回None
+    """
+    if not text:
+        return None
+    now = now or datetime.now()
+
+    best = None
+    for pattern, resolver in _RULES:
+        match = pattern.search(text)
+        # 取文本中最早出现的表达；位置相同时优先规则表中靠前的更具体规则
+        if match and (best is None or match.start() < best[0].start()):
+            best = (match, resolver)
+
+    if best is None:
+        return None
+
+    match, resolver = best
+    try:
+        start, end = resolver(match, now)
+    except (ValueError, KeyError, TypeError):
+        return None
+    start, end = _narrow_to_day_part(text, match, start, end)
+    return TimeRange(start=start, end=end, expression=match.group(0).strip())
+
+
+def parse_recall_range(text: str, now: Optional[datetime] = None,
+                       require_recall_cue: bool = True) -> Optional[TimeRange]:
+    """
+    解析用于过滤记忆检索的时间范围
+
+    - 从当前时间之后开始的范围（如"明天"、"下周"）不会有记忆，返回None；跨过当前时间的范围截断到当前时间
+    - 包含今天的范围（如"今天"、"最近"、"这周"）在闲聊中很常见，require_recall_cue为True时
+      只有文本带有回忆用语（如"记得"、"聊过"、"上次"）才返回，避免无意中缩小检索范围
+    - 未指明哪一周的星期几或周末（如"我周三要考试"）同样要求回忆用语，带有打算、计划的用语时不返回
+
+    Args:
+        text: 用户输入或时间表达式
+        now: 参考时间，默认当前时间
+        require_recall_cue: 包含今天的范围是否要求文本带有回忆用语；传入的是明确的时间表达式时设为False
+    """
+    now = now or datetime.now()
+    time_range = parse_time_expression(text, now=now)
+    if time_range is None or time_range.start >= now:
+        return None
+    if require_recall_cue and _BARE_WEEKDAY.match(time_range.expression):
+        if _FUTURE_INTENT.search(text) or not _RECALL_CUES.search(text):
+            return None
+    if time_range.end > _day_start(now):
+        if require_recall_cue and not _RECALL_CUES.search(text):
+            return None
+        time_range.end = min(time_range.end, now)
+    return time_range
@@ -0,0 +1,265 @@
+"""
+对话流程追踪工具
+为每轮对话生成trace ID，记录各阶段（情绪分析、记忆检索、工具调用、思考、回复、保存、
+嵌入计算和ChromaDB操作）的耗时span，保存在环形缓冲区中，并可按JSONL格式导出
+"""
+
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from emotional_companion.utils.env_utils import get_env_bool, get_env_int
+
+# 当前所在的span，asyncio任务和asyncio.to_thread都会复制上下文，子阶段因此能找到父span
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    """一段被追踪的操作"""
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start_time: float = field(default_factory=time.time)
+    duration_ms: Optional[float] = None
+    status: str = "ok"
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    _start_perf: float = field(default_factory=time.perf_counter, repr=False)
+
+    def set_attribute(self, key: str, value: Any):
+        """附加属性，如输入长度、命中条数等"""
+        self.attributes[key] = value
+
+    def finish(self, error: Optional[BaseException] = None):
+        """结束span并记录耗时"""
+        self.duration_ms = round((time.perf_counter() - self._start_perf) * 1000, 3)
+        if error is not None:
+            self.status = "cancelled" if isinstance(error, asyncio.CancelledError) else "error"
+            self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """span收集器，按trace保存最近的若干轮对话"""
+
+    def __init__(self, max_traces: int = 200, max_spans_per_trace: int = 500,
+                 export_path: Optional[str] = None, enabled: bool = True):
+        """
+        Args:
+            max_traces: 环形缓冲区保留的trace数量
+            max_spans_per_trace: 单个trace最多保留的span数量，防止长时间运行的后台trace无限增长
+            export_path: JSONL导出文件路径，为None时不导出
+            enabled: 是否启用追踪
+        """
+        self.max_traces = max_traces
+        self.max_spans_per_trace = max_spans_per_trace
+        self.export_path = export_path
+        self.enabled = enabled
+        self._traces: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def current_trace_id() -> Optional[str]:
+        """获取当前上下文的trace ID"""
+        current = _current_span.get()
+        return current.trace_id if current else None
+
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        """获取当前上下文所在的span"""
+        return _current_span.get()
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """开始一条新的trace（一轮对话），返回根span"""
+        with self._start_span(name, attributes, new_trace=True) as root:
+            yield root
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """在当前trace下开始一个子span，不在任何trace中时自成一条trace"""
+        with self._start_span(name, attributes, new_trace=False) as current:
+            yield current
+
+    @contextmanager
+    def _start_span(self, name: str, attributes: dict, new_trace: bool):
+        if not self.enabled:
+            yield Span(name=name, trace_id="", span_id="")
+            return
+
+        parent = None if new_trace else _current_span.get()
+        current = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else uuid.uuid4().hex[:16],
+            span_id=uuid.uuid4().hex[:8],
+            parent_id=parent.span_id if parent else None,
+            attributes=dict(attributes),
+        )
+        token = _current_span.set(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.finish(e)
+            raise
+        else:
+            current.finish()
+        finally:
+            _current_span.reset(token)
+            self._record(current)
+
+    def _record(self, span: Span):
+        """将结束的span写入环形缓冲区并导出"""
+        data = span.to_dict()
+        with self._lock:
+            trace = self._traces.get(span.trace_id)
+            if trace is None:
+                trace = {"trace_id": span.trace_id, "spans": []}
+                self._traces[span.trace_id] = trace
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            if span.parent_id is None:
+                trace.update(name=span.name, start_time=span.start_time,
+                             duration_ms=span.duration_ms, status=span.status,
+                             attributes=span.attributes)
+            if len(trace["spans"]) < self.max_spans_per_trace:
+                trace["spans"].append(data)
+            else:
+                trace["dropped_spans"] = trace.get("dropped_spans", 0) + 1
+
+            if self.export_path:
+                self._export(data)
+
+    def _export(self, data: dict):
+        """以JSONL格式追加写入span，失败时停止导出，不影响主流程"""
+        try:
+            directory = os.path.dirname(self.export_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(data, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print(f"[警告] 追踪数据导出失败，已停止导出: {e}")
+            self.export_path = None
+
+    @staticmethod
+    def _summarize(trace: dict) -> dict:
+        """按span名称汇总耗时，得到每个阶段的耗时分解"""
+        breakdown: Dict[str, dict] = {}
+        for span in trace["spans"]:
+            if span["parent_id"] is None or span["duration_ms"] is None:
+                continue
+            entry = breakdown.setdefault(span["name"], {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] = round(entry["total_ms"] + span["duration_ms"], 3)
+        summary = {key: value for key, value in trace.items() if key != "spans"}
+        summary["span_count"] = len(trace["spans"])
+        summary["breakdown"] = breakdown
+        return summary
+
+    def get_recent_traces(self, limit: int = 20, include_spans: bool = False) -> List[dict]:
+        """获取最近的trace，默认只返回各阶段耗时汇总"""
+        with self._lock:
+            traces = list(self._traces.values())[-limit:]
+            traces = [dict(trace, spans=list(trace["spans"])) for trace in reversed(traces)]
+        if include_spans:
+            return [dict(self._summarize(trace), spans=trace["spans"]) for trace in traces]
+        return [self._summarize(trace) for trace in traces]
+
+    def get_trace(self, trace_id: str) -> Optional[dict]:
+        """获取指定trace的全部span"""
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None:
+                return None
+            trace = dict(trace, spans=list(trace["spans"]))
+        return dict(self._summarize(trace), spans=trace["spans"])
+
+    def clear(self):
+        """清空缓冲区"""
+        with self._lock:
+            self._traces.clear()
+
+
+def traced(name: Optional[str] = None):
+    """装饰器：将同步或异步函数的执行记录为span"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_tool(func):
+    """
+    包装代理工具函数，每次调用记录一个tool span
+
+    AutoGen在线程池中执行同步工具时不会复制上下文，这里改为异步函数并通过
+    asyncio.to_thread执行原函数，使工具内部的记忆操作仍归属于当前对话的trace。
+    functools.wraps保留了原函数的签名和文档，工具的参数描述不受影响
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with tracer.span(f"tool.{func.__name__}"):
+            return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
+
+class TracedProxy:
+    """代理对象，将指定方法的每次调用记录为span，其余属性直接透传"""
+
+    def __init__(self, target, prefix: str, methods):
+        self._target = target
+        self._prefix = prefix
+        self._methods = set(methods)
+
+    def __getattr__(self, item):
+        attribute = getattr(self._target, item)
+        if item not in self._methods or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def wrapper(*args, **kwargs):
+            with tracer.span(f"{self._prefix}.{item}"):
+                return attribute(*args, **kwargs)
+        return wrapper
+
+
+tracer = Tracer(
+    max_traces=get_env_int("TRACE_BUFFER_SIZE", 200),
+    export_path=os.getenv("TRACE_EXPORT_PATH") or None,
+    enabled=get_env_bool("ENABLE_TRACING", True),
+)
@@ -868,6 +868,16 @@ async updateMaximizeButton() {
                 this.handleWebSocketChatResponse(data)
                 break
                 
+            case 'chat_delta':
+                // 处理流式回复片段
+                this.handleWebSocketChatDelta(data)
+                break
+                
+            case 'chat_cancelled':
+                // 处理被取代的回复
+                this.handleWebSocketChatCancelled(data)
+                break
+                
             case 'proactive_chat':
                 // 处理主动消息
                 this.handleProactiveMessage(data)
@@ -878,17 +888,64 @@ async updateMaximizeButton() {
         }
     }
 
+    /**
+     * 处理WebSocket流式回复片段
+     */
+    handleWebSocketChatDelta(data) {
+        const { stream_id, delta } = data
+        
+        // 收到第一个片段时创建消息气泡
+        if (!this.streamingBubble || this.streamingId !== stream_id) {
+            this.hideTypingIndicator()
+            const messageElement = this.createMessageElement('bot', '')
+            this.chatMessages.appendChild(messageElement)
+            this.streamingBubble = messageElement.querySelector('.message-bubble')
+            this.streamingId = stream_id
+            this.streamingText = ''
+        }
+        
+        this.streamingText += delta
+        this.streamingBubble.innerHTML = this.streamingText.replace(/\n/g, '<br>')
+        this.scrollToBottom()
+    }
+
+    /**
+     * 处理被新消息取代的回复：移除未完成的流式气泡，等待合并后的回复
+     */
+    handleWebSocketChatCancelled(data) {
+        const { stream_id } = data
+        
+        if (stream_id && this.streamingBubble && this.streamingId === stream_id) {
+            const messageElement = this.streamingBubble.closest('.message')
+            if (messageElement) {
+                messageElement.remove()
+            }
+            this.streamingBubble = null
+            this.streamingId = null
+            this.streamingText = ''
+        }
+    }
+
     /**
      * 处理WebSocket聊天回复
      */
     async handleWebSocketChatResponse(data) {
-        const { response, emotional_state, commands } = data
+        const { response, emotional_state, commands, stream_id, streamed } = data
         
         // 隐藏"正在输入"状态
         this.hideTypingIndicator()
         
-        // 添加AI回复到界面
-        await this.addBotMessage(response, emotional_state)
+        if (streamed && this.streamingBubble && this.streamingId === stream_id) {
+            // 流式回复结束，以完整回复覆盖已显示的片段
+            this.streamingBubble.innerHTML = response.replace(/\n/g, '<br>')
+            this.streamingBubble = null
+            this.streamingId = null
+            this.streamingText = ''
+            this.scrollToBottom()
+        } else {
+            // 添加AI回复到界面
+            await this.addBotMessage(response, emotional_state)
+        }
         
         // 更新情感状态
         if (emotional_state) {
@@ -955,7 +1012,7 @@ async updateMaximizeButton() {
      */
     sendMessageViaWebSocket(message) {
         if (this.wsClient && this.wsClient.isConnected()) {
-            return this.wsClient.sendChatMessage(message)
+            return this.wsClient.sendChatMessage(message, true)
         }
         return false
     }
@@ -120,9 +120,10 @@ class SimpleWebSocketClient {
     
     /**
      * 发送聊天消息
+     * stream为true时服务器会先推送chat_delta片段，再以chat_response收尾
      */
-    sendChatMessage(content) {
-        return this.sendMessage('chat', content)
+    sendChatMessage(content, stream = false) {
+        return this.sendMessage(stream ? 'chat_stream' : 'chat', content)
     }
     
     /**
@@ -147,7 +148,31 @@ class SimpleWebSocketClient {
                         response: messageData.response,
                         emotional_state: messageData.emotional_state,
                         processing_time: messageData.processing_time,
-                        commands: messageData.commands
+                        commands: messageData.commands,
+                        stream_id: messageData.stream_id,
+                        streamed: messageData.streamed
+                    })
+                }
+                break
+                
+            case 'chat_delta':
+                // 流式回复片段
+                if (this.onMessage) {
+                    this.onMessage({
+                        type: 'chat_delta',
+                        stream_id: messageData.stream_id,
+                        delta: messageData.delta
+                    })
+                }
+                break
+                
+            case 'chat_cancelled':
+                // 回复被更新的消息取代，该消息会合并到新消息的回复中
+                if (this.onMessage) {
+                    this.onMessage({
+                        type: 'chat_cancelled',
+                        stream_id: messageData.stream_id,
+                        session_id: messageData.session_id
                     })
                 }
                 break
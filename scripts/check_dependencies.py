@@ -43,7 +43,6 @@ def main():
         ("pyautogen", "PyAutoGen"),
         ("chromadb", "ChromaDB"),
         ("sentence_transformers", "Sentence Transformers"),
-        ("schedule", "Schedule"),
         ("pyfiglet", "PyFiglet"),
         ("dotenv", "Python-dotenv"),
         ("emotional_companion", "Emotional Companion")
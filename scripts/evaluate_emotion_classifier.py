@@ -0,0 +1,166 @@
+"""
+本地情绪分类器离线评估脚本
+对比本地分类器与参考标注（或emotion_analyzer代理）的一致率和延迟
+
+用法:
+    python scripts/evaluate_emotion_classifier.py
+    python scripts/evaluate_emotion_classifier.py --dataset eval.jsonl --llm
+
+数据集为JSONL格式，每行形如 {"text": "...", "emotion": "sad", "valence": -0.6}
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from emotional_companion.analysis.emotion_classifier import LocalEmotionClassifier, normalize_emotion_label
+
+# 内置评估集，与分类器种子集不重叠
+BUILTIN_DATASET = [
+    {"text": "今天升职加薪了，好开心", "emotion": "happy", "valence": 0.8},
+    {"text": "下周就放假啦，超期待", "emotion": "excited", "valence": 0.8},
+    {"text": "谢谢你昨天安慰我", "emotion": "grateful", "valence": 0.7},
+    {"text": "好想见到你", "emotion": "affectionate", "valence": 0.6},
+    {"text": "我刚到家", "emotion": "neutral", "valence": 0.0},
+    {"text": "泡了杯茶，听听音乐", "emotion": "calm", "valence": 0.3},
+    {"text": "我的猫去世了", "emotion": "sad", "valence": -0.9},
+    {"text": "朋友们都没空，只有我自己", "emotion": "lonely", "valence": -0.6},
+    {"text": "论文还没写完，deadline快到了", "emotion": "anxious", "valence": -0.6},
+    {"text": "室友半夜还在吵，真讨厌", "emotion": "angry", "valence": -0.7},
+    {"text": "今天跑了十公里，腿都软了", "emotion": "tired", "valence": -0.3},
+    {"text": "居然在街上碰到了高中同学", "emotion": "surprised", "valence": 0.2},
+    {"text": "这道题我怎么都想不明白", "emotion": "confused", "valence": -0.3},
+    {"text": "准备了好久的比赛还是没拿奖", "emotion": "disappointed", "valence": -0.6},
+    {"text": "刚刚地震了，好害怕", "emotion": "scared", "valence": -0.8},
+    {"text": "I just got the job!", "emotion": "excited", "valence": 0.9},
+    {"text": "Feeling kind of lonely tonight", "emotion": "lonely", "valence": -0.6},
+    {"text": "I'm exhausted after work", "emotion": "tired", "valence": -0.4},
+]
+
+
+def load_dataset(path):
+    """加载JSONL评估集，未指定时使用内置评估集"""
+    if not path:
+        return BUILTIN_DATASET
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                samples.append(json.loads(line))
+    return samples
+
+
+def percentile(values, ratio):
+    """计算分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(ratio * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def sign(value):
+    """情感价值的正负号，绝对值较小时视为中性"""
+    if value > 0.15:
+        return 1
+    if value < -0.15:
+        return -1
+    return 0
+
+
+async def run_llm(samples, config_path):
+    """使用emotion_analyzer代理生成参考结果"""
+    from autogen_agentchat.messages import TextMessage
+    from autogen_core import CancellationToken
+    from emotional_companion.agents.conversation_handler import ConversationHandler
+
+    handler = ConversationHandler(config_path, local_emotion_classifier=False)
+    results, latencies = [], []
+    for sample in samples:
+        message = TextMessage(content=f"分析这句话中的情绪: {sample['text']}", source="user")
+        start = time.perf_counter()
+        emotion_detector = handler.agent_system.create_emotion_detector()
+        response = await emotion_detector.on_messages([message], CancellationToken())
+        latencies.append(time.perf_counter() - start)
+        content = response.chat_message.content if response.chat_message else "{}"
+        results.append(handler._parse_emotion_data(content))
+    return results, latencies
+
+
+def report(name, predictions, references):
+    """打印一致率统计"""
+    emotion_match = sum(1 for p, r in zip(predictions, references)
+                        if normalize_emotion_label(p.get("emotion")) == normalize_emotion_label(r.get("emotion")))
+    valence_match = sum(1 for p, r in zip(predictions, references)
+                        if sign(float(p.get("valence", 0))) == sign(float(r.get("valence", 0))))
+    total = len(references) or 1
+    print(f"  [{name}] 情绪一致率: {emotion_match / total:.1%}  正负性一致率: {valence_match / total:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="评估本地情绪分类器")
+    parser.add_argument("--dataset", help="JSONL格式评估集路径，默认使用内置评估集")
+    parser.add_argument("--model", default="BAAI/bge-base-zh-v1.5", help="嵌入模型名称")
+    parser.add_argument("--threshold", type=float, default=0.45, help="回退到LLM的置信度阈值")
+    parser.add_argument("--llm", action="store_true", help="同时调用emotion_analyzer代理进行对比")
+    parser.add_argument("--config", default="configs/OAI_CONFIG_LIST.json", help="模型配置文件路径")
+    parser.add_argument("--verbose", action="store_true", help="打印每条样本的结果")
+    args = parser.parse_args()
+
+    from chromadb.utils import embedding_functions
+
+    samples = load_dataset(args.dataset)
+    print(f"=== 本地情绪分类器评估（{len(samples)} 条样本）===")
+
+    embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=args.model)
+    classifier = LocalEmotionClassifier(embedding_function, confidence_threshold=args.threshold)
+
+    warmup_start = time.perf_counter()
+    classifier.warmup()
+    print(f"种子集嵌入耗时: {time.perf_counter() - warmup_start:.2f}秒")
+
+    local_results, local_latencies, confidences = [], [], []
+    for sample in samples:
+        start = time.perf_counter()
+        result, confidence = classifier.classify(sample["text"])
+        local_latencies.append(time.perf_counter() - start)
+        local_results.append(result)
+        confidences.append(confidence)
+        if args.verbose:
+            print(f"  {sample['text'][:30]:<30} -> {result['emotion']:<13} 置信度 {confidence:.2f}"
+                  f" (标注: {sample.get('emotion', '-')})")
+
+    confident = [classifier.is_confident(c) for c in confidences]
+    print(f"\n本地分类延迟: p50 {percentile(local_latencies, 0.5) * 1000:.1f}ms"
+          f"  p95 {percentile(local_latencies, 0.95) * 1000:.1f}ms")
+    print(f"回退到LLM的比例: {1 - sum(confident) / len(samples):.1%}")
+
+    labeled = [i for i, s in enumerate(samples) if "emotion" in s]
+    if labeled:
+        print("\n与标注对比:")
+        report("本地", [local_results[i] for i in labeled], [samples[i] for i in labeled])
+        confident_labeled = [i for i in labeled if confident[i]]
+        if confident_labeled:
+            report("本地(高置信)", [local_results[i] for i in confident_labeled],
+                   [samples[i] for i in confident_labeled])
+
+    if args.llm:
+        llm_results, llm_latencies = asyncio.run(run_llm(samples, args.config))
+        print(f"\nLLM延迟: p50 {percentile(llm_latencies, 0.5):.2f}s  p95 {percentile(llm_latencies, 0.95):.2f}s")
+        print("与LLM对比:")
+        report("本地 vs LLM", local_results, llm_results)
+        intensity_diff = statistics.mean(abs(float(l["intensity"]) - float(m["intensity"]))
+                                         for l, m in zip(local_results, llm_results))
+        print(f"  平均强度差: {intensity_diff:.2f}")
+        if labeled:
+            report("LLM", [llm_results[i] for i in labeled], [samples[i] for i in labeled])
+
+
+if __name__ == "__main__":
+    main()
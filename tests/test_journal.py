@@ -0,0 +1,126 @@
+import contextvars
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from emotional_companion.memory.journal import WriteAheadJournal
+
+
+def make_journal(tmp_path, **kwargs):
+    kwargs.setdefault("commit_delay_ms", 0)
+    return WriteAheadJournal(str(tmp_path / "memory_journal.jsonl"), **kwargs)
+
+
+def test_applied_records_truncate_the_journal(tmp_path):
+    journal = make_journal(tmp_path)
+    first = journal.record([("episodic_memory", "add", {"ids": ["a"]})])
+    second = journal.record([("episodic_memory", "update", {"ids": ["a"]})])
+    assert journal.get_stats()["outstanding"] == 2
+
+    journal.applied(first)
+    assert journal.get_stats()["size_bytes"] > 0
+    journal.applied(second)
+    stats = journal.get_stats()
+    assert stats["outstanding"] == 0
+    assert stats["size_bytes"] == 0
+    assert stats["truncations"] == 1
+    journal.close()
+
+
+def test_oversized_journal_is_compacted_to_outstanding_records(tmp_path):
+    journal = make_journal(tmp_path, max_bytes=1)
+    pending = journal.record([("episodic_memory", "add", {"ids": ["pending"]})])
+    done = journal.record([("episodic_memory", "add", {"ids": ["done"]})])
+    journal.applied(done)
+    journal.close()
+
+    lines = (tmp_path / "memory_journal.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["ops"][0]["args"]["ids"] for line in lines] == [["pending"]]
+    assert pending != done
+
+
+def test_replay_turns_add_into_upsert_and_truncates(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.record([
+        ("episodic_memory", "add", {"ids": ["a"], "documents": ["你好"]}),
+        ("semantic_memory", "delete", {"ids": ["b"]}),
+    ])
+    journal.close()
+
+    # 模拟重启：未标记应用的记录在新实例中重放
+    journal = make_journal(tmp_path)
+    applied = []
+    assert journal.replay(lambda collection, method, args: applied.append((collection, method, args))) == 1
+    assert applied == [
+        ("episodic_memory", "upsert", {"ids": ["a"], "documents": ["你好"]}),
+        ("semantic_memory", "delete", {"ids": ["b"]}),
+    ]
+    assert journal.get_stats()["size_bytes"] == 0
+    assert journal.replay(lambda *args: applied.append(args)) == 0
+    journal.close()
+
+
+def test_replay_skips_partial_last_line(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.record([("episodic_memory", "upsert", {"ids": ["a"]})])
+    journal.close()
+    with open(tmp_path / "memory_journal.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"ts": 1, "ops": [{"collection": "episodic')
+
+    journal = make_journal(tmp_path)
+    applied = []
+    assert journal.replay(lambda collection, method, args: applied.append(args["ids"])) == 1
+    assert applied == [["a"]]
+    journal.close()
+
+
+class FakeCollection:
+    """记录写入调用的集合，get返回预置的记录"""
+
+    def __init__(self, records=None):
+        self.records = records or {}
+        self.calls = []
+
+    def get(self, ids=None, **kwargs):
+        ids = list(self.records) if ids is None else [i for i in ids if i in self.records]
+        return {"ids": ids, "metadatas": [dict(self.records[i]) for i in ids]}
+
+    def update(self, **kwargs):
+        self.calls.append(("update", kwargs["ids"]))
+
+
+def make_memory(tmp_path, episodic):
+    pytest.importorskip("chromadb")
+    from emotional_companion.memory.emotional_memory import EmotionalMemorySystem
+
+    memory = EmotionalMemorySystem.__new__(EmotionalMemorySystem)
+    memory.collections = {"episodic": episodic}
+    memory.decay_rate = 0.05
+    memory._current_unit = contextvars.ContextVar("memory_unit_test", default=None)
+    memory._write_stats = {"units": 0, "mutations": 0, "writes": 0, "state_saves_collapsed": 0}
+    memory.journal = make_journal(tmp_path)
+    return memory
+
+
+def test_memory_decay_is_journaled_as_one_record(tmp_path):
+    old = (datetime.now() - timedelta(days=10)).timestamp()
+    episodic = FakeCollection({
+        memory_id: {"last_accessed_epoch": old, "importance": 0.2} for memory_id in ("a", "b", "c")
+    })
+    memory = make_memory(tmp_path, episodic)
+
+    memory.apply_memory_decay()
+    assert episodic.calls == [("update", ["a", "b", "c"])]
+    stats = memory.journal.get_stats()
+    assert stats["records"] == 1
+    assert stats["outstanding"] == 0
+
+
+def test_memory_access_update_is_journaled(tmp_path):
+    episodic = FakeCollection({"a": {"importance": 0.5}})
+    memory = make_memory(tmp_path, episodic)
+
+    memory.update_memory_access("a")
+    assert episodic.calls == [("update", ["a"])]
+    assert memory.journal.get_stats()["records"] == 1
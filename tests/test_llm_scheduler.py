@@ -0,0 +1,180 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+from emotional_companion.agents import llm_scheduler
+from emotional_companion.agents.llm_scheduler import (
+    PRIORITY_INTERACTIVE,
+    PRIORITY_POST_TURN,
+    PRIORITY_PROACTIVE,
+    EndpointLimiter,
+    LLMScheduler,
+    priority_scope,
+)
+
+
+def make_limiter(max_concurrency=1, tpm_limit=0, background_share=0.5):
+    return EndpointLimiter("http://test", max_concurrency, tpm_limit, background_share)
+
+
+def rate_limit_error(headers):
+    request = httpx.Request("POST", "http://test/v1/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    async def scenario():
+        limiter = make_limiter(max_concurrency=1, background_share=1.0)
+        held = await limiter.acquire(PRIORITY_INTERACTIVE, 0)
+        order = []
+
+        async def request(name, priority):
+            reservation = await limiter.acquire(priority, 0)
+            order.append(name)
+            await asyncio.sleep(0)
+            limiter.release(reservation, None)
+
+        tasks = [asyncio.create_task(request(name, priority)) for name, priority in [
+            ("proactive", PRIORITY_PROACTIVE), ("post_turn", PRIORITY_POST_TURN),
+            ("interactive-1", PRIORITY_INTERACTIVE), ("interactive-2", PRIORITY_INTERACTIVE)]]
+        await asyncio.sleep(0)
+        limiter.release(held, None)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["interactive-1", "interactive-2", "post_turn", "proactive"]
+
+
+def test_background_requests_use_only_their_share():
+    async def scenario():
+        limiter = make_limiter(max_concurrency=4, background_share=0.5)
+        background = [await limiter.acquire(PRIORITY_POST_TURN, 0) for _ in range(2)]
+        third = asyncio.create_task(limiter.acquire(PRIORITY_PROACTIVE, 0))
+        await asyncio.sleep(0.01)
+        blocked = not third.done()
+        # 后台请求占满份额时实时请求仍可执行
+        interactive = await asyncio.wait_for(limiter.acquire(PRIORITY_INTERACTIVE, 0), 0.1)
+        limiter.release(background[0], None)
+        await asyncio.wait_for(third, 0.1)
+        return blocked, limiter.in_flight, interactive
+
+    blocked, in_flight, _ = asyncio.run(scenario())
+    assert blocked
+    assert in_flight == 3
+
+
+def test_tpm_budget_waits_for_the_window_and_uses_actual_usage(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "TPM_WINDOW", 0.1)
+
+    async def scenario():
+        limiter = make_limiter(max_concurrency=4, tpm_limit=1000)
+        first = await limiter.acquire(PRIORITY_INTERACTIVE, 800)
+        start = time.monotonic()
+        second = await limiter.acquire(PRIORITY_INTERACTIVE, 300)
+        waited = time.monotonic() - start
+        limiter.release(first, None)
+        # 按实际用量修正后，剩余预算足够立即放行
+        limiter.release(second, 100)
+        third = await asyncio.wait_for(limiter.acquire(PRIORITY_INTERACTIVE, 800), 0.05)
+        return waited, third
+
+    waited, _ = asyncio.run(scenario())
+    assert waited >= 0.05
+
+
+def test_background_tpm_budget_is_a_share_of_the_limit():
+    async def scenario():
+        limiter = make_limiter(max_concurrency=4, tpm_limit=1000, background_share=0.5)
+        await limiter.acquire(PRIORITY_INTERACTIVE, 400)
+        background = asyncio.create_task(limiter.acquire(PRIORITY_POST_TURN, 200))
+        await asyncio.sleep(0.01)
+        background_waits = not background.done()
+        background.cancel()
+        interactive = await asyncio.wait_for(limiter.acquire(PRIORITY_INTERACTIVE, 200), 0.05)
+        return background_waits, interactive
+
+    background_waits, _ = asyncio.run(scenario())
+    assert background_waits
+
+
+def test_retry_after_blocks_new_requests():
+    async def scenario():
+        limiter = make_limiter(max_concurrency=4)
+        limiter.block_for(0.1)
+        start = time.monotonic()
+        await limiter.acquire(PRIORITY_INTERACTIVE, 0)
+        return time.monotonic() - start
+
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_retry_after_header_parsing():
+    assert llm_scheduler._retry_after_seconds(rate_limit_error({"retry-after-ms": "250"})) == 0.25
+    assert llm_scheduler._retry_after_seconds(rate_limit_error({"retry-after": "3"})) == 3.0
+    assert llm_scheduler._retry_after_seconds(rate_limit_error({})) is None
+
+
+class FlakyClient:
+    """前几次调用抛出预设的异常，之后返回结果"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def create(self, messages, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def make_scheduled(client, max_retries=2):
+    scheduler = LLMScheduler()
+    scheduler.max_retries = max_retries
+    scheduler.base_delay = 0.01
+    return scheduler.wrap(client, "http://test", max_concurrency=2, tpm_limit=0)
+
+
+def test_rate_limited_call_retries_after_the_header_delay():
+    client = FlakyClient([rate_limit_error({"retry-after-ms": "50"})])
+    scheduled = make_scheduled(client)
+
+    async def scenario():
+        with priority_scope(PRIORITY_POST_TURN):
+            start = time.monotonic()
+            result = await scheduled.create([])
+            return result, time.monotonic() - start
+
+    result, elapsed = asyncio.run(scenario())
+    assert result == "ok" and client.calls == 2
+    assert elapsed >= 0.04
+    stats = scheduled.limiter.get_stats()
+    assert stats["in_flight"] == 0
+    assert stats["by_priority"]["post_turn"]["rate_limited"] == 1
+    assert stats["by_priority"]["post_turn"]["retries"] == 1
+
+
+def test_non_retryable_errors_are_raised_without_retry():
+    client = FlakyClient([ValueError("bad request")])
+    scheduled = make_scheduled(client)
+
+    with pytest.raises(ValueError):
+        asyncio.run(scheduled.create([]))
+    assert client.calls == 1
+    stats = scheduled.limiter.get_stats()
+    assert stats["in_flight"] == 0
+    assert stats["by_priority"]["interactive"]["errors"] == 1
+
+
+def test_retries_stop_after_the_limit():
+    client = FlakyClient([rate_limit_error({"retry-after-ms": "1"}) for _ in range(5)])
+    scheduled = make_scheduled(client, max_retries=2)
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(scheduled.create([]))
+    assert client.calls == 3
+    assert scheduled.limiter.in_flight == 0
@@ -0,0 +1,141 @@
+import pytest
+
+from emotional_companion.agents import load_control
+from emotional_companion.agents.load_control import LoadController
+from emotional_companion.agents.pipeline_profiles import DEGRADATION_LADDER
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+class FakeStageStats:
+    """固定的历史中位数和近期平均延迟"""
+
+    def __init__(self, baseline=None, recent=None, samples=10):
+        self.baseline = baseline
+        self.recent = recent
+        self.samples = samples
+
+    def percentile(self, ratio, min_samples=20):
+        return self.baseline
+
+    def recent_mean(self, window_seconds, min_samples=1):
+        return self.recent if self.samples >= min_samples else None
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(load_control, "time", fake)
+    return fake
+
+
+def make_controller(queue, stages=None, **kwargs):
+    stages = stages or {}
+    defaults = dict(max_in_flight=8, max_queue=4, latency_inflation=2.0, step_down=1.0, step_up=0.6,
+                    recovery_seconds=30, step_down_interval=5, latency_window=60,
+                    latency_min_samples=5, latency_load_floor=0.25)
+    defaults.update(kwargs)
+    return LoadController(queue_depth_provider=lambda: queue["depth"],
+                          stage_stats_provider=lambda stage: stages.get(stage, FakeStageStats()),
+                          **defaults)
+
+
+def test_steps_down_one_level_per_interval(clock):
+    queue = {"depth": 4}
+    controller = make_controller(queue)
+
+    assert controller.evaluate() is DEGRADATION_LADDER[1]
+    # 间隔内压力仍然很高也不会继续降级
+    clock.now += 1
+    assert controller.evaluate() is DEGRADATION_LADDER[1]
+    clock.now += 5
+    assert controller.evaluate() is DEGRADATION_LADDER[2]
+    for _ in range(5):
+        clock.now += 5
+        controller.evaluate()
+    assert controller.level == len(DEGRADATION_LADDER) - 1
+
+
+def test_recovers_one_level_after_sustained_calm(clock):
+    queue = {"depth": 4}
+    controller = make_controller(queue)
+    controller.evaluate()
+    clock.now += 5
+    controller.evaluate()
+    assert controller.level == 2
+
+    queue["depth"] = 0
+    controller.evaluate()
+    clock.now += 29
+    assert controller.evaluate() is DEGRADATION_LADDER[2]
+    clock.now += 1
+    assert controller.evaluate() is DEGRADATION_LADDER[1]
+    # 每升一级重新计时
+    clock.now += 10
+    assert controller.level == 1 and controller.evaluate() is DEGRADATION_LADDER[1]
+    clock.now += 20
+    assert controller.evaluate() is DEGRADATION_LADDER[0]
+
+
+def test_pressure_between_thresholds_resets_recovery(clock):
+    queue = {"depth": 4}
+    controller = make_controller(queue)
+    controller.evaluate()
+
+    queue["depth"] = 0
+    controller.evaluate()
+    clock.now += 20
+    # 压力介于step_up和step_down之间：不降级，但中断恢复计时
+    queue["depth"] = 3
+    controller.evaluate()
+    queue["depth"] = 0
+    clock.now += 20
+    controller.evaluate()
+    assert controller.level == 1
+    clock.now += 30
+    controller.evaluate()
+    assert controller.level == 0
+
+
+def test_latency_alone_does_not_degrade_a_lightly_loaded_server(clock):
+    stages = {"thinker": FakeStageStats(baseline=1.0, recent=5.0)}
+    controller = make_controller({"depth": 0}, stages)
+
+    assert controller.evaluate() is DEGRADATION_LADDER[0]
+    assert controller.last_pressure == 0.0
+    assert controller.get_stats()["signals"]["latency_stage"] == "thinker"
+
+
+def test_latency_counts_once_load_reaches_the_floor(clock):
+    stages = {"thinker": FakeStageStats(baseline=1.0, recent=5.0)}
+    controller = make_controller({"depth": 1}, stages)
+
+    assert controller.evaluate() is DEGRADATION_LADDER[1]
+    assert controller.last_pressure == 2.5
+
+
+def test_latency_without_enough_samples_is_ignored(clock):
+    stages = {"companion": FakeStageStats(baseline=1.0, recent=5.0, samples=2)}
+    controller = make_controller({"depth": 1}, stages)
+
+    controller.evaluate()
+    assert controller.last_pressure == 0.25
+    assert controller.level == 0
+
+
+def test_in_flight_turns_count_toward_pressure(clock):
+    controller = make_controller({"depth": 0})
+    with controller.track_turn(), controller.track_turn():
+        controller.evaluate()
+        assert controller.get_stats()["signals"]["in_flight"] == 2
+    assert controller.last_pressure == 0.25
+    assert controller.in_flight == 0
@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+
+import pytest
+from pydantic import ValidationError
+
+from emotional_companion.memory.operations import MemoryOperation, apply_memory_operations, validate_operation
+
+
+class FakeMemorySystem:
+    """记录调用顺序和是否处于批量写入中的记忆系统"""
+
+    def __init__(self):
+        self.calls = []
+        self.batches = 0
+        self.in_batch = False
+
+    @contextmanager
+    def batch_writes(self):
+        self.batches += 1
+        self.in_batch = True
+        try:
+            yield
+        finally:
+            self.in_batch = False
+
+    def _record(self, name, *args):
+        self.calls.append((name, args, self.in_batch))
+
+    def update_emotional_state(self, *args):
+        self._record("update_emotional_state", *args)
+
+    def add_relationship_event(self, *args):
+        self._record("add_relationship_event", *args)
+
+    def add_user_preference(self, *args):
+        self._record("add_user_preference", *args)
+
+    def add_user_profile_info(self, *args):
+        self._record("add_user_profile_info", *args)
+
+    def delete_user_preference(self, *args):
+        self._record("delete_user_preference", *args)
+        return False
+
+    def delete_user_profile_info(self, *args):
+        self._record("delete_user_profile_info", *args)
+        return True
+
+
+def test_unknown_op_is_rejected():
+    with pytest.raises(ValidationError):
+        MemoryOperation(op="drop_all_memories")
+
+
+def test_missing_required_fields():
+    assert validate_operation(MemoryOperation(op="save_user_preference", category="食物", item="  ")) \
+        == "save_user_preference缺少item"
+    assert validate_operation(MemoryOperation(op="update_emotion")) == "update_emotion缺少emotion"
+    assert validate_operation(MemoryOperation(op="delete_user_profile_info", category="生日")) is None
+
+
+def test_all_operations_run_in_one_batch_with_clamped_values():
+    memory = FakeMemorySystem()
+    result = apply_memory_operations(memory, [
+        MemoryOperation(op="update_emotion", emotion=" happy ", intensity=5),
+        MemoryOperation(op="record_relationship_event", description="一起看了电影", impact=-3),
+        MemoryOperation(op="save_user_preference", category="食物", item="草莓"),
+        MemoryOperation(op="save_user_profile_info", category="生日", value="3月1日"),
+        MemoryOperation(op="delete_user_preference", category="音乐"),
+        MemoryOperation(op="delete_user_profile_info", category="职业"),
+    ])
+    assert memory.batches == 1
+    assert all(in_batch for _, _, in_batch in memory.calls)
+    assert [(name, args) for name, args, _ in memory.calls] == [
+        ("update_emotional_state", ("happy", 1.0, None)),
+        ("add_relationship_event", ("一起看了电影", 0.7, -1.0)),
+        ("add_user_preference", ("食物", "草莓", 1.0, 0.8)),
+        ("add_user_profile_info", ("生日", "3月1日", 0.9, "conversation")),
+        ("delete_user_preference", ("音乐",)),
+        ("delete_user_profile_info", ("职业",)),
+    ]
+    assert result.startswith("已执行6项：情感 happy；")
+    assert "删除偏好 音乐(不存在)" in result
+
+
+def test_invalid_operations_are_skipped_and_reported():
+    memory = FakeMemorySystem()
+    result = apply_memory_operations(memory, [
+        MemoryOperation(op="save_user_profile_info", category="生日"),
+        MemoryOperation(op="update_emotion", emotion="calm"),
+    ])
+    assert [name for name, _, _ in memory.calls] == ["update_emotional_state"]
+    assert result == "已执行1项：情感 calm，跳过1项（save_user_profile_info缺少value）"
+
+
+def test_nothing_valid_opens_no_batch():
+    memory = FakeMemorySystem()
+    assert apply_memory_operations(memory, [MemoryOperation(op="record_relationship_event")]) \
+        == "已执行0项，跳过1项（record_relationship_event缺少description）"
+    assert memory.batches == 0
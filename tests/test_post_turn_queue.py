@@ -0,0 +1,109 @@
+import asyncio
+import contextvars
+import json
+
+from emotional_companion.agents.post_turn_queue import PostTurnJob, PostTurnQueue
+
+marker = contextvars.ContextVar("marker", default=None)
+
+
+class RecordingHandler:
+    def __init__(self, name, delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.runs = []
+
+    async def run_post_turn_job(self, job):
+        self.runs.append((job.user_input, marker.get()))
+        await asyncio.sleep(self.delay)
+
+
+def make_job(text):
+    return PostTurnJob(user_input=text, response="ok", emotion_data={}, inner_thoughts="")
+
+
+def test_jobs_run_in_submit_context(tmp_path):
+    handler = RecordingHandler("default")
+
+    async def scenario():
+        queue = PostTurnQueue(handler, str(tmp_path / "spill.jsonl"), workers=1)
+        marker.set("turn-1")
+        await queue.submit(make_job("hi"))
+        await queue.drain()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert handler.runs == [("hi", "turn-1")]
+    assert queue.completed == 1 and queue.failed == 0
+
+
+def test_same_session_jobs_keep_order_with_multiple_workers(tmp_path):
+    order = []
+
+    class OrderedHandler(RecordingHandler):
+        async def run_post_turn_job(self, job):
+            # 先提交的任务耗时更长，并发执行时会被后提交的任务超过
+            await asyncio.sleep(0.05 if job.user_input == "1" else 0)
+            order.append(job.user_input)
+
+    handler = OrderedHandler("session")
+
+    async def scenario():
+        queue = PostTurnQueue(handler, str(tmp_path / "spill.jsonl"), workers=4)
+        for text in ("1", "2", "3"):
+            await queue.submit(make_job(text))
+        await queue.drain()
+
+    asyncio.run(scenario())
+    assert order == ["1", "2", "3"]
+
+
+def test_full_queue_spills_and_refills(tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    blocker = asyncio.Event()
+
+    class BlockingHandler(RecordingHandler):
+        async def run_post_turn_job(self, job):
+            await blocker.wait()
+            self.runs.append((job.user_input, None))
+
+    handler = BlockingHandler("default")
+
+    async def scenario():
+        queue = PostTurnQueue(handler, str(spill), workers=1, maxsize=1, enqueue_timeout=0.01)
+        for text in ("a", "b", "c"):
+            await queue.submit(make_job(text))
+            await asyncio.sleep(0)
+        assert queue.spilled == 1
+        assert json.loads(spill.read_text(encoding="utf-8").strip())["user_input"] == "c"
+        blocker.set()
+        # 队列空闲后重新载入暂存的任务
+        for _ in range(100):
+            if len(handler.runs) == 3:
+                break
+            await asyncio.sleep(0.01)
+        await queue.drain()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert [text for text, _ in handler.runs] == ["a", "b", "c"]
+    assert queue.replayed == 1
+    assert not spill.exists()
+
+
+def test_drain_spills_only_jobs_that_have_not_started(tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    handler = RecordingHandler("default", delay=10)
+
+    async def scenario():
+        queue = PostTurnQueue(handler, str(spill), workers=1, drain_timeout=0.05)
+        await queue.submit(make_job("running"))
+        await asyncio.sleep(0.01)
+        await queue.submit(make_job("queued"))
+        await queue.drain()
+        return queue
+
+    queue = asyncio.run(scenario())
+    spilled = [json.loads(line)["user_input"] for line in spill.read_text(encoding="utf-8").splitlines()]
+    assert spilled == ["queued"]
+    assert queue.interrupted == 1
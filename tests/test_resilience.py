@@ -0,0 +1,148 @@
+import asyncio
+import threading
+
+import pytest
+
+from emotional_companion.agents.resilience import (
+    ResilientChatCompletionClient,
+    StageDeadlineExceeded,
+    StagePolicy,
+    StageStats,
+    deadline_scope,
+)
+
+
+class FakeClient:
+    """按预设的延迟依次返回结果或抛出异常的模型客户端"""
+
+    def __init__(self, name, delays=(0.0,), error=None, chunks=("你", "好")):
+        self._raw_config = {"model": name}
+        self.name = name
+        self.delays = list(delays)
+        self.error = error
+        self.chunks = chunks
+        self.calls = 0
+        self.cancelled = 0
+        self.closed_streams = 0
+
+    def _next_delay(self):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        return delay
+
+    async def create(self, messages, **kwargs):
+        delay = self._next_delay()
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return f"{self.name}:{self.calls}"
+
+    async def create_stream(self, messages, **kwargs):
+        delay = self._next_delay()
+        call = self.calls
+        try:
+            await asyncio.sleep(delay)
+            if self.error is not None:
+                raise self.error
+            for chunk in self.chunks:
+                yield f"{self.name}{call}:{chunk}"
+        finally:
+            self.closed_streams += 1
+
+
+def make_client(stage, clients, timeout=1.0, hedge=False, first_token_timeout=None):
+    policy = StagePolicy(timeout=timeout, hedge=hedge, hedge_min_delay=0.01,
+                         first_token_timeout=first_token_timeout)
+    return ResilientChatCompletionClient(stage, clients, policy=policy)
+
+
+def test_hedged_request_wins_and_cancels_the_slow_one():
+    primary = FakeClient("a", delays=(1.0, 0.0))
+    client = make_client("test_hedge", [primary], timeout=0.2, hedge=True)
+
+    # 样本不足时在超时时间过半后发出对冲请求
+    assert asyncio.run(client.create([])) == "a:2"
+    assert primary.cancelled == 1
+    stats = client.stats.to_dict()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_error_fails_over_to_the_next_model():
+    broken = FakeClient("a", error=RuntimeError("boom"))
+    backup = FakeClient("b")
+    client = make_client("test_failover_error", [broken, backup])
+
+    assert asyncio.run(client.create([])) == "b:1"
+    stats = client.stats.to_dict()
+    assert stats["errors"] == 1 and stats["failovers"] == 1
+
+
+def test_timeout_fails_over_to_the_next_model():
+    slow = FakeClient("a", delays=(1.0,))
+    backup = FakeClient("b")
+    client = make_client("test_failover_timeout", [slow, backup], timeout=0.05)
+
+    assert asyncio.run(client.create([])) == "b:1"
+    assert slow.cancelled == 1
+    assert client.stats.to_dict()["timeouts"] == 1
+
+
+def test_all_models_failing_raises_stage_deadline():
+    client = make_client("test_all_fail", [FakeClient("a", error=RuntimeError("boom")),
+                                           FakeClient("b", delays=(1.0,))], timeout=0.05)
+    with pytest.raises(StageDeadlineExceeded):
+        asyncio.run(client.create([]))
+
+
+def test_turn_deadline_limits_each_attempt():
+    client = make_client("test_turn_deadline", [FakeClient("a", delays=(1.0,))], timeout=10)
+
+    async def scenario():
+        with deadline_scope(0.05):
+            await client.create([])
+
+    with pytest.raises(StageDeadlineExceeded):
+        asyncio.run(scenario())
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+def test_hedged_stream_wins_on_first_token_and_closes_the_loser():
+    primary = FakeClient("a", delays=(1.0, 0.0))
+    client = make_client("test_stream_hedge", [primary], timeout=10, hedge=True, first_token_timeout=0.2)
+
+    assert asyncio.run(collect(client.create_stream([]))) == ["a2:你", "a2:好"]
+    assert primary.closed_streams == 2
+    stats = client.stats.to_dict()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_stream_fails_over_before_the_first_token():
+    slow = FakeClient("a", delays=(1.0,))
+    backup = FakeClient("b")
+    client = make_client("test_stream_failover", [slow, backup], timeout=10, first_token_timeout=0.05)
+
+    assert asyncio.run(collect(client.create_stream([]))) == ["b1:你", "b1:好"]
+    stats = client.stats.to_dict()
+    assert stats["timeouts"] == 1 and stats["failovers"] == 1
+
+
+def test_stage_stats_counters_are_thread_safe():
+    stats = StageStats()
+
+    def work():
+        for _ in range(10000):
+            stats.increment("calls")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stats.to_dict()["calls"] == 80000
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from emotional_companion.memory.schema import SCHEMA_VERSION, needs_migration, to_epoch, upgrade_metadata
+
+
+def test_upgrade_metadata_adds_schema_fields_and_keeps_existing():
+    metadata = {"timestamp": "2024-06-01T08:00:00", "last_accessed": "2024-06-02T09:00:00", "type": "chat"}
+    upgraded = upgrade_metadata(metadata, "你好")
+    assert upgraded["type"] == "chat"
+    assert upgraded["schema_version"] == SCHEMA_VERSION
+    assert upgraded["timestamp_epoch"] == to_epoch("2024-06-01T08:00:00")
+    assert upgraded["last_accessed_epoch"] == to_epoch("2024-06-02T09:00:00")
+    assert len(upgraded["content_hash"]) == 16
+    assert not needs_migration(upgraded)
+    # 原始元数据不被修改
+    assert "schema_version" not in metadata
+
+
+def test_upgrade_metadata_reads_state_timestamp():
+    metadata = {"state_data": json.dumps({"last_updated": "2024-06-01T08:00:00"})}
+    assert upgrade_metadata(metadata, "")["timestamp_epoch"] == to_epoch("2024-06-01T08:00:00")
+
+
+def test_needs_migration():
+    assert needs_migration(None)
+    assert needs_migration({"timestamp": "2024-06-01T08:00:00"})
+    assert not needs_migration({"schema_version": SCHEMA_VERSION})
+
+
+class FakeCollection:
+    def __init__(self, records):
+        self.records = records
+        self.updates = []
+
+    def count(self):
+        return len(self.records)
+
+    def get(self, limit, offset, include):
+        page = self.records[offset:offset + limit]
+        return {
+            "ids": [record[0] for record in page],
+            "documents": [record[1] for record in page],
+            "metadatas": [record[2] for record in page],
+        }
+
+    def update(self, ids, metadatas):
+        self.updates.append(list(ids))
+        for memory_id, metadata in zip(ids, metadatas):
+            for i, record in enumerate(self.records):
+                if record[0] == memory_id:
+                    self.records[i] = (memory_id, record[1], metadata)
+
+
+class FakeClient:
+    def __init__(self, collections):
+        self.collections = collections
+
+    def get_collection(self, name):
+        return self.collections[name]
+
+
+def make_migrator(tmp_path, collection, batch_size=2):
+    schema_migration = pytest.importorskip("emotional_companion.memory.schema_migration")
+    migrator = schema_migration.MemorySchemaMigrator.__new__(schema_migration.MemorySchemaMigrator)
+    migrator.persist_directory = tmp_path
+    migrator.batch_size = batch_size
+    migrator.state_file = tmp_path / schema_migration.STATE_FILE_NAME
+    migrator.client = FakeClient({"episodic_memory": collection})
+    return migrator
+
+
+def test_migrator_pages_through_collection_and_saves_progress(tmp_path):
+    collection = FakeCollection([
+        ("a", "一", {"timestamp": "2024-06-01T08:00:00"}),
+        ("b", "二", {"schema_version": SCHEMA_VERSION}),
+        ("c", "三", {"timestamp": "2024-06-02T08:00:00"}),
+    ])
+    migrator = make_migrator(tmp_path, collection)
+
+    state = migrator.run(["episodic_memory"])
+    info = state["collections"]["episodic_memory"]
+    assert info == {"offset": 3, "scanned": 3, "updated": 2, "completed": True}
+    assert collection.updates == [["a"], ["c"]]
+    assert all(not needs_migration(metadata) for _, _, metadata in collection.records)
+
+    # 已完成的集合再次运行时跳过
+    migrator.run(["episodic_memory"])
+    assert collection.updates == [["a"], ["c"]]
+
+
+def test_migrator_resumes_from_saved_offset(tmp_path):
+    collection = FakeCollection([(memory_id, memory_id, {}) for memory_id in "abcd"])
+    migrator = make_migrator(tmp_path, collection)
+    migrator._save_state({"collections": {"episodic_memory": {
+        "offset": 2, "scanned": 2, "updated": 2, "completed": False}}})
+
+    state = migrator.run(["episodic_memory"])
+    assert collection.updates == [["c", "d"]]
+    assert state["collections"]["episodic_memory"]["updated"] == 4
+
+
+def test_migrator_dry_run_writes_nothing(tmp_path):
+    collection = FakeCollection([("a", "一", {})])
+    migrator = make_migrator(tmp_path, collection)
+    state = migrator.run(["episodic_memory"], dry_run=True)
+    assert state["collections"]["episodic_memory"]["updated"] == 1
+    assert collection.updates == []
+    assert not migrator.state_file.exists()
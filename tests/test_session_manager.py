@@ -0,0 +1,193 @@
+import asyncio
+import importlib.util
+import os
+
+# 直接按路径加载模块：导入web_api包会创建FastAPI应用并初始化整个系统
+_spec = importlib.util.spec_from_file_location(
+    "session_manager", os.path.join(os.path.dirname(__file__), "..", "web_api", "session_manager.py"))
+session_manager = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(session_manager)
+
+DEFAULT_SESSION_ID = session_manager.DEFAULT_SESSION_ID
+SessionManager = session_manager.SessionManager
+
+
+class FakeBaseHandler:
+    def __init__(self):
+        self.created = 0
+
+    def create_session_handler(self):
+        self.created += 1
+        return object()
+
+
+def make_manager(**kwargs):
+    kwargs.setdefault("cancel_superseded", False)
+    kwargs.setdefault("debounce_ms", 0)
+    return SessionManager(FakeBaseHandler(), **kwargs)
+
+
+def recording_turn(log, delay=0.0):
+    async def turn(session, message, token):
+        log.append(("start", session.session_id, message))
+        await asyncio.sleep(delay)
+        log.append(("end", session.session_id, message))
+        return message
+    return turn
+
+
+def test_sessions_get_their_own_handlers():
+    manager = make_manager()
+    first = manager.get_session("a")
+    assert manager.get_session("a") is first
+    assert manager.get_session("b").handler is not first.handler
+    assert manager.get_session(None).session_id == DEFAULT_SESSION_ID
+
+
+def test_turns_in_one_session_run_in_order_and_sessions_run_concurrently():
+    log = []
+    manager = make_manager()
+
+    async def scenario():
+        return await asyncio.gather(
+            manager.submit_turn("a", "a1", recording_turn(log, 0.05)),
+            manager.submit_turn("a", "a2", recording_turn(log, 0.0)),
+            manager.submit_turn("b", "b1", recording_turn(log, 0.0)),
+        )
+
+    assert asyncio.run(scenario()) == ["a1", "a2", "b1"]
+    session_a = [(event, message) for event, sid, message in log if sid == "a"]
+    assert session_a == [("start", "a1"), ("end", "a1"), ("start", "a2"), ("end", "a2")]
+    # 会话b不必等待会话a的长轮次
+    assert log.index(("end", "b", "b1")) < log.index(("end", "a", "a1"))
+
+
+def test_capacity_eviction_skips_busy_sessions():
+    manager = make_manager(max_sessions=2)
+
+    async def scenario():
+        busy = asyncio.create_task(manager.submit_turn("busy", "x", recording_turn([], 0.05)))
+        await asyncio.sleep(0.01)
+        manager.get_session("idle")
+        manager.get_session("new")
+        sessions = list(manager._sessions)
+        await busy
+        return sessions
+
+    assert asyncio.run(scenario()) == ["busy", "new"]
+    assert manager.evicted_count == 1
+
+
+def test_capacity_overflows_when_every_session_is_busy():
+    manager = make_manager(max_sessions=1)
+
+    async def scenario():
+        busy = asyncio.create_task(manager.submit_turn("busy", "x", recording_turn([], 0.05)))
+        await asyncio.sleep(0.01)
+        manager.get_session("other")
+        count = len(manager._sessions)
+        await busy
+        return count
+
+    assert asyncio.run(scenario()) == 2
+
+
+def cancellable_turn(log, delay):
+    """把耗时的工作关联到取消令牌，模拟代理调用"""
+    async def turn(session, message, token):
+        log.append(("start", message))
+        work = asyncio.ensure_future(asyncio.sleep(delay))
+        token.link_future(work)
+        await work
+        log.append(("end", message))
+        return message
+    return turn
+
+
+def test_newer_message_supersedes_running_turn_and_merges_its_message():
+    log = []
+    manager = make_manager(cancel_superseded=True)
+
+    async def scenario():
+        first = asyncio.create_task(manager.submit_turn("s", "1", cancellable_turn(log, 1)))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(manager.submit_turn("s", "2", cancellable_turn(log, 1)))
+        await asyncio.sleep(0.01)
+        third = asyncio.create_task(manager.submit_turn("s", "3", cancellable_turn(log, 0)))
+        return await asyncio.gather(first, second, third, return_exceptions=True)
+
+    first, second, third = asyncio.run(scenario())
+    assert isinstance(first, session_manager.TurnSuperseded) and first.message == "1"
+    # 第二轮执行时已合并了第一条消息，被取代时整体转入下一轮
+    assert isinstance(second, session_manager.TurnSuperseded) and second.message == "1\n2"
+    assert third == "1\n2\n3"
+    assert [message for event, message in log if event == "start"] == ["1", "1\n2", "1\n2\n3"]
+    session = manager.get_session("s")
+    assert session.superseded_turns == 2
+    assert session.turns == 1
+    assert session.carry_over == [] and session.active_tokens == {} and session.pending_turns == 0
+
+
+def test_queued_turn_superseded_before_it_starts():
+    log = []
+    manager = make_manager(cancel_superseded=True)
+
+    async def scenario():
+        first = asyncio.create_task(manager.submit_turn("s", "1", cancellable_turn(log, 1)))
+        await asyncio.sleep(0.01)
+        # 第二、三条消息同时到达：第二轮还在等待会话锁时就被第三条取代
+        second = asyncio.create_task(manager.submit_turn("s", "2", cancellable_turn(log, 1)))
+        third = asyncio.create_task(manager.submit_turn("s", "3", cancellable_turn(log, 0)))
+        return await asyncio.gather(first, second, third, return_exceptions=True)
+
+    first, second, third = asyncio.run(scenario())
+    assert isinstance(first, session_manager.TurnSuperseded)
+    assert isinstance(second, session_manager.TurnSuperseded) and second.message == "2"
+    assert third == "1\n2\n3"
+    assert [message for event, message in log if event == "start"] == ["1", "1\n2\n3"]
+
+
+def test_default_session_turns_are_never_superseded():
+    log = []
+    manager = make_manager(cancel_superseded=True, debounce_ms=20)
+
+    async def scenario():
+        return await asyncio.gather(
+            manager.submit_turn(None, "a", cancellable_turn(log, 0.02)),
+            manager.submit_turn(None, "b", cancellable_turn(log, 0)),
+        )
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+
+
+def test_debounce_merges_messages_within_the_window():
+    log = []
+    manager = make_manager(debounce_ms=50)
+
+    async def scenario():
+        first = asyncio.create_task(manager.submit_turn("s", "在吗", recording_turn(log)))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(manager.submit_turn("s", "想和你聊聊", recording_turn(log)))
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    first, second = asyncio.run(scenario())
+    assert isinstance(first, session_manager.TurnSuperseded)
+    assert second == "在吗\n想和你聊聊"
+    assert [event for event in log if event[0] == "start"] == [("start", "s", "在吗\n想和你聊聊")]
+
+
+def test_cancellation_without_a_newer_message_propagates():
+    manager = make_manager(cancel_superseded=True)
+
+    async def scenario():
+        task = asyncio.create_task(manager.submit_turn("s", "1", cancellable_turn([], 1)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return "cancelled"
+
+    assert asyncio.run(scenario()) == "cancelled"
+    session = manager.get_session("s")
+    assert session.carry_over == [] and session.pending_turns == 0
@@ -0,0 +1,122 @@
+from emotional_companion.agents.state_updates import (
+    MONOLOGUE_TAG,
+    REPLY_TAG,
+    STATE_UPDATE_TAG,
+    SectionStreamFilter,
+    closed_monologue,
+    parse_state_update,
+    split_fused_output,
+    state_update_operations,
+    strip_state_update,
+)
+
+
+def thoughts(update_section: str) -> str:
+    return f"{MONOLOGUE_TAG}\n用户今天很开心，我也想多陪用户聊聊。\n{STATE_UPDATE_TAG}\n{update_section}"
+
+
+def test_parse_full_update_and_normalize_values():
+    update = parse_state_update(thoughts(
+        '{"emotion": "Happy", "intensity": 3, "valence": -2,'
+        ' "relationship_events": [{"description": "一起聊了电影", "importance": 0.9}],'
+        ' "preferences": [{"category": "食物", "item": "草莓"}],'
+        ' "profile": [{"category": "生日", "value": "3月1日"}]}'
+    ))
+    assert update["emotion"] == "happy"
+    assert update["intensity"] == 1.0
+    assert update["valence"] == -1.0
+    assert update["relationship_events"] == [{"description": "一起聊了电影", "importance": 0.9, "impact": 0.1}]
+    assert update["preferences"] == [{"category": "食物", "item": "草莓", "sentiment": 1.0, "certainty": 0.8}]
+    assert update["profile"] == [{"category": "生日", "value": "3月1日", "confidence": 0.9}]
+
+
+def test_empty_object_means_nothing_to_update():
+    update = parse_state_update(thoughts("{}"))
+    assert update is not None
+    assert update["emotion"] is None
+    assert state_update_operations(update) == []
+
+
+def test_missing_section_returns_none():
+    assert parse_state_update(f"{MONOLOGUE_TAG}\n只有独白") is None
+    assert parse_state_update("") is None
+
+
+def test_malformed_json_returns_none():
+    assert parse_state_update(thoughts('{"emotion": "happy", "intensity": ')) is None
+    assert parse_state_update(thoughts("情绪变得开心了")) is None
+
+
+def test_code_fence_single_quotes_and_incomplete_items():
+    update = parse_state_update(thoughts(
+        "```json\n{'preferences': [{'category': '食物', 'item': ''},"
+        " {'category': '音乐', 'item': '爵士', 'certainty': 'high'}]}\n```"
+    ))
+    assert update["emotion"] is None
+    # 缺少必需字段的项被丢弃，无法解析的数值取默认值
+    assert update["preferences"] == [{"category": "音乐", "item": "爵士", "sentiment": 1.0, "certainty": 0.8}]
+
+
+def test_null_emotion_string_is_ignored():
+    assert parse_state_update(thoughts('{"emotion": "null", "intensity": 0.5}'))["intensity"] is None
+
+
+def test_strip_state_update_keeps_only_monologue():
+    text = thoughts('{"emotion": "happy"}')
+    stripped = strip_state_update(text)
+    assert STATE_UPDATE_TAG not in stripped
+    assert stripped.startswith(MONOLOGUE_TAG)
+    assert "happy" not in stripped
+    assert strip_state_update(f"{MONOLOGUE_TAG}\n只有独白") == f"{MONOLOGUE_TAG}\n只有独白"
+
+
+def test_state_update_operations_order():
+    update = parse_state_update(thoughts(
+        '{"emotion": "sad", "preferences": [{"category": "食物", "item": "草莓"}],'
+        ' "profile": [{"category": "职业", "value": "老师"}]}'
+    ))
+    assert [operation.op for operation in state_update_operations(update)] == [
+        "update_emotion", "save_user_preference", "save_user_profile_info"]
+
+
+def test_closed_monologue_waits_for_the_next_tag_across_chunks():
+    chunks = [MONOLOGUE_TAG[:3], MONOLOGUE_TAG[3:] + "\n用户", "今天很开心", "\n【", "状态更新】\n{}"]
+    partial = ""
+    results = []
+    for chunk in chunks:
+        partial += chunk
+        results.append(closed_monologue(partial))
+    assert results[:3] == [None, None, None]
+    assert results[3].strip() == "用户今天很开心"
+    assert results[4] == results[3]
+
+
+def test_closed_monologue_ignores_empty_monologue():
+    assert closed_monologue(f"{MONOLOGUE_TAG}\n\n{STATE_UPDATE_TAG}") is None
+    assert closed_monologue("没有标签的输出") is None
+
+
+def test_split_fused_output():
+    text = f"{MONOLOGUE_TAG}\n有点想念\n{REPLY_TAG}\n你好呀～\n{STATE_UPDATE_TAG}\n{{}}"
+    assert split_fused_output(text) == ("有点想念", "你好呀～", "{}")
+
+
+def test_split_fused_output_without_reply_tag_uses_whole_output():
+    text = f"{MONOLOGUE_TAG}你好呀\n{STATE_UPDATE_TAG}\n{{\"emotion\": \"happy\"}}"
+    assert split_fused_output(text) == ("", "你好呀", "")
+
+
+def test_stream_filter_forwards_only_the_reply_with_split_tags():
+    reply_filter = SectionStreamFilter(REPLY_TAG)
+    chunks = [MONOLOGUE_TAG + "想", "一想\n【回", "复】\n你", "好 ", "呀\n", "【状", "态更新】{}", "之后的内容"]
+    forwarded = [reply_filter.feed(chunk) for chunk in chunks]
+    assert "".join(forwarded) == "你好 呀"
+    # 标签之前的空白不会先被转发出去
+    assert forwarded[3] == "好"
+    assert reply_filter.closed
+
+
+def test_stream_filter_without_tag_forwards_nothing():
+    reply_filter = SectionStreamFilter(REPLY_TAG)
+    assert reply_filter.feed("没有任何标签的输出") == ""
+    assert not reply_filter.closed
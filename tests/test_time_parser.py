@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+from emotional_companion.utils.time_parser import parse_recall_range, parse_time_expression
+
+# 2024-06-12 是星期三
+NOW = datetime(2024, 6, 12, 15, 30)
+
+
+def test_yesterday_evening_narrows_to_day_part():
+    time_range = parse_time_expression("昨天晚上我们聊了什么", now=NOW)
+    assert time_range.start == datetime(2024, 6, 11, 18)
+    assert time_range.end == datetime(2024, 6, 12)
+
+
+def test_english_days_ago():
+    time_range = parse_time_expression("what did we talk about two days ago", now=NOW)
+    assert time_range.start == datetime(2024, 6, 10)
+    assert time_range.end == datetime(2024, 6, 11)
+
+
+def test_absolute_date():
+    time_range = parse_time_expression("2024年5月1日", now=NOW)
+    assert time_range.start == datetime(2024, 5, 1)
+    assert time_range.end == datetime(2024, 5, 2)
+
+
+def test_no_time_expression():
+    assert parse_time_expression("你好呀", now=NOW) is None
+
+
+def test_recall_range_ignores_future_ranges():
+    assert parse_recall_range("明天我们去看电影吧", now=NOW) is None
+
+
+def test_recall_range_requires_cue_for_ranges_touching_today():
+    assert parse_recall_range("今天天气真好", now=NOW) is None
+    time_range = parse_recall_range("今天我们聊过什么", now=NOW)
+    assert time_range.start == datetime(2024, 6, 12)
+    assert time_range.end == NOW
+
+
+def test_recall_range_without_cue_requirement_clips_to_now():
+    time_range = parse_recall_range("最近", now=NOW, require_recall_cue=False)
+    assert time_range is not None
+    assert time_range.end == NOW
+
+
+def test_recall_range_past_days_need_no_cue():
+    time_range = parse_recall_range("昨天好累", now=NOW)
+    assert time_range.start == datetime(2024, 6, 11)
+    assert time_range.end == datetime(2024, 6, 12)
+
+
+# 2026-10-19 是星期一
+MONDAY = datetime(2026, 10, 19, 10, 0)
+
+
+def test_bare_weekday_with_future_intent_is_not_a_recall_range():
+    assert parse_recall_range("我周三要考试", now=MONDAY) is None
+    assert parse_recall_range("周日打算去爬山", now=MONDAY) is None
+    assert parse_recall_range("周末打算干嘛", now=MONDAY) is None
+    assert parse_recall_range("I'm going to the gym on Friday", now=MONDAY) is None
+
+
+def test_bare_weekday_requires_recall_cue():
+    assert parse_recall_range("周三好忙", now=MONDAY) is None
+    time_range = parse_recall_range("周三我们聊了什么", now=MONDAY)
+    assert time_range.start == datetime(2026, 10, 14)
+    time_range = parse_recall_range("what did we talk about on Friday", now=MONDAY)
+    assert time_range.expression == "Friday"
+    assert time_range.start == datetime(2026, 10, 16)
+
+
+def test_last_week_weekday_needs_no_cue():
+    time_range = parse_recall_range("上周三好忙", now=MONDAY)
+    assert time_range.start == datetime(2026, 10, 14)
+    assert time_range.end == datetime(2026, 10, 15)
+
+
+def test_explicit_weekday_expression_keeps_past_reading():
+    time_range = parse_recall_range("周三", now=MONDAY, require_recall_cue=False)
+    assert time_range.start == datetime(2026, 10, 14)
+
+
+def test_this_week_phrases_are_not_weekdays():
+    assert parse_time_expression("这周天气不错", now=MONDAY).expression == "这周"
+    assert parse_time_expression("这周一直在加班", now=MONDAY).expression == "这周"
+    assert parse_time_expression("这周一我们聊了什么", now=MONDAY).expression == "这周一"
+
+
+def test_past_few_days():
+    time_range = parse_time_expression("the past few days", now=MONDAY)
+    assert time_range.start == datetime(2026, 10, 16, 10, 0)
+    assert time_range.end == MONDAY
+    assert parse_recall_range("what did I tell you the past few days", now=MONDAY) is not None
+
+
+def test_months_ago_centers_on_the_same_day():
+    time_range = parse_time_expression("一个月前我们聊过什么", now=MONDAY)
+    assert time_range.start == datetime(2026, 9, 4)
+    assert time_range.end == datetime(2026, 10, 5)
+    # 目标月份没有这一天时取该月最后一天
+    time_range = parse_time_expression("a month ago", now=datetime(2026, 3, 31, 12, 0))
+    assert time_range.start == datetime(2026, 2, 28) - timedelta(days=15)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from emotional_companion.analysis.triage import (
+    ROUTE_FULL,
+    ROUTE_LIGHT,
+    SUBSTANTIVE_SEEDS,
+    TRIVIAL_SEEDS,
+    TriageRouter,
+)
+
+
+@pytest.mark.parametrize("text", ["嗯", "嗯嗯～", "好的！", "晚安!", "在吗？", "ok", "Good night."])
+def test_trivial_phrases_go_light(text):
+    assert TriageRouter().route(text) == (ROUTE_LIGHT, "phrase")
+
+
+@pytest.mark.parametrize("text", ["😊", "😊😊👍", "～～", "哈哈哈"])
+def test_emoji_and_laughter_go_light(text):
+    assert TriageRouter().route(text)[0] == ROUTE_LIGHT
+
+
+@pytest.mark.parametrize("text", ["好累", "好难过", "有点害怕", "你好吗?", "so tired"])
+def test_short_messages_needing_attention_stay_full(text):
+    assert TriageRouter().route(text) == (ROUTE_FULL, "attention")
+
+
+def test_english_cues_match_whole_words_only():
+    assert TriageRouter().route("download it") == (ROUTE_FULL, "default")
+
+
+def test_long_messages_stay_full():
+    assert TriageRouter(max_chars=12).route("我今天被老板骂了所以很不开心呢真的") == (ROUTE_FULL, "length")
+
+
+def test_without_embeddings_unknown_messages_stay_full():
+    assert TriageRouter().route("今天下雨") == (ROUTE_FULL, "default")
+
+
+def fake_embedding(light_texts):
+    """简单种子和light_texts映射到同一方向，其余文本映射到另一方向"""
+    def embed(texts):
+        trivial = set(TRIVIAL_SEEDS) | set(light_texts)
+        return [[1.0, 0.0] if text in trivial else [0.0, 1.0] for text in texts]
+    return embed
+
+
+def test_embedding_vote_routes_unknown_short_messages():
+    router = TriageRouter(embedding_function=fake_embedding({"好嘞好嘞"}))
+    assert router.route("好嘞好嘞") == (ROUTE_LIGHT, "embedding")
+    assert router.route(SUBSTANTIVE_SEEDS[0][:6]) == (ROUTE_FULL, "embedding")
+
+
+def test_embedding_failure_falls_back_to_full():
+    def broken(texts):
+        raise RuntimeError("model not loaded")
+
+    assert TriageRouter(embedding_function=broken).route("今天下雨") == (ROUTE_FULL, "default")
+
+
+def test_stats_share_and_reasons():
+    router = TriageRouter()
+    router.record(ROUTE_LIGHT, "phrase", 0.1)
+    router.record(ROUTE_FULL, "attention", 0.5)
+    router.record(ROUTE_FULL, "length", 0.7)
+    stats = router.get_stats()
+    assert stats[ROUTE_LIGHT]["share"] == round(1 / 3, 3)
+    assert stats[ROUTE_FULL]["reasons"] == {"attention": 1, "length": 1}
+    assert np.isclose(stats[ROUTE_FULL]["avg_ms"], 600.0)
@@ -0,0 +1,97 @@
+import contextvars
+
+import pytest
+
+from emotional_companion.memory.unit_of_work import MemoryUnitOfWork, coalesce_operations
+
+
+def add(collection, record_id, category="c", document="doc"):
+    return (collection, "add", {"ids": [record_id], "metadatas": [{"category": category}], "documents": [document]})
+
+
+def test_coalesce_merges_adds_per_collection():
+    operations = coalesce_operations([add("episodic", "a"), add("relationship", "r"), add("episodic", "b")])
+    assert [(collection, method, args["ids"]) for collection, method, args in operations] == [
+        ("episodic", "add", ["a", "b"]),
+        ("relationship", "add", ["r"]),
+    ]
+
+
+def test_coalesce_keeps_delete_between_adds():
+    delete = ("episodic", "delete", {"ids": ["a"]})
+    operations = coalesce_operations([add("episodic", "a"), delete, add("episodic", "a")])
+    assert [method for _, method, _ in operations] == ["add", "delete", "add"]
+
+
+def test_coalesce_folds_update_of_pending_add():
+    update = ("preferences", "update", {"ids": ["p"], "metadatas": [{"category": "c", "item": "new"}],
+                                        "documents": ["new"]})
+    operations = coalesce_operations([add("preferences", "p"), update])
+    assert operations == [("preferences", "add", {"ids": ["p"], "metadatas": [{"category": "c", "item": "new"}],
+                                                  "documents": ["new"]})]
+
+
+def test_pending_record_id_finds_latest_write_for_category():
+    unit = MemoryUnitOfWork()
+    unit.add([add("preferences", "p1", "food"), add("preferences", "p2", "music"), add("user_profile", "u1", "food")])
+    assert unit.pending_record_id("preferences", "food") == "p1"
+    assert unit.pending_record_id("preferences", "sport") is None
+
+
+def test_rollback_returns_only_changes_after_savepoint():
+    unit = MemoryUnitOfWork()
+    unit.record_state_change("current_emotion", "neutral", "happy")
+    savepoint = unit.savepoint()
+    unit.add([add("episodic", "a")])
+    unit.record_state_change("current_emotion", "happy", "sad")
+    assert unit.rollback_to(savepoint) == [("current_emotion", "happy", "sad")]
+    assert unit.operations == []
+
+
+class FakeCollection:
+    """只有已提交的写入才能被查询到的集合"""
+
+    def __init__(self):
+        self.records = {}
+        self.calls = []
+
+    def query(self, where=None, **kwargs):
+        ids = [record_id for record_id, metadata in self.records.items()
+               if metadata.get("category") == where["category"]]
+        return {"ids": [ids]}
+
+    def add(self, ids, metadatas, documents):
+        self.calls.append(("add", list(ids)))
+        self.records.update(zip(ids, metadatas))
+
+    def update(self, ids, metadatas=None, documents=None):
+        self.calls.append(("update", list(ids)))
+        self.records.update(zip(ids, metadatas))
+
+
+def make_memory():
+    pytest.importorskip("chromadb")
+    from emotional_companion.memory.emotional_memory import EmotionalMemorySystem
+
+    memory = EmotionalMemorySystem.__new__(EmotionalMemorySystem)
+    memory.collections = {"preferences": FakeCollection(), "user_profile": FakeCollection()}
+    memory._current_unit = contextvars.ContextVar("memory_unit_test", default=None)
+    memory._write_stats = {"units": 0, "mutations": 0, "writes": 0, "state_saves_collapsed": 0}
+    memory.journal = None
+    return memory
+
+
+def test_same_category_writes_in_one_unit_do_not_duplicate():
+    memory = make_memory()
+    with memory.unit_of_work():
+        memory.add_user_preference("食物", "火锅")
+        memory.add_user_preference("食物", "烧烤")
+        memory.add_user_profile_info("生日", "3月1日")
+        memory.add_user_profile_info("生日", "3月2日")
+
+    preferences = memory.collections["preferences"]
+    assert len(preferences.calls) == 1 and preferences.calls[0][0] == "add"
+    assert [metadata["item"] for metadata in preferences.records.values()] == ["烧烤"]
+    profile = memory.collections["user_profile"]
+    assert len(profile.calls) == 1
+    assert [metadata["value"] for metadata in profile.records.values()] == ["3月2日"]
@@ -0,0 +1,124 @@
+import asyncio
+import importlib.util
+import json
+import os
+
+# 直接按路径加载模块：导入web_api包会创建FastAPI应用并初始化整个系统
+_spec = importlib.util.spec_from_file_location(
+    "websocket_handler", os.path.join(os.path.dirname(__file__), "..", "web_api", "websocket_handler.py"))
+websocket_handler = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(websocket_handler)
+
+SimpleWebSocketManager = websocket_handler.SimpleWebSocketManager
+
+
+class FakeWebSocket:
+    """send_text在release之前一直阻塞，模拟接收缓慢的客户端"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+        self.release = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        await self.release.wait()
+        self.sent.append(json.loads(text)["type"])
+
+    async def close(self, code=1000, reason=""):
+        self.closed = (code, reason)
+
+
+async def connect_stalled(manager):
+    websocket = FakeWebSocket()
+    assert await manager.connect(websocket)
+    # 第一帧被写协程取出后阻塞在send_text，之后的帧留在队列中
+    await manager.send_message(websocket, {"type": "chat_response"})
+    await asyncio.sleep(0)
+    return websocket
+
+
+def test_drop_policy_drops_only_droppable_frames():
+    async def scenario():
+        manager = SimpleWebSocketManager(max_connections=5, max_queue=2, send_timeout=1,
+                                         slow_consumer_policy="drop")
+        websocket = await connect_stalled(manager)
+        results = [
+            await manager.send_message(websocket, {"type": "chat_delta"}),
+            await manager.send_message(websocket, {"type": "chat_response"}),
+            # 队列已满：流式片段和心跳直接丢弃
+            await manager.send_message(websocket, {"type": "chat_delta"}),
+            await manager.send_message(websocket, {"type": "pong"}),
+            # 主动消息挤掉队列中的流式片段
+            await manager.send_message(websocket, {"type": "proactive_chat"}),
+        ]
+        connection = manager.active_connections[websocket]
+        dropped = connection.dropped
+        websocket.release.set()
+        await asyncio.sleep(0.01)
+        return websocket, results, dropped, manager
+
+    websocket, results, dropped, manager = asyncio.run(scenario())
+    assert results == [True, True, False, False, True]
+    assert dropped == 3
+    assert websocket.sent == ["chat_response", "chat_response", "proactive_chat"]
+    assert websocket.closed is None
+    assert websocket in manager.active_connections
+
+
+def test_drop_policy_disconnects_when_a_critical_frame_does_not_fit():
+    async def scenario():
+        manager = SimpleWebSocketManager(max_connections=5, max_queue=2, send_timeout=1,
+                                         slow_consumer_policy="drop")
+        websocket = await connect_stalled(manager)
+        await manager.send_message(websocket, {"type": "chat_response"})
+        await manager.send_message(websocket, {"type": "proactive_chat"})
+        accepted = await manager.send_message(websocket, {"type": "chat_response"})
+        # 正在进行的发送完成（或超时）后，写协程关闭连接
+        websocket.release.set()
+        await asyncio.sleep(0.01)
+        return websocket, accepted, manager
+
+    websocket, accepted, manager = asyncio.run(scenario())
+    assert accepted is False
+    assert websocket.closed == (1008, "Slow consumer")
+    assert websocket not in manager.active_connections
+    assert manager.slow_disconnects == 1
+
+
+def test_disconnect_policy_closes_on_any_overflow():
+    async def scenario():
+        manager = SimpleWebSocketManager(max_connections=5, max_queue=1, send_timeout=1,
+                                         slow_consumer_policy="disconnect")
+        websocket = await connect_stalled(manager)
+        await manager.send_message(websocket, {"type": "chat_delta"})
+        accepted = await manager.send_message(websocket, {"type": "chat_delta"})
+        websocket.release.set()
+        await asyncio.sleep(0.01)
+        return websocket, accepted, manager
+
+    websocket, accepted, manager = asyncio.run(scenario())
+    assert accepted is False
+    assert websocket.closed == (1008, "Slow consumer")
+    assert websocket not in manager.active_connections
+
+
+def test_send_failure_closes_the_socket():
+    class FailingWebSocket(FakeWebSocket):
+        async def send_text(self, text):
+            raise RuntimeError("broken pipe")
+
+    async def scenario():
+        manager = SimpleWebSocketManager(max_connections=5, max_queue=4, send_timeout=1)
+        websocket = FailingWebSocket()
+        await manager.connect(websocket)
+        await manager.broadcast({"type": "proactive_chat"})
+        await asyncio.sleep(0.01)
+        return websocket, manager
+
+    websocket, manager = asyncio.run(scenario())
+    assert websocket.closed == (1011, "Send failed")
+    assert websocket not in manager.active_connections
+    assert manager.send_failures == 1
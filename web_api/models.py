@@ -2,7 +2,7 @@
 Web API 数据模型定义
 """
 
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Literal
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -11,6 +11,8 @@ class ChatRequest(BaseModel):
     """聊天请求模型"""
     message: str
     enable_timing: bool = True
+    session_id: Optional[str] = None  # 会话ID，不传时使用默认会话
+    pipeline_mode: Optional[Literal["staged", "fused"]] = None  # 对话流程模式，不传时使用PIPELINE_MODE配置
 
 
 class ChatResponse(BaseModel):
@@ -20,6 +22,10 @@ class ChatResponse(BaseModel):
     emotional_state: Optional[Dict[str, Any]] = None
     processing_time: Optional[float] = None
     commands: Optional[List[Dict[str, Any]]] = None  # 新增：视觉效果指令列表
+    trace_id: Optional[str] = None  # 本轮对话的追踪ID，可通过/api/traces/{trace_id}查看耗时分解
+    session_id: Optional[str] = None  # 本轮对话所属的会话ID
+    pipeline_mode: Optional[str] = None  # 本轮实际使用的对话流程模式
+    profile: Optional[str] = None  # 本轮实际使用的流程档位（分流与负载控制合并后的结果）
 
 
 class EmotionalState(BaseModel):
@@ -37,6 +43,7 @@ class ChatHistoryItem(BaseModel):
     ai_response: str
     timestamp: datetime
     emotional_state: Optional[Dict[str, Any]] = None
+    session_id: Optional[str] = None
 
 
 class ChatHistory(BaseModel):
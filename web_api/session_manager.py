@@ -0,0 +1,247 @@
+"""
+会话管理模块
+为每个会话分配独立的对话处理器（代理上下文、指令队列、对话状态），
+会话之间并发执行，同一会话内的对话轮次按到达顺序依次处理；
+同一会话收到新消息时，可取消仍在进行中的旧轮次，并把未得到回复的消息合并进新轮次
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+import logging
+
+from autogen_core import CancellationToken
+
+from emotional_companion.utils.env_utils import get_env_bool, get_env_int
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_ID = "default"
+
+T = TypeVar("T")
+
+
+class TurnSuperseded(Exception):
+    """对话轮次被同一会话中更新的消息取代"""
+
+    def __init__(self, session_id: str, message: str):
+        super().__init__(f"会话 {session_id} 的轮次已被新消息取代")
+        self.session_id = session_id
+        self.message = message
+
+
+class ConversationSession:
+    """单个会话的状态"""
+
+    def __init__(self, session_id: str, handler):
+        self.session_id = session_id
+        self.handler = handler
+        # asyncio.Lock按等待顺序唤醒，保证同一会话内的轮次按到达顺序执行
+        self.lock = asyncio.Lock()
+        self.created_at = time.time()
+        self.last_active = time.time()
+        self.turns = 0
+        self.pending_turns = 0
+        self.superseded_turns = 0
+        # 最新提交的轮次序号，以及各未完成轮次的取消令牌
+        self.turn_seq = 0
+        self.active_tokens: Dict[int, CancellationToken] = {}
+        # 被取代、尚未得到回复的消息，会合并进下一次实际执行的轮次
+        self.carry_over: List[str] = []
+
+    @property
+    def is_busy(self) -> bool:
+        return self.pending_turns > 0
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "last_active": self.last_active,
+            "idle_seconds": round(time.time() - self.last_active, 1),
+            "turns": self.turns,
+            "pending_turns": self.pending_turns,
+            "superseded_turns": self.superseded_turns,
+        }
+
+
+class SessionManager:
+    """会话池：按LRU保留有限数量的会话，并定期回收空闲会话"""
+
+    def __init__(self, base_handler, max_sessions: Optional[int] = None,
+                 idle_timeout: Optional[int] = None, cleanup_interval: int = 60,
+                 cancel_superseded: Optional[bool] = None, debounce_ms: Optional[int] = None):
+        """
+        Args:
+            base_handler: 基础对话处理器，新会话通过其create_session_handler创建
+            max_sessions: 最多保留的会话数，为None时读取SESSION_POOL_SIZE
+            idle_timeout: 会话空闲多少秒后被回收，为None时读取SESSION_IDLE_TIMEOUT
+            cleanup_interval: 空闲回收检查间隔（秒）
+            cancel_superseded: 新消息到达时是否取消同一会话中进行中的轮次，为None时读取TURN_CANCEL_SUPERSEDED
+            debounce_ms: 消息防抖窗口（毫秒），窗口内连续到达的消息合并为一轮，为None时读取TURN_DEBOUNCE_MS
+                         取消和防抖只作用于客户端明确指定了会话ID的消息，默认会话由互不相关的调用方共用
+        """
+        self.base_handler = base_handler
+        self.max_sessions = max_sessions or get_env_int("SESSION_POOL_SIZE", 32)
+        self.idle_timeout = idle_timeout or get_env_int("SESSION_IDLE_TIMEOUT", 1800)
+        self.cleanup_interval = cleanup_interval
+        self.cancel_superseded = (get_env_bool("TURN_CANCEL_SUPERSEDED", False)
+                                  if cancel_superseded is None else cancel_superseded)
+        self.debounce = (get_env_int("TURN_DEBOUNCE_MS", 0) if debounce_ms is None else debounce_ms) / 1000
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._cleanup_task: Optional[asyncio.Task] = None
+        self.evicted_count = 0
+
+    def get_session(self, session_id: Optional[str] = None) -> ConversationSession:
+        """获取会话，不存在时创建；未指定会话ID时使用默认会话"""
+        session_id = session_id or DEFAULT_SESSION_ID
+        session = self._sessions.get(session_id)
+        if session is None:
+            self._evict_for_capacity()
+            session = ConversationSession(session_id, self.base_handler.create_session_handler())
+            self._sessions[session_id] = session
+            logger.info(f"创建会话 {session_id}，当前会话数: {len(self._sessions)}")
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _evict_for_capacity(self):
+        """会话数达到上限时，回收最久未使用且没有进行中轮次的会话"""
+        while len(self._sessions) >= self.max_sessions:
+            victim = next((sid for sid, s in self._sessions.items() if not s.is_busy), None)
+            if victim is None:
+                # 所有会话都在处理中，暂时超出上限，待空闲后再回收
+                logger.warning(f"会话池已满且全部繁忙，暂时超出上限 ({self.max_sessions})")
+                return
+            self._remove(victim, "容量")
+
+    def evict_idle(self) -> int:
+        """回收空闲超时的会话，返回回收数量"""
+        now = time.time()
+        expired = [
+            sid for sid, session in self._sessions.items()
+            if not session.is_busy and now - session.last_active > self.idle_timeout
+        ]
+        for session_id in expired:
+            self._remove(session_id, "空闲超时")
+        return len(expired)
+
+    def _remove(self, session_id: str, reason: str):
+        self._sessions.pop(session_id, None)
+        self.evicted_count += 1
+        logger.info(f"回收会话 {session_id}（{reason}），当前会话数: {len(self._sessions)}")
+
+    async def submit_turn(self, session_id: Optional[str], message: str,
+                          turn: Callable[[ConversationSession, str, CancellationToken], Awaitable[T]]) -> T:
+        """
+        提交一条用户消息并在会话内执行对应的轮次
+
+        启用取消时，新消息会通过取消令牌中止同一会话中仍在进行（或排队）的旧轮次，
+        旧轮次抛出TurnSuperseded，其消息与新消息合并后由新轮次统一回复。
+        启用防抖时，先等待防抖窗口，窗口内又有新消息到达则直接合并进新消息。
+        未指定会话ID的消息使用默认会话，只排队执行，不会取代其他调用方的轮次
+
+        Args:
+            session_id: 会话ID，为None时使用默认会话
+            message: 用户消息
+            turn: 接收(会话, 合并后的消息, 取消令牌)并返回协程的函数
+
+        Raises:
+            TurnSuperseded: 本轮被更新的消息取代
+        """
+        session = self.get_session(session_id)
+        session.turn_seq += 1
+        seq = session.turn_seq
+        token = CancellationToken()
+        # 默认会话可能由多个互不相关的客户端共用，不能互相取代
+        explicit = session_id is not None
+
+        if self.cancel_superseded and explicit:
+            for other_token in session.active_tokens.values():
+                other_token.cancel()
+        session.active_tokens[seq] = token
+        session.pending_turns += 1
+
+        def supersede(text: str) -> TurnSuperseded:
+            session.carry_over.append(text)
+            session.superseded_turns += 1
+            return TurnSuperseded(session.session_id, text)
+
+        try:
+            if self.debounce > 0 and explicit:
+                await asyncio.sleep(self.debounce)
+                if session.turn_seq != seq:
+                    raise supersede(message)
+
+            async with session.lock:
+                if token.is_cancelled():
+                    raise supersede(message)
+
+                # 合并此前被取代的消息
+                merged = "\n".join(session.carry_over + [message])
+                session.carry_over.clear()
+                session.last_active = time.time()
+                try:
+                    result = await turn(session, merged, token)
+                except asyncio.CancelledError:
+                    # 令牌被取消说明是被新消息取代，其他情况（如服务关闭）照常向上抛出
+                    if not token.is_cancelled():
+                        raise
+                    raise supersede(merged)
+                session.turns += 1
+                return result
+        finally:
+            session.active_tokens.pop(seq, None)
+            session.pending_turns -= 1
+            session.last_active = time.time()
+
+    def queued_turns(self) -> int:
+        """正在等待执行（防抖中或等待会话锁）的轮次数，每个会话中正在执行的轮次不计入"""
+        return sum(
+            max(0, session.pending_turns - (1 if session.lock.locked() else 0))
+            for session in list(self._sessions.values())
+        )
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"回收空闲会话失败: {e}")
+
+    def start(self):
+        """启动空闲会话回收任务"""
+        if self._cleanup_task is None or self._cleanup_task.done():
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    async def stop(self):
+        """停止空闲会话回收任务"""
+        if self._cleanup_task:
+            self._cleanup_task.cancel()
+            try:
+                await self._cleanup_task
+            except asyncio.CancelledError:
+                pass
+            self._cleanup_task = None
+
+    async def get_context_stats(self) -> Dict[str, dict]:
+        """获取每个会话各代理模型上下文的大小"""
+        return {
+            session_id: await session.handler.agent_system.get_agent_context_stats()
+            for session_id, session in list(self._sessions.items())
+        }
+
+    def get_stats(self) -> Dict[str, object]:
+        """获取会话池状态"""
+        return {
+            "active_sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "idle_timeout": self.idle_timeout,
+            "evicted_sessions": self.evicted_count,
+            "cancel_superseded": self.cancel_superseded,
+            "debounce_ms": int(self.debounce * 1000),
+            "busy_sessions": sum(1 for session in self._sessions.values() if session.is_busy),
+            "queued_turns": self.queued_turns(),
+            "sessions": [session.to_dict() for session in reversed(self._sessions.values())],
+        }
@@ -19,6 +19,7 @@ def early_disable_telemetry():
 # 立即执行环境变量设置
 early_disable_telemetry()
 
+import asyncio
 import time
 import uuid
 from datetime import datetime, timedelta
@@ -45,8 +46,13 @@ from fastapi.encoders import jsonable_encoder
 import logging
 
 from emotional_companion.agents.conversation_handler import ConversationHandler
+from emotional_companion.utils.tracing import tracer
+from emotional_companion.utils.prompt_budget import prompt_metrics
+from emotional_companion.agents.resilience import get_resilience_stats
+from emotional_companion.agents.llm_scheduler import llm_scheduler
 from web_api.config_manager import ConfigManager
 from web_api.websocket_handler import ws_manager, proactive_service, start_proactive_service
+from web_api.session_manager import SessionManager, TurnSuperseded
 from web_api.models import (
     ChatRequest, ChatResponse, EmotionalState, 
     ChatHistory, ChatHistoryItem, HealthStatus, ErrorResponse,
@@ -70,6 +76,7 @@ class WebAPIServer:
             print(f"⚠️ 禁用遥测时出现问题: {e}")
         
         self.conversation_handler: Optional[ConversationHandler] = None
+        self.session_manager: Optional[SessionManager] = None
         self.start_time = time.time()
         self.chat_history: List[ChatHistoryItem] = []
         self.max_history_size = 1000
@@ -89,8 +96,22 @@ class WebAPIServer:
             if self._has_valid_api_keys(config_path):
                 self.conversation_handler = ConversationHandler(config_path)
                 
-                # 启动后台任务
+                # 预先建立到各模型端点的连接，避免首轮对话承担握手开销
+                await self.conversation_handler.agent_system.client_factory.warmup()
+                
+                # 每个会话从基础处理器派生独立的代理上下文和对话状态
+                self.session_manager = SessionManager(self.conversation_handler)
+                self.session_manager.start()
+                if self.conversation_handler.load_controller is not None:
+                    self.conversation_handler.load_controller.queue_depth_provider = self.session_manager.queued_turns
+                
+                # 启动后台任务，并载入上次关闭时暂存的对话后任务
                 self.conversation_handler.start_background_tasks()
+                self.conversation_handler.post_turn_queue.start()
+                
+                # 主动关怀优先使用预生成的个性化消息
+                proactive_service.message_provider = self.conversation_handler.agent_system.take_proactive_message
+                self.conversation_handler.agent_system.proactive_delivery_attached = True
                 
                 print(f"✅ ConversationHandler初始化成功")
                 print(f"✅ 配置文件: {config_path}")
@@ -130,13 +151,24 @@ class WebAPIServer:
     
     async def cleanup(self):
         """清理资源"""
+        if self.session_manager:
+            await self.session_manager.stop()
+        
         if self.conversation_handler:
-            self.conversation_handler.stop_background_tasks()
+            await self.conversation_handler.stop_background_tasks()
             print("✅ 后台任务已停止")
+            
+            # 在关闭连接池之前处理完对话后任务，未完成的写入暂存文件，下次启动时继续
+            await self.conversation_handler.post_turn_queue.drain()
+            print("✅ 对话后任务队列已关闭")
+            
+            # 关闭共享的HTTP连接池
+            await self.conversation_handler.agent_system.client_factory.aclose()
         
         # 停止WebSocket主动消息服务
         from web_api.websocket_handler import proactive_service
         await proactive_service.stop()
+        await ws_manager.stop()
         print("✅ WebSocket服务已停止")
 
 
@@ -185,6 +217,8 @@ async def websocket_endpoint(websocket: WebSocket):
     # 建立连接
     if not await ws_manager.connect(websocket):
         return
+    # 客户端未指定session_id时，每个连接使用独立的会话
+    connection_session_id = f"ws-{uuid.uuid4().hex[:12]}"
     
     try:
         while True:
@@ -201,7 +235,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 continue
             
             # 处理不同类型的消息
-            await handle_websocket_message(websocket, message)
+            await handle_websocket_message(websocket, message, connection_session_id)
                 
     except WebSocketDisconnect:
         ws_manager.disconnect(websocket)
@@ -211,15 +245,23 @@ async def websocket_endpoint(websocket: WebSocket):
         ws_manager.disconnect(websocket)
 
 
-async def handle_websocket_message(websocket: WebSocket, message: dict):
-    """处理WebSocket消息"""
+async def handle_websocket_message(websocket: WebSocket, message: dict, connection_session_id: str):
+    """处理WebSocket消息，消息未指定session_id时使用连接自身的会话"""
     message_type = message.get("type")
     message_data = message.get("data", "")
     
     try:
-        if message_type == "chat":
-            # 处理聊天消息
-            await handle_chat_message(websocket, message_data)
+        if message_type in ("chat", "chat_stream"):
+            # 处理聊天消息，chat_stream先推送chat_delta片段，最后以chat_response收尾。
+            # 在后台任务中处理，接收循环得以继续读取新消息，新消息可以取代进行中的轮次
+            task = asyncio.create_task(handle_chat_message(
+                websocket, message_data,
+                stream=message_type == "chat_stream",
+                session_id=message.get("session_id") or connection_session_id,
+                pipeline_mode=message.get("pipeline_mode")
+            ))
+            chat_tasks.add(task)
+            task.add_done_callback(chat_tasks.discard)
             
         elif message_type == "ping":
             # 处理心跳检测
@@ -249,8 +291,21 @@ async def handle_websocket_message(websocket: WebSocket, message: dict):
         })
 
 
-async def handle_chat_message(websocket: WebSocket, user_message: str):
-    """处理聊天消息"""
+# 进行中的WebSocket聊天任务，保留引用避免任务被提前回收
+chat_tasks = set()
+
+
+async def handle_chat_message(websocket: WebSocket, user_message: str, stream: bool = False,
+                              session_id: Optional[str] = None, pipeline_mode: Optional[str] = None):
+    """
+    处理聊天消息
+    
+    stream为True时，主对话代理生成的文本以chat_delta帧逐段推送，
+    完整回复、视觉效果指令和最终情感状态在收尾的chat_response帧中发送。
+    session_id决定使用哪个会话的对话状态，消息中未指定时为连接自身的会话；
+    pipeline_mode可选staged（思考与回复两次调用）或fused（单次调用），不传时使用服务端配置。
+    本轮被同一会话的新消息取代时发送chat_cancelled帧，该消息会合并进新消息的回复
+    """
     if not user_message.strip():
         await ws_manager.send_message(websocket, {
             "type": "chat_response",
@@ -268,34 +323,91 @@ async def handle_chat_message(websocket: WebSocket, user_message: str):
     
     if server.conversation_handler:
         try:
-            # 调用AI对话处理器（获取完整响应数据）
-            response_data = await server.conversation_handler.get_response_with_commands(
-                user_message, 
-                enable_timing=True
-            )
+            start_time = time.time()
+            stream_id = str(uuid.uuid4()) if stream else None
+            first_delta_time = None
+            merged_message = user_message
+            
+            async def send_delta(delta: str):
+                nonlocal first_delta_time
+                if first_delta_time is None:
+                    first_delta_time = time.time() - start_time
+                await ws_manager.send_message(websocket, {
+                    "type": "chat_delta",
+                    "data": {
+                        "stream_id": stream_id,
+                        "delta": delta
+                    },
+                    "timestamp": time.time()
+                })
+            
+            async def run_turn(session, message, token):
+                nonlocal merged_message
+                merged_message = message
+                return await session.handler.get_response_with_commands(
+                    message, 
+                    enable_timing=True,
+                    on_delta=send_delta if stream else None,
+                    cancellation_token=token,
+                    pipeline_mode=pipeline_mode
+                )
+            
+            # 在会话内调用AI对话处理器（获取完整响应数据），同一会话的消息按顺序处理
+            session = server.session_manager.get_session(session_id)
+            try:
+                response_data = await server.session_manager.submit_turn(
+                    session_id, user_message, run_turn
+                )
+            except TurnSuperseded:
+                await ws_manager.send_message(websocket, {
+                    "type": "chat_cancelled",
+                    "data": {
+                        "session_id": session.session_id,
+                        "stream_id": stream_id,
+                        "message": user_message,
+                        "reason": "superseded"
+                    },
+                    "timestamp": time.time()
+                })
+                return
             
             # 获取当前情感状态
             emotional_state = server.conversation_handler.get_current_emotional_state()
             
+            response_payload = {
+                "response": response_data.get("response", ""),
+                "emotional_state": emotional_state,
+                "commands": response_data.get("commands", []),
+                "processing_time": time.time() - start_time,
+                "trace_id": response_data.get("trace_id"),
+                "session_id": session.session_id,
+                "pipeline_mode": response_data.get("pipeline_mode"),
+                "profile": response_data.get("profile"),
+                "merged": merged_message != user_message
+            }
+            if stream:
+                # 流式模式的收尾帧：前端应以完整回复覆盖已推送的片段
+                response_payload.update({
+                    "stream_id": stream_id,
+                    "streamed": True,
+                    "first_token_time": first_delta_time
+                })
+            
             # 发送AI回复（使用前端期望的数据格式）
             await ws_manager.send_message(websocket, {
                 "type": "chat_response",
-                "data": {   
-                    "response": response_data.get("response", ""),
-                    "emotional_state": emotional_state,
-                    "commands": response_data.get("commands", []),
-                    "processing_time": None  # 可以添加处理时间统计
-                },
+                "data": response_payload,
                 "timestamp": time.time()
             })
             
             # 记录到聊天历史
             history_item = ChatHistoryItem(
                 id=str(uuid.uuid4()),
-                user_message=user_message,
+                user_message=merged_message,
                 ai_response=response_data.get("response", ""),
                 timestamp=datetime.now(),
-                emotional_state=emotional_state
+                emotional_state=emotional_state,
+                session_id=session.session_id
             )
             
             server.chat_history.append(history_item)
@@ -388,7 +500,8 @@ async def root():
             "chat": "/api/chat",
             "emotional_state": "/api/emotional-state",
             "chat_history": "/api/chat/history",
-            "health": "/api/health"
+            "health": "/api/health",
+            "traces": "/api/traces"
         }
     }
 
@@ -416,11 +529,34 @@ async def chat_endpoint(request: ChatRequest):
     try:
         start_time = time.time()
         
-        # 获取AI回复（包含视觉效果指令）
-        response_data = await server.conversation_handler.get_response_with_commands(
-            request.message, 
-            enable_timing=request.enable_timing
-        )
+        # 在会话内获取AI回复（包含视觉效果指令）
+        session = server.session_manager.get_session(request.session_id)
+        merged_message = request.message
+        
+        async def run_turn(session, message, token):
+            nonlocal merged_message
+            merged_message = message
+            return await session.handler.get_response_with_commands(
+                message, 
+                enable_timing=request.enable_timing,
+                cancellation_token=token,
+                pipeline_mode=request.pipeline_mode
+            )
+        
+        try:
+            response_data = await server.session_manager.submit_turn(
+                request.session_id, request.message, run_turn
+            )
+        except TurnSuperseded:
+            # 本轮被同一会话的新请求取代，消息会合并进新请求的回复
+            raise HTTPException(
+                status_code=409,
+                detail={
+                    "error": "superseded",
+                    "message": "该消息已被同一会话中更新的消息取代，将合并在新消息的回复中",
+                    "session_id": session.session_id
+                }
+            )
         
         processing_time = time.time() - start_time
         
@@ -442,10 +578,11 @@ async def chat_endpoint(request: ChatRequest):
         # 添加到聊天历史
         chat_item = ChatHistoryItem(
             id=chat_id,
-            user_message=request.message,
+            user_message=merged_message,
             ai_response=ai_response,
             timestamp=timestamp,
-            emotional_state=emotional_state
+            emotional_state=emotional_state,
+            session_id=session.session_id
         )
         
         server.chat_history.append(chat_item)
@@ -458,11 +595,17 @@ async def chat_endpoint(request: ChatRequest):
             timestamp=timestamp,
             emotional_state=emotional_state,
             processing_time=processing_time if request.enable_timing else None,
-            commands=commands if commands else None
+            commands=commands if commands else None,
+            trace_id=response_data.get("trace_id"),
+            session_id=session.session_id,
+            pipeline_mode=response_data.get("pipeline_mode"),
+            profile=response_data.get("profile")
         )
         
         return JSONResponse(content=jsonable_encoder(chat_response))
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -609,6 +752,26 @@ async def get_stats():
             "websocket_connections": ws_manager.get_connection_count(),
             "proactive_service_running": proactive_service.is_running,
             "proactive_last_message": proactive_service.last_message_time.isoformat() if hasattr(proactive_service, 'last_message_time') else None,
+            "prompt_tokens": prompt_metrics.snapshot(),
+            "agent_contexts": await server.session_manager.get_context_stats()
+                if server.session_manager else None,
+            "http_pools": server.conversation_handler.agent_system.client_factory.get_pool_stats()
+                if server.conversation_handler else None,
+            "sessions": server.session_manager.get_stats() if server.session_manager else None,
+            "stage_resilience": get_resilience_stats(),
+            "llm_scheduler": llm_scheduler.get_stats(),
+            "post_turn_queue": server.conversation_handler.post_turn_queue.get_stats()
+                if server.conversation_handler else None,
+            "background_tasks": server.conversation_handler.agent_system.background_scheduler.get_stats()
+                if server.conversation_handler else None,
+            "proactive_cache": server.conversation_handler.agent_system.proactive_cache.get_stats()
+                if server.conversation_handler else None,
+            "memory_writes": server.conversation_handler.agent_system.memory_system.get_write_stats()
+                if server.conversation_handler else None,
+            "triage": server.conversation_handler.triage_router.get_stats()
+                if server.conversation_handler and server.conversation_handler.triage_router else None,
+            "load_control": server.conversation_handler.load_controller.get_stats()
+                if server.conversation_handler and server.conversation_handler.load_controller else None,
             "timestamp": datetime.now()
         }
         
@@ -639,6 +802,7 @@ async def get_websocket_status():
                 "last_message_time": proactive_service.last_message_time.isoformat(),
                 "total_messages": len(proactive_service.proactive_messages)
             },
+            "outbound": ws_manager.get_stats(),
             "timestamp": datetime.now()
         }
         
@@ -650,6 +814,31 @@ async def get_websocket_status():
         )
 
 
+@app.get("/api/traces")
+async def get_recent_traces(limit: int = 20, include_spans: bool = False):
+    """
+    获取最近几轮对话的追踪数据，默认只返回各阶段耗时汇总
+    """
+    limit = max(1, min(limit, tracer.max_traces))
+    traces = tracer.get_recent_traces(limit=limit, include_spans=include_spans)
+    return JSONResponse(content=jsonable_encoder({
+        "enabled": tracer.enabled,
+        "count": len(traces),
+        "traces": traces
+    }))
+
+
+@app.get("/api/traces/{trace_id}")
+async def get_trace_detail(trace_id: str):
+    """
+    获取单轮对话的全部span
+    """
+    trace = tracer.get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"未找到追踪记录: {trace_id}")
+    return JSONResponse(content=jsonable_encoder(trace))
+
+
 # ===== 配置管理接口 =====
 
 @app.get("/api/config", response_model=SystemConfig)
@@ -1,29 +1,108 @@
 """
 WebSocket处理器模块
 简化的WebSocket连接管理和消息处理
+
+每个连接有一个有界的发送队列和独立的写协程，发送和广播只把消息放入队列，
+慢速客户端不会拖慢其他连接。队列满时按WS_SLOW_CONSUMER_POLICY处理：
+drop丢弃可丢弃的帧（流式片段、心跳），放不下关键帧时断开连接；disconnect直接断开连接
 """
 
 import json
 import asyncio
+import os
 import time
 import random
+from collections import deque
 from datetime import datetime, timedelta
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import List, Dict, Optional
+from typing import Callable, Deque, List, Dict, Optional, Tuple
 import logging
 
+from emotional_companion.utils.env_utils import get_env_float, get_env_int
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 队列满时可以丢弃的帧类型：流式片段会被收尾的chat_response覆盖，心跳丢失不影响对话。
+# 主动消息不可丢弃：个性化主动消息在发送前已从缓存中取出，丢弃后无法再次发送
+DROPPABLE_FRAME_TYPES = {"chat_delta", "pong"}
+
+
+class _Connection:
+    """一个WebSocket连接的发送队列和写协程"""
+    
+    def __init__(self, websocket: WebSocket, max_queue: int):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        # (是否可丢弃, 已序列化的消息)
+        self.queue: Deque[Tuple[bool, str]] = deque()
+        self.ready = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        self.close_reason: Optional[str] = None
+        self.connected_at = time.time()
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+    
+    def _evict_droppable(self) -> bool:
+        """移除队列中最早的一帧可丢弃消息，为关键帧腾出位置"""
+        for index, (droppable, _) in enumerate(self.queue):
+            if droppable:
+                del self.queue[index]
+                self.dropped += 1
+                return True
+        return False
+    
+    def enqueue(self, text: str, droppable: bool, policy: str) -> bool:
+        """放入发送队列，返回是否入队；队列溢出且需要断开时设置close_reason"""
+        if self.close_reason is not None:
+            return False
+        if len(self.queue) >= self.max_queue:
+            if policy == "disconnect":
+                self.close_reason = "Slow consumer"
+            elif droppable:
+                self.dropped += 1
+                return False
+            elif not self._evict_droppable():
+                self.close_reason = "Slow consumer"
+            if self.close_reason is not None:
+                # 唤醒写协程关闭连接
+                self.ready.set()
+                return False
+        self.queue.append((droppable, text))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.ready.set()
+        return True
+
 
 class SimpleWebSocketManager:
     """简单的WebSocket连接管理器"""
     
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.max_connections = 10  # 最大连接数限制
+    def __init__(self, max_connections: Optional[int] = None, max_queue: Optional[int] = None,
+                 send_timeout: Optional[float] = None, slow_consumer_policy: Optional[str] = None):
+        """
+        Args:
+            max_connections: 最大连接数，为None时读取WS_MAX_CONNECTIONS
+            max_queue: 每个连接发送队列的容量，为None时读取WS_SEND_QUEUE_SIZE
+            send_timeout: 单条消息的发送超时（秒），超时视为连接失效，为None时读取WS_SEND_TIMEOUT
+            slow_consumer_policy: 队列满时的处理方式drop/disconnect，为None时读取WS_SLOW_CONSUMER_POLICY
+        """
+        self.active_connections: Dict[WebSocket, _Connection] = {}
+        self.max_connections = max_connections or get_env_int("WS_MAX_CONNECTIONS", 10)  # 最大连接数限制
+        self.max_queue = max_queue or get_env_int("WS_SEND_QUEUE_SIZE", 256)
+        self.send_timeout = send_timeout or get_env_float("WS_SEND_TIMEOUT", 10.0)
+        policy = (slow_consumer_policy or os.getenv("WS_SLOW_CONSUMER_POLICY", "drop")).strip().lower()
+        if policy not in ("drop", "disconnect"):
+            logger.warning(f"未知的慢速客户端策略 {policy}，使用drop")
+            policy = "drop"
+        self.slow_consumer_policy = policy
         self.message_rate_limit: Dict[str, List[float]] = {}  # 消息频率限制
         
+        self.total_sent = 0
+        self.total_dropped = 0
+        self.slow_disconnects = 0
+        self.send_failures = 0
+        
     async def connect(self, websocket: WebSocket) -> bool:
         """建立WebSocket连接"""
         try:
@@ -34,7 +113,9 @@ class SimpleWebSocketManager:
                 return False
                 
             await websocket.accept()
-            self.active_connections.append(websocket)
+            connection = _Connection(websocket, self.max_queue)
+            connection.writer = asyncio.create_task(self._writer(connection), name="websocket-writer")
+            self.active_connections[websocket] = connection
             logger.info(f"WebSocket连接建立，当前连接数: {len(self.active_connections)}")
             return True
             
@@ -44,34 +125,71 @@ class SimpleWebSocketManager:
     
     def disconnect(self, websocket: WebSocket):
         """断开WebSocket连接"""
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            logger.info(f"WebSocket连接断开，当前连接数: {len(self.active_connections)}")
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        self.total_sent += connection.sent
+        self.total_dropped += connection.dropped
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+        logger.info(f"WebSocket连接断开，当前连接数: {len(self.active_connections)}")
     
-    async def send_message(self, websocket: WebSocket, message: dict) -> bool:
-        """向指定WebSocket发送消息"""
+    async def _writer(self, connection: _Connection):
+        """按顺序发送连接队列中的消息"""
+        websocket = connection.websocket
         try:
-            await websocket.send_text(json.dumps(message, ensure_ascii=False))
-            return True
+            while True:
+                await connection.ready.wait()
+                if connection.close_reason is not None:
+                    self.slow_disconnects += 1
+                    logger.warning(f"WebSocket客户端接收过慢（队列 {len(connection.queue)}/{connection.max_queue}），断开连接")
+                    try:
+                        await asyncio.wait_for(websocket.close(code=1008, reason=connection.close_reason),
+                                               self.send_timeout)
+                    except Exception:
+                        pass
+                    break
+                if not connection.queue:
+                    connection.ready.clear()
+                    continue
+                _, text = connection.queue.popleft()
+                await asyncio.wait_for(websocket.send_text(text), self.send_timeout)
+                connection.sent += 1
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"发送消息失败: {e}")
-            # 如果发送失败，从连接列表中移除
-            self.disconnect(websocket)
+            self.send_failures += 1
+            logger.error(f"发送消息失败: {type(e).__name__} {e}")
+            # 发送失败或超时的连接不再可用，关闭连接使接收循环结束，客户端可以重新连接
+            try:
+                await asyncio.wait_for(websocket.close(code=1011, reason="Send failed"), self.send_timeout)
+            except Exception:
+                pass
+        # 从连接列表中移除
+        self.disconnect(websocket)
+    
+    def _enqueue(self, websocket: WebSocket, text: str, droppable: bool) -> bool:
+        connection = self.active_connections.get(websocket)
+        if connection is None:
             return False
+        return connection.enqueue(text, droppable, self.slow_consumer_policy)
+    
+    async def send_message(self, websocket: WebSocket, message: dict) -> bool:
+        """把消息放入指定WebSocket的发送队列，不等待发送完成"""
+        text = json.dumps(message, ensure_ascii=False)
+        return self._enqueue(websocket, text, message.get("type") in DROPPABLE_FRAME_TYPES)
     
     async def broadcast(self, message: dict) -> int:
-        """向所有连接广播消息"""
+        """向所有连接广播消息：消息只序列化一次并放入各连接的发送队列，返回成功入队的连接数"""
         if not self.active_connections:
             logger.debug("没有活跃连接，跳过广播")
             return 0
             
-        success_count = 0
+        text = json.dumps(message, ensure_ascii=False)
+        droppable = message.get("type") in DROPPABLE_FRAME_TYPES
         # 复制连接列表，避免在迭代过程中修改
-        connections_copy = self.active_connections.copy()
-        
-        for connection in connections_copy:
-            if await self.send_message(connection, message):
-                success_count += 1
+        connections_copy = list(self.active_connections)
+        success_count = sum(1 for connection in connections_copy if self._enqueue(connection, text, droppable))
                 
         logger.info(f"广播消息完成，成功发送到 {success_count}/{len(connections_copy)} 个连接")
         return success_count
@@ -103,6 +221,37 @@ class SimpleWebSocketManager:
     def get_connection_count(self) -> int:
         """获取当前连接数"""
         return len(self.active_connections)
+    
+    def get_stats(self) -> dict:
+        """获取发送队列和慢速客户端统计"""
+        connections = list(self.active_connections.values())
+        return {
+            "max_connections": self.max_connections,
+            "send_queue_size": self.max_queue,
+            "send_timeout": self.send_timeout,
+            "slow_consumer_policy": self.slow_consumer_policy,
+            "sent": self.total_sent + sum(connection.sent for connection in connections),
+            "dropped": self.total_dropped + sum(connection.dropped for connection in connections),
+            "slow_disconnects": self.slow_disconnects,
+            "send_failures": self.send_failures,
+            "connections": [
+                {
+                    "connected_at": connection.connected_at,
+                    "queue_depth": len(connection.queue),
+                    "max_depth": connection.max_depth,
+                    "sent": connection.sent,
+                    "dropped": connection.dropped,
+                }
+                for connection in connections
+            ],
+        }
+    
+    async def stop(self):
+        """停止所有连接的写协程"""
+        writers = [connection.writer for connection in self.active_connections.values() if connection.writer]
+        for writer in writers:
+            writer.cancel()
+        await asyncio.gather(*writers, return_exceptions=True)
 
 
 class ProactiveMessageService:
@@ -114,6 +263,8 @@ class ProactiveMessageService:
         self.last_message_time = datetime.now()
         self.check_interval = 300  # 每5分钟检查一次
         self.idle_threshold = 30  # 30分钟无消息后发送主动关怀
+        # 个性化主动消息的来源（预生成的缓存），返回None时使用预定义消息
+        self.message_provider: Optional[Callable[[], Optional[str]]] = None
         
         # 预定义的主动关怀消息
         self.proactive_messages = [
@@ -168,11 +319,15 @@ class ProactiveMessageService:
     async def _send_proactive_message(self):
         """发送主动关怀消息"""
         try:
-            message = random.choice(self.proactive_messages)
+            message = self.message_provider() if self.message_provider else None
+            personalized = message is not None
+            if not personalized:
+                message = random.choice(self.proactive_messages)
             
             proactive_data = {
                 "type": "proactive_chat",
                 "data": message,
+                "personalized": personalized,
                 "timestamp": time.time()
             }
             